@@ -0,0 +1,88 @@
+'''
+电机并发配置
+
+启动时并发下发所有电机的configure_actuator(限制同时在途的请求数)，失败的电机单独重试；
+同一轮中并发读取电机状态作为零位，启动耗时从逐个配置的N次往返缩短到约一次往返
+eg:
+report = await configure_actuators(kos.actuator, [{'actuator_id': 31, 'kp': 20.0, 'kd': 0.5, 'torque_enabled': True}, ...])
+report.positions    # {actuator_id: 当前位置(度)}
+report.elapsed      # 启动耗时(秒)
+'''
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+
+@dataclass
+class StartupReport:
+    positions: dict[int, float] = field(default_factory=dict)  # 配置时读取的电机位置(度)，用作零位
+    failed: dict[int, str] = field(default_factory=dict)        # 重试后仍失败的电机及最后一次错误
+    retries: int = 0        # 重试总次数
+    elapsed: float = 0.0    # 从开始配置到全部完成(含零位读取)的耗时(秒)
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+
+async def _retry(call, retries: int, retry_delay: float, report: StartupReport):
+    # 依次重试，返回(结果, 错误信息)；错误信息为None表示成功
+    error = None
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            report.retries += 1
+            await asyncio.sleep(retry_delay * attempt)
+        try:
+            result = await call()
+        except Exception as e:
+            # grpc错误只保留状态码和描述
+            error = f'{e.code().name}: {e.details()}' if hasattr(e, 'code') and hasattr(e, 'details') else repr(e)
+            continue
+        if getattr(result, 'success', True) is False:
+            error = getattr(result, 'error', None) or 'success=False'
+            continue
+        return result, None
+    return None, error
+
+
+async def configure_actuators(actuator, configs: list[dict], concurrency: int = 8, retries: int = 2,
+                              retry_delay: float = 0.05, read_positions: bool = True) -> StartupReport:
+    '''
+        并发配置电机
+        actuator: KOS的actuator服务客户端(kos.actuator)
+        configs: 每个电机的configure_actuator参数，必须包含actuator_id
+        concurrency: 同时在途的配置请求数上限，避免一次性压满电机总线
+        retries: 每个电机的最大重试次数(RPC异常或返回success=False)
+        read_positions: 是否在同一轮中读取电机位置
+    '''
+    start = time.monotonic()
+    report = StartupReport()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def configure(config: dict):
+        async with semaphore:
+            _, error = await _retry(lambda: actuator.configure_actuator(**config), retries, retry_delay, report)
+        if error is not None:
+            report.failed[config['actuator_id']] = error
+
+    async def read(ids: list[int]):
+        # 一次批量读取全部位置，缺失的电机再单独补读
+        response, error = await _retry(lambda: actuator.get_actuators_state(ids), retries, retry_delay, report)
+        if response is not None:
+            for state in response.states:
+                report.positions[state.actuator_id] = state.position
+        missing = [actuator_id for actuator_id in ids if actuator_id not in report.positions]
+        for actuator_id in missing:
+            response, error = await _retry(lambda: actuator.get_actuators_state([actuator_id]), retries, retry_delay, report)
+            if response is not None and response.states:
+                report.positions[actuator_id] = response.states[0].position
+            else:
+                report.failed.setdefault(actuator_id, error or 'state missing')
+
+    tasks = [configure(config) for config in configs]
+    if read_positions:
+        tasks.append(read([config['actuator_id'] for config in configs]))
+    await asyncio.gather(*tasks)
+    report.elapsed = time.monotonic() - start
+    return report
@@ -3,17 +3,18 @@
 '''
 本代码包括：
 1.读取麦克风\扬声器
-2.提供测试,录制一段语音并将其播放出来
+2.提供测试,边录边播(流式回环,延迟约为几个块长)
 有关pykos.services.sound提供的类实现 ,请参考:
 https://kscalelabs.github.io/api-docs/pykos/sound.html
 '''
 
 import asyncio
-from io import BytesIO
 
 from pykos import KOS
 from pykos.services.sound import SoundServiceClient, AudioConfig
 
+from audio_stream import AudioStream, Gain
+
 async def main():
     # 1. 连接
     # async with KOS(ip='localhost', port=50051) as kos:# kos-sim端使用本行，将下一行注释
@@ -33,26 +34,11 @@ async def main():
             channels=1
         )
 
-        # 4. 测试
-        print("recording…")
-        audio_buffer = BytesIO()
-        async for chunk in sound_client.record_audio(
-            duration_ms=5000, **config
-        ):
-            audio_buffer.write(chunk)
-        print("recorded,", audio_buffer.tell(), "byte saved")
-        audio_buffer.seek(0)
-        print("playing…")
-        async def audio_iterator():
-            while True:
-                data = audio_buffer.read(4096)
-                if not data:
-                    break
-                yield data
-
-        response = await sound_client.play_audio(
-            audio_iterator(), **config
-        )
+        # 4. 测试：录音按20ms切块，经过增益处理后通过有界队列直接送往扬声器
+        print("streaming…")
+        stream = AudioStream(sound_client, config, chunk_ms=20, stages=[Gain(1.0)])
+        response = await stream.run(duration_ms=5000)
+        print("stats:", stream.stats())
 
         if response.success:
             print("test passed!")
@@ -63,18 +49,14 @@ if __name__ == "__main__":
     asyncio.run(main())
 
 '''
-注:本测试使用回环测试,数据缓存在audio_buffer
-如果你想把音频保存为wav,需要做如下修改：
-
-import wave
+注:本测试使用流式回环测试,内存中只保留队列里的几个块
+如果你想把音频保存为wav,可以用audio_writer.py逐块写入文件,不必先缓存整段录音：
 
-在audio_buffer.seek(0)之后,插入写wav文件的逻辑
+from audio_writer import record_to_file
 
-with wave.open('output_test01.wav', 'wb') as wf:
-    wf.setnchannels(config.channels)
-    wf.setsampwidth(config.bit_depth // 8)
-    wf.setframerate(config.sample_rate)
-    wf.writeframes(audio_buffer.read())
+files = await record_to_file(sound_client, 'output_test01.wav', config, duration_ms=5000)
+# 长时间录音可以按时长轮转: rotate_seconds=60 -> output_test01_0000.wav, output_test01_0001.wav ...
+# 只要PCM数据时用 format='raw'
 
 参考:https://stackoverflow.com/questions/52369925/creating-wav-file-from-bytes
 '''
\ No newline at end of file
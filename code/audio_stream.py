@@ -0,0 +1,237 @@
+'''
+流式全双工音频
+
+麦克风(SoundServiceClient.record_audio)的数据按固定块长切分，经过可插拔的处理阶段(增益、重采样等，NumPy原地运算)后
+放入有界异步队列，扬声器(play_audio)从队列中边取边播；延迟约为 块长 + 队列中的数据量，而不是整段录音的长度，内存占用固定
+队列满时默认阻塞录音流(背压)，也可以选择丢弃最旧的块来限制延迟；
+播放端按块长推算扬声器的消耗进度，某一块晚于扬声器需要它的时间才送到记为一次欠载
+eg:
+async with KOS(ip='192.168.42.1', port=50051) as kos:
+    sound_client = SoundServiceClient(kos._channel)
+    stream = AudioStream(sound_client, AudioConfig(sample_rate=16000, bit_depth=16, channels=1),
+                         chunk_ms=20, stages=[Gain(2.0)])
+    await stream.run(duration_ms=10000)
+    print(stream.stats())
+'''
+
+import asyncio
+import time
+from collections.abc import AsyncIterator, Callable
+
+import numpy as np
+
+from profiler import Histogram
+
+
+SAMPLE_DTYPES = {16: np.int16, 32: np.int32}
+OVERFLOW_POLICIES = ('block', 'drop_oldest')
+
+Stage = Callable[[np.ndarray], np.ndarray]
+
+
+def sample_dtype(bit_depth: int) -> np.dtype:
+    if bit_depth not in SAMPLE_DTYPES:
+        raise ValueError(f'不支持的位深: {bit_depth}，可选 {tuple(SAMPLE_DTYPES)}')
+    return np.dtype(SAMPLE_DTYPES[bit_depth]).newbyteorder('<')
+
+
+class Gain:
+    '''
+        增益处理阶段，原地修改样本并限幅
+    '''
+    def __init__(self, gain: float):
+        self.gain = gain
+        self._work = np.zeros(0, dtype=np.float32)
+
+    def __call__(self, samples: np.ndarray) -> np.ndarray:
+        if self._work.shape != samples.shape:
+            self._work = np.zeros(samples.shape, dtype=np.float32)
+        info = np.iinfo(samples.dtype)
+        np.multiply(samples, self.gain, out=self._work)
+        np.clip(self._work, info.min, info.max, out=self._work)
+        np.copyto(samples, self._work, casting='unsafe')
+        return samples
+
+
+class Resample:
+    '''
+        线性插值重采样处理阶段，按输入块长缓存插值位置和输出缓冲区
+        channels: 交错存放的声道数
+        注意：块与块之间不做相位衔接，适合语音等对音质要求不高的场景
+    '''
+    def __init__(self, src_rate: int, dst_rate: int, channels: int = 1):
+        self.src_rate = src_rate
+        self.dst_rate = dst_rate
+        self.channels = channels
+        self._cache: dict[tuple[int, np.dtype], tuple] = {}
+
+    def _plan(self, frames: int, dtype: np.dtype):
+        plan = self._cache.get((frames, dtype))
+        if plan is None:
+            out_frames = max(1, round(frames * self.dst_rate / self.src_rate))
+            plan = (
+                np.arange(frames, dtype=np.float64),
+                np.linspace(0, frames - 1, out_frames),
+                np.zeros((out_frames, self.channels), dtype=np.float64),
+                np.zeros(out_frames * self.channels, dtype=dtype),
+            )
+            self._cache[(frames, dtype)] = plan
+        return plan
+
+    def __call__(self, samples: np.ndarray) -> np.ndarray:
+        frames = samples.size // self.channels
+        source, positions, work, out = self._plan(frames, samples.dtype)
+        frames_in = samples.reshape(frames, self.channels)
+        for c in range(self.channels):
+            work[:, c] = np.interp(positions, source, frames_in[:, c])
+        np.rint(work, out=work)
+        np.copyto(out, work.reshape(-1), casting='unsafe')
+        return out
+
+
+class AudioStream:
+    '''
+        录音 -> 处理 -> 播放 的流式管线
+        config: 录音参数(AudioConfig)
+        play_config: 播放参数，None时与录音相同(使用Resample时需要设置成重采样后的采样率)
+        chunk_ms: 块长(毫秒)，决定最小延迟和每次处理的样本数
+        queue_chunks: 队列容量(块)
+        prefill_chunks: 播放开始前预先缓冲的块数，用于吸收网络抖动，延迟随之增加(prefill_chunks-1)个块长
+        overflow: 队列满时的处理策略，block: 阻塞录音流(背压)；drop_oldest: 丢弃最旧的块
+        stages: 处理阶段列表，每个阶段接收样本数组(int16/int32，可原地修改)并返回处理后的数组
+    '''
+    def __init__(self, sound_client, config: dict, play_config: dict | None = None, chunk_ms: float = 20,
+                 queue_chunks: int = 8, prefill_chunks: int = 2, overflow: str = 'block', stages: list[Stage] | None = None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'未知的溢出策略: {overflow}，可选 {OVERFLOW_POLICIES}')
+        self.sound_client = sound_client
+        self.config = dict(config)
+        self.play_config = dict(play_config or config)
+        self.dtype = sample_dtype(self.config['bit_depth'])
+        frame_bytes = self.dtype.itemsize * self.config['channels']
+        self.chunk_frames = max(1, round(self.config['sample_rate'] * chunk_ms / 1000))
+        self.chunk_bytes = self.chunk_frames * frame_bytes
+        self.chunk_seconds = self.chunk_frames / self.config['sample_rate']
+        self.queue_chunks = queue_chunks
+        self.prefill_chunks = min(prefill_chunks, queue_chunks)
+        self.overflow = overflow
+        self.stages = list(stages or [])
+        self.queue: asyncio.Queue | None = None
+        self._prefilled: asyncio.Event | None = None
+        # 切块用的暂存缓冲区，处理阶段直接在它的NumPy视图上运算
+        self._staging = bytearray(self.chunk_bytes)
+        self._staging_view = memoryview(self._staging)
+        self._samples = np.frombuffer(self._staging, dtype=self.dtype)
+        self._filled = 0
+        # 统计
+        self.latency = Histogram()      # 块凑满到交给播放的时间(秒)
+        self.process_time = Histogram()     # 每块处理阶段耗时(秒)
+        self.captured = 0       # 录到的块数
+        self.played = 0         # 交给播放的块数
+        self.underruns = 0      # 扬声器断流(数据晚到)的次数
+        self.dropped = 0        # drop_oldest策略下丢弃的块数
+        self.blocked = 0        # block策略下录音被阻塞的次数
+
+    def _process(self) -> bytes:
+        start = time.perf_counter()
+        samples = self._samples
+        for stage in self.stages:
+            samples = stage(samples)
+        data = samples.tobytes()
+        self.process_time.record(time.perf_counter() - start)
+        return data
+
+    async def _put(self, item):
+        queue = self.queue
+        if queue.full():
+            if self.overflow == 'drop_oldest':
+                queue.get_nowait()
+                self.dropped += 1
+            else:
+                self.blocked += 1
+        await queue.put(item)
+        if item is None or queue.qsize() >= self.prefill_chunks:
+            self._prefilled.set()
+
+    async def chunks(self, audio: AsyncIterator[bytes]) -> AsyncIterator[tuple[float, bytes]]:
+        '''
+            把任意长度的音频数据切成固定长度的块并处理，产出(块凑满的时间, 处理后的数据)
+            不足一块的结尾数据会被丢弃
+        '''
+        view = self._staging_view
+        size = self.chunk_bytes
+        async for data in audio:
+            data = memoryview(data)
+            offset = 0
+            while offset < len(data):
+                n = min(size - self._filled, len(data) - offset)
+                view[self._filled:self._filled + n] = data[offset:offset + n]
+                self._filled += n
+                offset += n
+                if self._filled == size:
+                    self._filled = 0
+                    self.captured += 1
+                    yield time.monotonic(), self._process()
+
+    async def capture(self, duration_ms: int = 0):
+        # 录音并切块，放入队列；结束时放入None
+        try:
+            async for item in self.chunks(self.sound_client.record_audio(duration_ms=duration_ms, **self.config)):
+                await self._put(item)
+        finally:
+            # 结束标记不等待队列空位，避免取消时卡住
+            if self.queue.full():
+                self.queue.get_nowait()
+                self.dropped += 1
+            self.queue.put_nowait(None)
+            self._prefilled.set()
+
+    async def playback_chunks(self) -> AsyncIterator[bytes]:
+        # 播放端的数据源，先等待预缓冲，再逐块取出
+        queue = self.queue
+        await self._prefilled.wait()
+        due = None      # 扬声器播完已送出数据的预计时间
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            captured_at, data = item
+            now = time.monotonic()
+            if due is not None and now > due:
+                self.underruns += 1
+                due = None
+            due = (now if due is None else due) + self.chunk_seconds
+            self.latency.record(now - captured_at)
+            self.played += 1
+            yield data
+
+    async def run(self, duration_ms: int = 0):
+        '''
+            同时录音和播放，duration_ms为0时持续运行直到stop()或任务被取消
+            返回play_audio的响应
+        '''
+        self.queue = asyncio.Queue(maxsize=self.queue_chunks)
+        self._prefilled = asyncio.Event()
+        capture = asyncio.create_task(self.capture(duration_ms))
+        try:
+            response = await self.sound_client.play_audio(self.playback_chunks(), **self.play_config)
+        finally:
+            if not capture.done():
+                capture.cancel()
+            await asyncio.gather(capture, return_exceptions=True)
+        return response
+
+    async def stop(self):
+        return await self.sound_client.stop_recording()
+
+    def stats(self) -> dict:
+        return {
+            'chunk_ms': self.chunk_seconds * 1000,
+            'captured': self.captured,
+            'played': self.played,
+            'underruns': self.underruns,
+            'dropped': self.dropped,
+            'blocked': self.blocked,
+            'queue_latency': self.latency.summary(),
+            'process_time': self.process_time.summary(),
+        }
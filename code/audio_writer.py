@@ -0,0 +1,161 @@
+'''
+录音直接写盘
+
+SoundServiceClient.record_audio产出的每一块数据到达后立即写入文件，内存中不保留录音，占用不随时长增长
+- 文件按块预分配并用mmap映射，数据直接拷贝进映射区，写满后扩展下一段
+- wav格式先写入文件头，关闭(或轮转、flush)时回填RIFF和data的长度，raw格式只有PCM数据
+- rotate_seconds: 每个文件的最长时长，超过后自动切换到下一个文件，适合长时间录音
+eg:
+async with KOS(ip='192.168.42.1', port=50051) as kos:
+    sound_client = SoundServiceClient(kos._channel)
+    files = await record_to_file(sound_client, 'mic.wav', AudioConfig(sample_rate=16000, bit_depth=16, channels=1),
+                                 duration_ms=60000, rotate_seconds=10)
+'''
+
+import mmap
+import os
+import struct
+from collections.abc import AsyncIterator
+from pathlib import Path
+
+
+FORMATS = ('wav', 'raw')
+WAV_HEADER_SIZE = 44
+WAV_MAX_DATA = 0xFFFFFFFF - WAV_HEADER_SIZE     # RIFF长度字段为32位
+
+
+def wav_header(sample_rate: int, bit_depth: int, channels: int, data_size: int) -> bytes:
+    block_align = channels * bit_depth // 8
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bit_depth,
+        b'data', data_size,
+    )
+
+
+class AudioWriter:
+    '''
+        流式音频写入器
+        path: 输出文件；轮转时依次写入 <stem>_0000<suffix>、<stem>_0001<suffix> ...
+        format: wav / raw
+        segment_seconds: 每次预分配(扩展)的时长
+        rotate_seconds: 单个文件的最长时长，None时不轮转(wav最大约4GB，超过时也会轮转)
+    '''
+    def __init__(self, path: str | Path, sample_rate: int, bit_depth: int, channels: int, format: str = 'wav',
+                 segment_seconds: float = 10.0, rotate_seconds: float | None = None):
+        if format not in FORMATS:
+            raise ValueError(f'未知的格式: {format}，可选 {FORMATS}')
+        if bit_depth % 8:
+            raise ValueError(f'不支持的位深: {bit_depth}')
+        self.path = Path(path)
+        self.sample_rate = sample_rate
+        self.bit_depth = bit_depth
+        self.channels = channels
+        self.format = format
+        self.frame_bytes = channels * bit_depth // 8
+        self.byte_rate = sample_rate * self.frame_bytes
+        self.header_size = WAV_HEADER_SIZE if format == 'wav' else 0
+        self.segment_bytes = max(1, round(segment_seconds * sample_rate)) * self.frame_bytes
+        # 单个文件的数据长度上限(按帧对齐)，None为不限
+        limits = []
+        if format == 'wav':
+            limits.append(WAV_MAX_DATA - WAV_MAX_DATA % self.frame_bytes)
+        if rotate_seconds is not None:
+            limits.append(max(1, round(rotate_seconds * sample_rate)) * self.frame_bytes)
+        self.file_limit = min(limits) if limits else None
+        self.rotating = rotate_seconds is not None
+        self.files: list[Path] = []
+        self.total_bytes = 0
+        self._fd = -1
+        self._map: mmap.mmap | None = None
+        self._size = 0      # 当前文件已写入的数据长度(不含文件头)
+        self._open()
+
+    def _next_path(self) -> Path:
+        if not self.rotating:
+            return self.path
+        return self.path.with_name(f'{self.path.stem}_{len(self.files):04d}{self.path.suffix}')
+
+    def _open(self):
+        path = self._next_path()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._size = 0
+        self._map = None
+        self._reserve(self.header_size + self.segment_bytes)
+        if self.header_size:
+            self._map[:self.header_size] = wav_header(self.sample_rate, self.bit_depth, self.channels, 0)
+        self.files.append(path)
+
+    def _reserve(self, size: int):
+        # 把文件扩展到size字节并重新映射
+        os.ftruncate(self._fd, size)
+        if self._map is None:
+            self._map = mmap.mmap(self._fd, size)
+        else:
+            self._map.resize(size)
+
+    def _finish(self):
+        # 回填文件头，截掉预分配但未写入的部分
+        end = self.header_size + self._size
+        if self.header_size:
+            self._map[:self.header_size] = wav_header(self.sample_rate, self.bit_depth, self.channels, self._size)
+        self._map.flush()
+        self._map.close()
+        self._map = None
+        os.ftruncate(self._fd, end)
+        os.close(self._fd)
+        self._fd = -1
+
+    def write(self, data):
+        '''
+            写入一块PCM数据(bytes或任意支持缓冲区协议的对象)，跨越轮转边界时自动拆分
+        '''
+        view = memoryview(data).cast('B')
+        while len(view):
+            if self.file_limit is not None and self._size >= self.file_limit:
+                self._finish()
+                self._open()
+            n = len(view) if self.file_limit is None else min(len(view), self.file_limit - self._size)
+            start = self.header_size + self._size
+            if start + n > len(self._map):
+                self._reserve(start + max(n, self.segment_bytes))
+            self._map[start:start + n] = view[:n]
+            self._size += n
+            self.total_bytes += n
+            view = view[n:]
+
+    def flush(self):
+        # 回填当前长度并写回磁盘，进程意外退出时文件仍然可以播放(末尾可能有预分配的静音)
+        if self.header_size:
+            self._map[:self.header_size] = wav_header(self.sample_rate, self.bit_depth, self.channels, self._size)
+        self._map.flush()
+
+    @property
+    def duration(self) -> float:
+        return self.total_bytes / self.byte_rate
+
+    async def consume(self, chunks: AsyncIterator[bytes]):
+        async for chunk in chunks:
+            self.write(chunk)
+
+    def close(self):
+        if self._fd >= 0:
+            self._finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+async def record_to_file(sound_client, path: str | Path, config: dict, duration_ms: int = 0, format: str = 'wav',
+                         rotate_seconds: float | None = None, segment_seconds: float = 10.0) -> list[Path]:
+    '''
+        录音并直接写入文件，返回写入的文件列表；duration_ms为0时持续录音，直到stop_recording或任务被取消
+    '''
+    with AudioWriter(path, config['sample_rate'], config['bit_depth'], config['channels'], format,
+                     segment_seconds, rotate_seconds) as writer:
+        await writer.consume(sound_client.record_audio(duration_ms=duration_ms, **config))
+    return writer.files
@@ -0,0 +1,191 @@
+'''
+控制循环基准测试
+
+在子进程中启动本地KOS替身服务器(fake_kos.py)，用随机权重的合成模型(synthetic_policy.py)分别运行
+BetterKOS.loop、多进程运行时(multiprocess_runtime.py)和pykos_controller.simple_walking，报告实际帧率、整帧/各阶段耗时分位数和CPU占用
+不需要机器人和kos-sim，可在普通Linux机器(CI)上检查控制循环热路径的性能回退
+eg:
+python benchmark_loop.py --seconds 10 --latency 0.002 --jitter 0.0005
+python benchmark_loop.py --controllers better_kos --pipelined --json result.json
+python benchmark_loop.py --command-rate 200     # 命令子步进，报告实际下发频率和增加的RPC数
+python benchmark_loop.py --variant int8         # 先由quantize_policy.py生成量化变体，再用变体运行
+'''
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from better_utils import BetterKOS
+from fake_kos import FakeKOSServer
+from multiprocess_runtime import MultiProcessRuntime
+from policy_session import POLICY_VARIANTS
+from profiler import LoopProfiler
+from quantize_policy import make_variants
+from synthetic_policy import make_obs_policy, make_walking_policy
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'onnx'))
+import pykos_controller  # noqa: E402
+
+
+CONTROLLERS = ('better_kos', 'multiprocess', 'simple_walking')
+
+
+def _serve(port_queue, options: dict):
+    # 子进程入口：服务器的CPU占用不计入被测控制器
+    async def _main():
+        server = FakeKOSServer(**options)
+        port_queue.put(await server.start())
+        await server.server.wait_for_termination()
+    asyncio.run(_main())
+
+
+def start_server(options: dict) -> tuple[multiprocessing.Process, int]:
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(queue, options), daemon=True)
+    process.start()
+    port = queue.get(timeout=10)
+    return process, port
+
+
+async def _bench_better_kos(port: int, model_path: Path, seconds: float, frequency: float, pipelined: bool,
+                            command_rate: float | None, variant: str):
+    async with BetterKOS('127.0.0.1', port) as kos:
+        await kos.load_session(str(model_path), variant=variant)
+        kos.pipelined = pipelined
+        if command_rate is not None:
+            kos.enable_substepping(command_rate, 1 / frequency)
+        try:
+            await asyncio.wait_for(kos.loop(1 / frequency), seconds)
+        except asyncio.TimeoutError:
+            pass
+        stats = kos.scheduler.stats()
+        if kos.command_stepper is not None:
+            stats['command'] = kos.command_stepper.stats()
+        return stats, kos.profiler
+
+
+async def _bench_multiprocess(port: int, model_path: Path, seconds: float, frequency: float, pipelined: bool,
+                              command_rate: float | None, variant: str):
+    # I/O在本进程，推理在子进程；pipelined对它无效(动作等待超时后自动使用上一帧的结果)
+    async with BetterKOS('127.0.0.1', port) as kos:
+        if command_rate is not None:
+            kos.enable_substepping(command_rate, 1 / frequency)
+        runtime = MultiProcessRuntime(model_path, {'variant': variant}, frequency=frequency)
+        await runtime.run(kos, seconds)
+        stats = runtime.scheduler.stats()
+        if kos.command_stepper is not None:
+            stats['command'] = kos.command_stepper.stats()
+        return stats, runtime.profiler
+
+
+async def _bench_simple_walking(port: int, model_path: Path, seconds: float, frequency: float, pipelined: bool,
+                                command_rate: float | None, variant: str):
+    # simple_walking固定50Hz运行，frequency和pipelined对它无效
+    profiler = LoopProfiler()
+    stats = await pykos_controller.simple_walking(model_path, None, '127.0.0.1', port, seconds, profiler, command_rate,
+                                                   variant)
+    return stats, profiler
+
+
+BENCHMARKS = {
+    'better_kos': (_bench_better_kos, make_obs_policy),
+    'multiprocess': (_bench_multiprocess, make_obs_policy),
+    'simple_walking': (_bench_simple_walking, make_walking_policy),
+}
+
+
+def _children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_benchmark(name: str, port: int, workdir: Path, seconds: float, frequency: float = 50, pipelined: bool = False,
+                  command_rate: float | None = None, variant: str = 'fp32') -> dict:
+    '''
+        运行一个控制器的基准测试，返回帧率、耗时分位数(秒)和CPU占用(单核百分比)
+        CPU占用按进程CPU时间/墙钟时间计算，包含推理线程、gRPC线程和已结束的子进程(多进程运行时的推理进程)
+        command_rate: 启用命令子步进时的下发频率，结果的command中为实际下发频率和RPC统计
+        variant: 模型变体(fp32 / int8 / fp16)，非fp32时先由合成模型生成该变体
+    '''
+    bench, make_model = BENCHMARKS[name]
+    model_path = make_model(workdir / f'{name}.onnx')
+    if variant != 'fp32':
+        make_variants(model_path, [variant])
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time() + _children_cpu()
+    stats, profiler = asyncio.run(bench(port, model_path, seconds, frequency, pipelined, command_rate, variant))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() + _children_cpu() - cpu_start
+    summary = profiler.summary()
+    return {
+        'controller': name,
+        'variant': variant,
+        'rate': stats['rate'],
+        'target_rate': 1 / stats['target_period'],
+        'ticks': stats['ticks'],
+        'overruns': stats['overruns'],
+        'jitter_max': stats['jitter_max'],
+        'cpu_percent': 100 * cpu / wall if wall > 0 else 0.0,
+        'stages': summary['stages'],
+        'command': stats.get('command'),
+    }
+
+
+def print_report(result: dict):
+    variant = '' if result['variant'] == 'fp32' else f' ({result["variant"]})'
+    print(f'[Benchmark] {result["controller"]}{variant}: rate={result["rate"]:.1f}/{result["target_rate"]:.0f}Hz '
+          f'ticks={result["ticks"]} overruns={result["overruns"]} jitter_max={result["jitter_max"]*1e3:.3f}ms '
+          f'cpu={result["cpu_percent"]:.1f}%')
+    command = result.get('command')
+    if command:
+        # 不启用子步进时每个策略帧一次command RPC，多出的部分即子步进增加的负载
+        added = command['rpc_rate'] - result['rate']
+        print(f'[Benchmark]   command: rate={command["tick_rate"]:.1f}/{command["frequency"]:.0f}Hz '
+              f'rpc_rate={command["rpc_rate"]:.1f}/s (+{added:.1f}/s) preempted={command["preempted"]} '
+              f'overruns={command["overruns"]} rpc_p99<={command["rpc_time"]["p99"]*1e3:.3f}ms')
+    for stage, s in result['stages'].items():
+        print(f'[Benchmark]   {stage:<12} mean={s["mean"]*1e3:.3f}ms p50<={s["p50"]*1e3:.3f}ms '
+              f'p90<={s["p90"]*1e3:.3f}ms p99<={s["p99"]*1e3:.3f}ms max={s["max"]*1e3:.3f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--controllers', nargs='+', choices=CONTROLLERS, default=list(CONTROLLERS))
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--frequency', type=float, default=50, help='BetterKOS.loop的目标频率(Hz)')
+    parser.add_argument('--pipelined', action='store_true', help='BetterKOS使用流水线模式')
+    parser.add_argument('--command-rate', type=float, default=None, help='命令子步进的下发频率(Hz)')
+    parser.add_argument('--variant', choices=POLICY_VARIANTS, default='fp32', help='模型变体(见quantize_policy.py)')
+    parser.add_argument('--latency', type=float, default=0.001, help='替身服务器每次RPC的附加延迟(秒)')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', type=str, default=None, help='结果写入JSON文件')
+    args = parser.parse_args()
+
+    server, port = start_server({'latency': args.latency, 'jitter': args.jitter,
+                                 'failure_rate': args.failure_rate, 'seed': args.seed})
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for name in args.controllers:
+                result = run_benchmark(name, port, Path(workdir), args.seconds, args.frequency, args.pipelined,
+                                       args.command_rate, args.variant)
+                print_report(result)
+                results.append(result)
+    finally:
+        server.terminate()
+        server.join()
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,9 +10,19 @@ import onnxruntime as ort
 import numpy as np
 import math
 from typing import TypedDict
+from dataclasses import dataclass
 import time
 import asyncio
 
+from rate_scheduler import RateScheduler
+from profiler import LoopProfiler
+from policy_session import InferenceExecutor, load_policy_session
+from telemetry import TelemetryRecorder, record_dtype
+from actuator_setup import StartupReport, configure_actuators
+from policy_layout import ObservationEngine, PolicyLayout, compile_layout, load_layout
+from command_stepper import CommandStepper
+from trajectory import Trajectory, TrajectoryPlayer
+
 
 ACTUATOR_MAPPING = {
     "left_shoulder_yaw": 11,
@@ -36,18 +46,20 @@ ACTUATOR_WITH_WRONG_DIRECTION = [
     # 34, 41, 42, 43, 45
     31, 32, 33, 35, 44
 ]
-MODEL_MAP = (
-                ACTUATOR_MAPPING['right_hip_pitch'],
-                ACTUATOR_MAPPING['left_hip_pitch'],
-                ACTUATOR_MAPPING['right_hip_yaw'],
-                ACTUATOR_MAPPING['left_hip_yaw'],
-                ACTUATOR_MAPPING['right_hip_roll'],
-                ACTUATOR_MAPPING['left_hip_roll'],
-                ACTUATOR_MAPPING['right_knee_pitch'],
-                ACTUATOR_MAPPING['left_knee_pitch'],
-                ACTUATOR_MAPPING['right_ankle_pitch'],
-                ACTUATOR_MAPPING['left_ankle_pitch']
+WRONG_DIRECTION_SET = frozenset(ACTUATOR_WITH_WRONG_DIRECTION)
+MODEL_JOINT_NAMES = (
+                'right_hip_pitch',
+                'left_hip_pitch',
+                'right_hip_yaw',
+                'left_hip_yaw',
+                'right_hip_roll',
+                'left_hip_roll',
+                'right_knee_pitch',
+                'left_knee_pitch',
+                'right_ankle_pitch',
+                'left_ankle_pitch'
             )
+MODEL_MAP = tuple(ACTUATOR_MAPPING[name] for name in MODEL_JOINT_NAMES)
 CONFIG = {
     'actuator_speed': 20,
     'actuator_torque': 0.1
@@ -59,11 +71,90 @@ def transform_position(position:float)->float:
         position = position - 360
     return position
 def transform_position2(position:float)->float:
-    while position < -math.pi:
-        position += 2*math.pi
-    while position > math.pi:
-        position -= 2*math.pi
-    return position
+    return math.remainder(position, 2*math.pi)
+
+def wrap_degrees(position: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
+    # transform_position的向量版本，结果范围(-180, 180]
+    out = np.remainder(position, 360, out=out)
+    np.subtract(out, 360, out=out, where=out > 180)
+    return out
+def wrap_radians(position: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
+    # transform_position2的向量版本，结果范围(-pi, pi]
+    out = np.remainder(position, 2*math.pi, out=out)
+    np.subtract(out, 2*math.pi, out=out, where=out > math.pi)
+    return out
+
+class JointLayout:
+    '''
+        编译好的关节布局，在init()读取零位后构建一次
+        ids: 按策略顺序排列的电机ID
+        signs: 方向(+1/-1)，ACTUATOR_WITH_WRONG_DIRECTION中的电机为-1
+        zero: 零位(度)
+        policy_index: 电机ID到策略下标的查找表(不在布局中的ID为-1)
+        电机状态与策略空间向量(弧度)之间的转换全部以向量运算完成，结果写入预分配的缓冲区
+    '''
+    def __init__(self, ids, wrong_direction, source_positions: dict):
+        self.ids = np.array(ids, dtype=np.int64)
+        self.id_list = [int(i) for i in ids]
+        self.size = len(self.id_list)
+        self.signs = np.array([-1.0 if i in wrong_direction else 1.0 for i in self.id_list])
+        self.zero = np.array([source_positions[i] for i in self.id_list], dtype=np.float64)
+        self.policy_index = np.full(int(self.ids.max()) + 1, -1, dtype=np.int64)
+        self.policy_index[self.ids] = np.arange(self.size)
+        self.raw_pos = np.zeros(self.size)
+        self.raw_vel = np.zeros(self.size)
+        self.dof_pos = np.zeros(self.size)
+        self.dof_vel = np.zeros(self.size)
+        self.work = np.zeros(self.size)    # 临时缓冲区
+    def load_states(self, states) -> np.ndarray:
+        # 把电机状态(任意顺序)按策略顺序写入raw_pos/raw_vel(度)，返回本次包含的策略下标
+        n = len(states)
+        ids = np.fromiter((state.actuator_id for state in states), dtype=np.int64, count=n)
+        order = self.policy_index[ids]
+        self.raw_pos[order] = np.fromiter((state.position for state in states), dtype=np.float64, count=n)
+        self.raw_vel[order] = np.fromiter((state.velocity for state in states), dtype=np.float64, count=n)
+        return order
+    def from_states(self, states) -> tuple[np.ndarray, np.ndarray]:
+        '''
+            电机状态 -> 策略空间的关节位置和速度(弧度)
+            返回的数组为内部缓冲区，下一次调用时会被覆盖
+        '''
+        self.load_states(states)
+        return self.from_raw()
+    def from_raw(self, raw_pos: np.ndarray | None = None, raw_vel: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        # 策略顺序的电机原始位置、速度(度) -> 策略空间的关节位置和速度(弧度)，省略时使用raw_pos/raw_vel缓冲区
+        if raw_pos is not None:
+            self.raw_pos[:] = raw_pos
+        if raw_vel is not None:
+            self.raw_vel[:] = raw_vel
+        self.joint_degrees(self.raw_pos, self.dof_pos)
+        np.multiply(self.dof_pos, math.pi/180, out=self.dof_pos)
+        np.multiply(self.raw_vel, self.signs, out=self.dof_vel)
+        np.multiply(self.dof_vel, math.pi/180, out=self.dof_vel)
+        return self.dof_pos, self.dof_vel
+    def joint_degrees(self, raw_pos: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
+        # 电机原始位置 -> 策略空间的关节位置(度，已减零位、回绕并修正方向)
+        out = wrap_degrees(np.subtract(raw_pos, self.zero, out=out), out=out)
+        return np.multiply(out, self.signs, out=out)
+    def to_raw(self, positions: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
+        # 策略空间的关节位置(度) -> 电机原始位置(度)
+        out = np.multiply(positions, self.signs, out=out)
+        np.add(out, self.zero, out=out)
+        return wrap_degrees(out, out=out)
+
+@dataclass
+class SensorSnapshot:
+    '''
+        一帧的传感器快照，由BetterKOS.read_sensors并发采集
+        timestamp: 全部读数返回时的单调时钟时间(time.monotonic)
+        euler_angles: IMU欧拉角(度)
+        imu_values: IMU原始值(陀螺仪为度/秒)
+        actuator_states: 按MODEL_MAP顺序请求的电机状态列表
+    '''
+    timestamp: float
+    euler_angles: object
+    imu_values: object
+    actuator_states: list
 
 class BetterKOS(KOS):
     '''
@@ -80,48 +171,135 @@ class BetterKOS(KOS):
     phase: float = 0         # 步调相位/2pi
     walk_speed: float = 1/0.4    # 步态速度 1.0=2pi/s
     move_commands = np.array([0.1, 0.0, 0.0], dtype=np.float32)  # 移动控制[x, y, z]
+    state_max_age: float = 0.05     # command_actuators可复用的状态快照最长寿命(秒)
     session: ort.InferenceSession
+    executor: InferenceExecutor | None = None
+    pipelined: bool = False     # 流水线模式：本帧推理与下一帧的传感器读取重叠，动作延后一帧下发
+    debug: 'DebugPrinter | None' = None    # 推理调试输出，默认关闭
+    telemetry: TelemetryRecorder | None = None  # 遥测记录，每帧一条(观测、动作、电机状态、IMU)，用start_telemetry按当前布局创建
+    setup_concurrency: int = 8      # init时同时在途的电机配置请求数
+    setup_retries: int = 2          # init时每个电机的最大重试次数
+    startup: StartupReport | None = None    # 最近一次init的结果(零位、失败电机、耗时)
+    command_stepper: CommandStepper | None = None   # 命令子步进器，启用后策略目标由它插值并高频下发，见enable_substepping
+    trajectory_rate: float = 100    # reset_smooth/move_to/play_keyframes轨迹的下发频率(Hz)
+    trajectory_player: TrajectoryPlayer | None = None   # 最近一次播放轨迹的播放器，cancel_trajectory()通过它停止
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.source_positions = {}      # 每个实例独立记录零位(多机器人时不能共用类属性)
+        self.policy_layout = compile_layout(observation_layout_spec())  # 策略输入输出布局，load_session时可替换
+        self.obs_builder = ObservationBuilder(layout=self.policy_layout)
+        self.action_output: str | int = self.policy_layout.action_output
+        self.profiler = LoopProfiler()     # 分段耗时统计，kos.profiler.dump()查看
+        self._pending = None    # 流水线模式下尚未取回的推理(future, 对应的传感器快照)
+        self._trajectory_layouts = {}   # 电机ID元组 -> JointLayout，轨迹的关节空间与电机原始位置之间的转换
     async def reset(self):
-        cmds = []
-        for actuator_id in ACTUATOR_MAPPING.values():
-            cmds.append([{
-                'actuator_id': actuator_id,
-                'position': 0
-            }])
-        await self.command_actuators(cmds)
+        # 所有电机回到零位：一次批量下发，速度为带方向的actuator_speed，不等待到位
+        await self.command_actuators([{
+            'actuator_id': actuator_id,
+            'position': 0
+        } for actuator_id in ACTUATOR_MAPPING.values()])
+    async def reset_smooth(self, duration: float | None = None, speed: float = CONFIG['actuator_speed'], on_progress=None) -> dict:
+        # 所有电机沿平滑轨迹回到零位，播放完才返回；duration为None时按speed(度/秒)计算时长，见move_to
+        return await self.move_to({actuator_id: 0.0 for actuator_id in ACTUATOR_MAPPING.values()}, duration, speed, on_progress)
     async def init(self):
-        # 初始化电机
-        print('正在配置电机...')
-        for actuator_id in ACTUATOR_MAPPING.values():
-            await self.actuator.configure_actuator(
-                actuator_id=actuator_id,
-                torque_enabled=True,
-                kp=20.0,
-                kd=0.5
-            )
-        print('正在初始化电机位置，请注意，当前电机位置会被设置为0')
-        states = await self.actuator.get_actuators_state(list(ACTUATOR_MAPPING.values()))
-        for state in states.states:
-            print(state)
-            self.source_positions[state.actuator_id] = state.position
-        print('电机位置初始化完成')
+        # 初始化电机：并发配置所有电机，同一轮中读取当前位置作为零位
+        print('正在配置电机，请注意，当前电机位置会被设置为0')
+        report = await configure_actuators(self.actuator, [{
+            'actuator_id': actuator_id,
+            'torque_enabled': True,
+            'kp': 20.0,
+            'kd': 0.5
+        } for actuator_id in ACTUATOR_MAPPING.values()], self.setup_concurrency, self.setup_retries)
+        self.startup = report
+        if not report.ok:
+            raise RuntimeError(f'电机配置失败: {report.failed}')
+        self.source_positions.update(report.positions)
+        self._build_joint_layout()
+        print(f'电机初始化完成，共{len(report.positions)}个，耗时{report.elapsed*1000:.1f}ms，重试{report.retries}次')
     async def move(self, actuator_id, position, speed=10):
+        # 保持原来的语义：position为相对零位的电机原始方向(不修正方向)，一次下发，speed作为速度上限交给电机，不等待到位
+        # 需要平滑轨迹、方向修正或等待到位时使用move_to
         return await self.actuator.command_actuators([{
             'actuator_id': actuator_id,
             'position': transform_position(position + self.source_positions[actuator_id]),
             'velocity': speed
         }])
-    async def command_actuators(self, commands:list[ActuatorCommand]):
-        k = 1 if commands[0]['actuator_id'] not in ACTUATOR_WITH_WRONG_DIRECTION else -1
+
+    async def current_pose(self, ids) -> np.ndarray:
+        # 读取一次电机状态，返回关节空间位置(度，已减零位、回绕并修正方向)，顺序与ids一致
+        layout = self._trajectory_layout(ids)
+        response = await self.actuator.get_actuators_state(layout.id_list)
+        layout.load_states(response.states)
+        return layout.joint_degrees(layout.raw_pos).copy()
+
+    def _trajectory_layout(self, ids) -> 'JointLayout':
+        key = tuple(int(i) for i in ids)
+        layout = self._trajectory_layouts.get(key)
+        if layout is None:
+            missing = [i for i in key if i not in self.source_positions]
+            if missing:
+                raise RuntimeError(f'电机{missing}没有零位，请先init')
+            layout = self._trajectory_layouts[key] = JointLayout(key, WRONG_DIRECTION_SET, self.source_positions)
+        return layout
+
+    async def play_trajectory(self, trajectory: Trajectory, on_progress=None, torque: float = CONFIG['actuator_torque']) -> dict:
+        '''
+            播放关节空间的轨迹，每个周期一次批量command_actuators，同时下发轨迹速度作为前馈
+            on_progress(done, total): 每个周期调用一次；kos.cancel_trajectory()或取消任务可中途停止
+            返回TrajectoryPlayer.play的结果
+        '''
+        layout = self._trajectory_layout(trajectory.ids)
+        self.trajectory_player = player = TrajectoryPlayer(self.actuator, layout.id_list, fields={'torque': torque})
+        return await player.play(trajectory.raw_positions(layout.signs, layout.zero), trajectory.rate,
+                                 trajectory.raw_velocities(layout.signs), on_progress)
+
+    async def play_keyframes(self, keyframes, ids=None, profile: str = 'min_jerk', on_progress=None) -> dict:
+        '''
+            从当前姿态依次经过各关键帧
+            keyframes: [(时长(秒), {电机ID: 位置(度)} 或与ids同序的位置序列)]
+            ids: 参与的电机，None时为关键帧字典中出现过的全部电机
+            eg: await kos.play_keyframes([(1.0, {31: 20, 34: -40}), (0.5, {31: 0, 34: 0})])
+        '''
+        if ids is None:
+            if not all(isinstance(pose, dict) for _, pose in keyframes):
+                raise ValueError('关键帧不是{电机ID: 位置}字典时需要指定ids')
+            ids = list(dict.fromkeys(int(i) for _, pose in keyframes for i in pose))
+        start = await self.current_pose(ids)
+        trajectory = Trajectory.plan(ids, start, keyframes, self.trajectory_rate, profile)
+        return await self.play_trajectory(trajectory, on_progress)
+
+    async def move_to(self, pose: dict, duration: float | None = None, speed: float = CONFIG['actuator_speed'], on_progress=None) -> dict:
+        '''
+            多个电机同时平滑移动到pose({电机ID: 位置(度)})，同时到达
+            duration为None时按speed(度/秒)计算，使移动最远的关节峰值速度不超过speed
+        '''
+        ids = list(pose)
+        start = await self.current_pose(ids)
+        trajectory = Trajectory.move_to(ids, start, [pose[i] for i in ids], duration, speed, self.trajectory_rate)
+        return await self.play_trajectory(trajectory, on_progress)
+
+    def cancel_trajectory(self):
+        # 在下一个周期停止正在播放的轨迹
+        if self.trajectory_player is not None:
+            self.trajectory_player.cancel()
+    async def command_actuators(self, commands:list[ActuatorCommand], snapshot: SensorSnapshot | None = None):
+        # snapshot: 调用方已持有的传感器快照，足够新(不超过state_max_age秒)时直接用于判断速度方向，省去一次状态读取
         ids = [i['actuator_id'] for i in commands]
-        states = await self.actuator.get_actuators_state(ids)
+        states = {}
+        if snapshot is not None and time.monotonic() - snapshot.timestamp <= self.state_max_age:
+            states = {state.actuator_id: state for state in snapshot.actuator_states}
+        missing = [actuator_id for actuator_id in ids if actuator_id not in states]
+        if missing:
+            response = await self.actuator.get_actuators_state(missing)
+            for state in response.states:
+                states[state.actuator_id] = state
         cmds = []
-        for state in states.states:
-            k = 1 if state.actuator_id not in ACTUATOR_WITH_WRONG_DIRECTION else -1
+        for command in commands:
+            state = states.get(command['actuator_id'])
+            if state is None:
+                continue
+            k = -1 if state.actuator_id in WRONG_DIRECTION_SET else 1
             now_pos = transform_position(state.position-self.source_positions[state.actuator_id])*k
-            command = commands[ids.index(state.actuator_id)]
             direction = 1 if command['position'] > now_pos else -1
             cmds.append({
                 'actuator_id': state.actuator_id,
@@ -134,73 +312,236 @@ class BetterKOS(KOS):
         await super().__aenter__()
         await self.init()
         return self
+    async def __aexit__(self, *args):
+        if self.executor is not None:
+            self.executor.close()
+        await super().__aexit__(*args)
     
-    async def load_session(self, session_path:str):
-        self.session = ort.InferenceSession(session_path)
+    def _build_joint_layout(self):
+        self._trajectory_layouts.clear()    # 零位变化后重新构建
+        layout = self.policy_layout
+        wrong_direction = {joint.actuator_id for joint in layout.joints if joint.sign < 0}
+        self.layout = JointLayout(layout.ids, wrong_direction, self.source_positions)
+
+    def set_policy_layout(self, layout: 'PolicyLayout | str'):
+        # layout: 编译好的布局，或包含policy段的配置文件路径
+        if self.telemetry is not None:
+            raise RuntimeError('遥测记录的长度由策略布局决定，请先关闭kos.telemetry再更换布局')
+        if not isinstance(layout, PolicyLayout):
+            layout = load_layout(layout)
+        self.policy_layout = layout
+        self.obs_builder = ObservationBuilder(layout=layout)
+        self.action_output = layout.action_output
+        self.last_actions = np.zeros(len(layout.joints))
+        if self.source_positions:
+            self._build_joint_layout()
+
+    async def load_session(self, session_path:str, options: dict | None = None, layout: 'PolicyLayout | str | None' = None,
+                           variant: str | None = None):
+        # options: 会话配置(图优化级别、线程数、模型缓存、预热次数、模型变体)，见policy_session.SESSION_OPTIONS
+        # layout: 策略的输入输出布局，None时使用model_100.onnx的默认布局
+        # variant: 模型变体(fp32 / int8 / fp16，见quantize_policy.py)，覆盖options中的variant
+        if layout is not None:
+            self.set_policy_layout(layout)
+        if variant is not None:
+            options = {**(options or {}), 'variant': variant}
+        self.session = await load_policy_session(session_path, options)
+        self.executor = InferenceExecutor(self.session)
+        if isinstance(self.action_output, int):
+            self.action_output = self.session.get_outputs()[self.action_output].name
         print('ONNX模型加载成功')
 
-    async def update(self):
+    async def read_sensors(self) -> SensorSnapshot:
+        # 并发读取策略需要的传感器数据(欧拉角、IMU、腿部电机状态)，一帧只付出约一次往返延迟
+        euler_angles, imu_values, states = await asyncio.gather(
+            self.imu.get_euler_angles(),
+            self.imu.get_imu_values(),
+            self.actuator.get_actuators_state(self.layout.id_list),
+        )
+        return SensorSnapshot(time.monotonic(), euler_angles, imu_values, list(states.states))
+
+    def advance_phase(self, dt: float | None = None):
+        # 推进步态相位，dt为None时按单调时钟的实际间隔推进
+        if dt is None:
+            current_time_second = time.monotonic()
+            dt = current_time_second - self.last_time_second if self.last_time_second > 0 else 0.0
+            self.last_time_second = current_time_second
+        self.phase = (self.phase + self.walk_speed * dt) % (2*math.pi)
+
+    async def update(self, dt: float | None = None):
         # 帧更新
+        # dt: 固定步长(秒)，由调度器给出；为None时按单调时钟的实际间隔推进相位
+        profiler = self.profiler
+        profiler.start_tick()
         # 调整步态
-        current_time_second = time.time()
-        if self.last_time_second > 0:
-            dt = current_time_second - self.last_time_second
-            self.phase += self.walk_speed * dt
-            if self.phase > 2*math.pi:
-                self.phase -= 2*math.pi
-        self.last_time_second = current_time_second
+        self.advance_phase(dt)
+        if self.pipelined:
+            await self._update_pipelined(profiler)
+            profiler.tick()
+            return
         # 获取传感器数据
-        imu_euler_angles = await self.imu.get_euler_angles()
-        imu_data = await self.imu.get_imu_values()
-        imu_advanced_data = await self.imu.get_imu_advanced_values()
-        # base_ang_vel = [imu_data.gyro_x/180*math.pi, imu_data.gyro_y/180*math.pi, imu_data.gyro_z/180*math.pi]
-        # base_euler = [imu_euler_angles.roll/180*math.pi, imu_euler_angles.pitch/180*math.pi, imu_euler_angles.yaw/180*math.pi]
-        base_ang_vel = [-imu_data.gyro_z/180*math.pi, -imu_data.gyro_x/180*math.pi, imu_data.gyro_y/180*math.pi]
-        base_euler = [-imu_euler_angles.yaw/180*math.pi, -imu_euler_angles.roll/180*math.pi, imu_euler_angles.pitch/180*math.pi]
-        # 获取关节位置和速度
-        states = await self.actuator.get_actuators_state([
-            ACTUATOR_MAPPING['right_hip_pitch'],
-            ACTUATOR_MAPPING['left_hip_pitch'],
-            ACTUATOR_MAPPING['right_hip_yaw'],
-            ACTUATOR_MAPPING['left_hip_yaw'],
-            ACTUATOR_MAPPING['right_hip_roll'],
-            ACTUATOR_MAPPING['left_hip_roll'],
-            ACTUATOR_MAPPING['right_knee_pitch'],
-            ACTUATOR_MAPPING['left_knee_pitch'],
-            ACTUATOR_MAPPING['right_ankle_pitch'],
-            ACTUATOR_MAPPING['left_ankle_pitch']
-        ])
-        dof_pos = np.zeros(10)
-        dof_vel = np.zeros(10)
-        for state in states.states:
-            k = 1 if state.actuator_id not in ACTUATOR_WITH_WRONG_DIRECTION else -1
-            dof_pos[MODEL_MAP.index(state.actuator_id)] = k*transform_position(state.position - self.source_positions[state.actuator_id])/180*math.pi
-            dof_vel[MODEL_MAP.index(state.actuator_id)] = k*state.velocity/180*math.pi
+        with profiler.stage('sensors'):
+            snapshot = await self.read_sensors()
+        with profiler.stage('obs'):
+            dof_pos, dof_vel = self.layout.from_states(snapshot.actuator_states)
+            self.build_observation(snapshot, dof_pos, dof_vel)
         # 推理
-        next_actions = onnx_inference(self.session, self.phase, self.move_commands, {
-            'ang_vel': 1.0,
-            'dof_pos': 1.0,
-            'dof_vel': 0.05,
-            'lin_vel': 2.0,
-            'quat': 1.0
-        }, dof_pos, dof_vel, self.last_actions, base_ang_vel, base_euler, np.zeros(10))
-        for i in range(len(next_actions)):
-            next_actions[i] = transform_position2(next_actions[i])
-        # 叠加增量
-        self.last_actions = next_actions
+        dump = self.debug is not None and self.debug.ready()
+        if dump:
+            print('[Inference Input]', self.obs_builder.obs)
+        with profiler.stage('inference'):
+            outputs = await self.executor.run(self.obs_builder.feeds, [self.action_output])
+        if dump:
+            print('[Inference Output]', outputs[0][0])
+        with profiler.stage('post'):
+            targets = self.actions_to_targets(outputs[0][0], dof_pos)
         # 移动电机
-        await self.command_actuators([{
-            'actuator_id': MODEL_MAP[i],
-            'position': (dof_pos[i] + next_actions[i])*180/math.pi,
-            'velocity': CONFIG['actuator_speed']
-        # } for i in range(10) if MODEL_MAP[i] in (33, 43)])
-        } for i in range(10)])
-    
-    async def loop(self, delta_time:float=0.02):
-        # 命令循环
-        while True:
-            await self.update()
-            await asyncio.sleep(delta_time)
+        with profiler.stage('command'):
+            await self.command_positions(targets, snapshot)
+        profiler.record('action_age', time.monotonic() - snapshot.timestamp)
+        if self.telemetry is not None:
+            self.record_telemetry(snapshot, self.last_actions)
+        profiler.tick()
+
+    async def _update_pipelined(self, profiler: LoopProfiler):
+        # 流水线帧更新：读取本帧传感器的同时等待上一帧提交的推理，推理结果叠加在本帧关节位置上下发
+        # 动作对应的观测比非流水线模式多一帧延迟，记录在profiler的action_age中
+        with profiler.stage('sensors'):
+            if self._pending is None:
+                snapshot = await self.read_sensors()
+                outputs = None
+            else:
+                future, previous = self._pending
+                snapshot, outputs = await asyncio.gather(self.read_sensors(), future)
+        dof_pos, dof_vel = self.layout.from_states(snapshot.actuator_states)
+        targets = None
+        with profiler.stage('post'):
+            if outputs is not None:
+                targets = self.actions_to_targets(outputs[0][0], dof_pos)
+        if outputs is not None and self.telemetry is not None:
+            # 观测缓冲区此时仍是上一帧的观测，与这次取回的动作对应
+            self.record_telemetry(previous, self.last_actions)
+        with profiler.stage('obs'):
+            self.build_observation(snapshot, dof_pos, dof_vel)
+        if self.debug is not None and self.debug.ready():
+            print('[Inference Input]', self.obs_builder.obs)
+            if outputs is not None:
+                print('[Inference Output]', outputs[0][0])
+        self._pending = (self.executor.submit(self.obs_builder.feeds, [self.action_output]), snapshot)
+        if targets is not None:
+            with profiler.stage('command'):
+                await self.command_positions(targets, snapshot)
+            profiler.record('action_age', time.monotonic() - previous.timestamp)
+
+    def build_observation(self, snapshot: SensorSnapshot, dof_pos: np.ndarray, dof_vel: np.ndarray):
+        # 把传感器快照和策略空间的关节状态写入信号，按布局构建观测向量(写入obs_builder)
+        signals = self.obs_builder.signals
+        gait = signals['gait']
+        gait[0] = math.sin(2*math.pi*self.phase)
+        gait[1] = math.cos(2*math.pi*self.phase)
+        signals['command'][:] = self.move_commands
+        signals['dof_pos'][:] = dof_pos
+        signals['dof_vel'][:] = dof_vel
+        prev_actions = signals['prev_actions']
+        prev_actions[:] = self.last_actions[:len(prev_actions)]
+        # IMU读数为度、度/秒，坐标轴映射由布局完成
+        imu_data = snapshot.imu_values
+        imu_euler_angles = snapshot.euler_angles
+        signals['ang_vel'][:] = (imu_data.gyro_x, imu_data.gyro_y, imu_data.gyro_z)
+        signals['euler'][:] = (imu_euler_angles.roll, imu_euler_angles.pitch, imu_euler_angles.yaw)
+        signals['ang_vel'] *= math.pi/180
+        signals['euler'] *= math.pi/180
+        self.obs_builder.compute()
+
+    def actions_to_targets(self, next_actions: np.ndarray, dof_pos: np.ndarray) -> np.ndarray:
+        # 按布局解码动作(回绕、缩放、叠加在当前或默认位置上)，返回策略空间的目标位置(度)
+        targets = self.obs_builder.decode(next_actions, dof_pos)
+        self.last_actions = next_actions
+        return targets
+
+    def start_telemetry(self, path: str, **options) -> TelemetryRecorder:
+        '''
+            创建遥测记录器并赋给kos.telemetry，记录长度取自当前的策略布局(观测)、模型的动作输出和电机布局
+            需要先load_session；options传给TelemetryRecorder(capacity、flush_interval)
+        '''
+        if self.executor is None:
+            raise RuntimeError('需要先load_session')
+        output = next(o for o in self.session.get_outputs() if o.name == self.action_output)
+        action_size = output.shape[-1]
+        if not isinstance(action_size, int):
+            raise ValueError(f'动作输出{output.name}的长度不固定: {output.shape}')
+        dtype = record_dtype(self.obs_builder.obs.size, action_size, self.layout.size)
+        self.telemetry = TelemetryRecorder(path, dtype, **options)
+        return self.telemetry
+
+    def record_telemetry(self, snapshot: SensorSnapshot, actions: np.ndarray):
+        layout = self.layout
+        layout.load_states(snapshot.actuator_states)
+        imu = snapshot.imu_values
+        euler = snapshot.euler_angles
+        self.telemetry.record(snapshot.timestamp, self.obs_builder.obs, actions, layout.raw_pos, layout.raw_vel,
+                              (imu.gyro_x, imu.gyro_y, imu.gyro_z, euler.roll, euler.pitch, euler.yaw))
+
+    async def position_commands(self, positions: np.ndarray, snapshot: SensorSnapshot | None = None, velocity: float = CONFIG['actuator_speed']) -> tuple[np.ndarray, np.ndarray]:
+        '''
+            策略顺序的目标位置(度) -> (电机原始位置, 带方向的速度)，按策略顺序(MODEL_MAP)排列
+            snapshot足够新时用它判断速度方向，否则读取一次电机状态
+        '''
+        layout = self.layout
+        if snapshot is not None and time.monotonic() - snapshot.timestamp <= self.state_max_age:
+            states = snapshot.actuator_states
+        else:
+            states = (await self.actuator.get_actuators_state(layout.id_list)).states
+        layout.load_states(states)
+        now_pos = layout.joint_degrees(layout.raw_pos, layout.work)
+        velocities = np.where(positions > now_pos, velocity, -velocity) * layout.signs
+        return layout.to_raw(positions, layout.work), velocities
+
+    async def command_positions(self, positions: np.ndarray, snapshot: SensorSnapshot | None = None, velocity: float = CONFIG['actuator_speed'], torque: float = CONFIG['actuator_torque']):
+        '''
+            按策略顺序(MODEL_MAP)下发一组目标位置(度)，command_actuators的向量版本
+            启用了命令子步进器时只更新它的插值目标，由它的任务下发
+        '''
+        raw, velocities = await self.position_commands(positions, snapshot, velocity)
+        if self.command_stepper is not None:
+            self.command_stepper.set_target(raw, velocities)
+            return None
+        return await self.actuator.command_actuators([{
+            'actuator_id': actuator_id,
+            'position': position,
+            'velocity': speed,
+            'torque': torque
+        } for actuator_id, position, speed in zip(self.layout.id_list, raw.tolist(), velocities.tolist())])
+
+    def enable_substepping(self, frequency: float = 200, policy_period: float | None = None, torque: float = CONFIG['actuator_torque']) -> CommandStepper:
+        '''
+            启用命令子步进：策略帧之间以frequency(Hz)插值并批量下发，loop()运行期间自动启停
+            policy_period: 插值时长(秒)，None时使用策略帧的实测间隔
+        '''
+        self.command_stepper = CommandStepper(self.actuator, self.layout.id_list, frequency, policy_period, fields={'torque': torque})
+        return self.command_stepper
+
+    async def loop(self, delta_time:float=0.02, overrun:str='skip'):
+        # 命令循环，按固定频率执行update，超时策略见RateScheduler
+        self.scheduler = RateScheduler(1/delta_time, overrun)
+        overruns = 0
+        stepper = self.command_stepper
+        if stepper is not None:
+            stepper.start()
+        try:
+            async for dt in self.scheduler:
+                self.profiler.miss(self.scheduler.overruns - overruns)
+                overruns = self.scheduler.overruns
+                await self.update(dt)
+        finally:
+            if stepper is not None:
+                await stepper.stop()
+            if self._pending is not None:
+                # 流水线模式下还有一帧推理在途：等它写完后丢弃，重新启动的循环不会下发旧快照算出的动作
+                future, _ = self._pending
+                self._pending = None
+                await self.executor.drain()
+                await asyncio.gather(future, return_exceptions=True)
     
 
 
@@ -216,7 +557,105 @@ class OBS_Scales(TypedDict):
     quat: float
 
 
-def onnx_inference(session:ort.InferenceSession, phase:float, commands:np.ndarray, obs_scales: OBS_Scales, dof_pos: np.ndarray, dof_vel: np.ndarray, actions: np.ndarray, base_ang_vel: np.ndarray, base_euler: np.ndarray, default_dof_pos: np.ndarray):
+OBS_SCALES: OBS_Scales = {
+    'ang_vel': 1.0,
+    'dof_pos': 1.0,
+    'dof_vel': 0.05,
+    'lin_vel': 2.0,
+    'quat': 1.0
+}
+OBS_SIZE = 45   # 观测向量长度(含4维保留位)
+
+
+def observation_layout_spec(obs_scales: OBS_Scales = OBS_SCALES, default_dof_pos=None, imu_remap: bool = True) -> dict:
+    '''
+        model_100.onnx的布局配置(格式见policy_layout.py)，观测布局：
+            0-1     步态周期的正弦/余弦值
+            2-4     步态指令 [X方向线速度，Y方向线速度，Yaw方向角速度]
+            5-14    关节位置 (dof_pos - default_dof_pos)
+            15-24   关节速度
+            25-34   上一步动作
+            35-37   角速度
+            38-40   姿态欧拉角
+            41-44   RESERVED
+        imu_remap: 角速度和欧拉角是否从IMU坐标系映射到训练坐标系([-z, -x, y])，为False时按[x, y, z]直接使用
+    '''
+    default_dof_pos = np.zeros(len(MODEL_MAP)) if default_dof_pos is None else default_dof_pos
+    imu_axes = {'index': [2, 0, 1], 'sign': [-1, -1, 1]} if imu_remap else {}
+    return {
+        'joints': [{
+            'name': name,
+            'actuator_id': actuator_id,
+            'default': float(default),
+            'sign': -1.0 if actuator_id in WRONG_DIRECTION_SET else 1.0,
+        } for name, actuator_id, default in zip(MODEL_JOINT_NAMES, MODEL_MAP, default_dof_pos)],
+        'inputs': {'obs': [
+            {'signal': 'gait'},
+            {'signal': 'command', 'scale': [obs_scales['lin_vel'], obs_scales['lin_vel'], obs_scales['ang_vel']]},
+            {'signal': 'dof_pos', 'subtract_default': True, 'scale': obs_scales['dof_pos']},
+            {'signal': 'dof_vel', 'scale': obs_scales['dof_vel']},
+            {'signal': 'prev_actions'},
+            {'signal': 'ang_vel', 'scale': obs_scales['ang_vel'], **imu_axes},
+            {'signal': 'euler', 'scale': obs_scales['quat'], **imu_axes},
+            {'signal': 'zero', 'size': 4},
+        ]},
+        'actions': {'output': 0, 'mode': 'delta', 'wrap': True},
+    }
+
+
+class ObservationBuilder(ObservationEngine):
+    '''
+        单输入策略的观测向量构建器
+        预分配一块float32缓冲区，每帧写入原始信号后按编译好的布局一次性计算观测值
+        默认布局为model_100.onnx的45维观测(见observation_layout_spec)，缩放参数和默认关节位置在构造时固定下来
+        layout: 自定义布局(policy_layout.PolicyLayout)，传入时忽略obs_scales和default_dof_pos
+    '''
+    def __init__(self, obs_scales: OBS_Scales = OBS_SCALES, default_dof_pos: np.ndarray | None = None, buffer: np.ndarray | None = None, layout: PolicyLayout | None = None):
+        # buffer: 可选的外部缓冲区(float32数组，例如批量推理矩阵中的一行)
+        if layout is None:
+            layout = compile_layout(observation_layout_spec(obs_scales, default_dof_pos, imu_remap=False))
+        if len(layout.inputs) != 1:
+            raise ValueError(f'ObservationBuilder只支持单输入策略，布局中有{list(layout.inputs)}')
+        self.input_name = next(iter(layout.inputs))
+        super().__init__(layout, None if buffer is None else {self.input_name: buffer})
+        self.obs = self.inputs[self.input_name]
+        # (1, N)的视图，直接作为模型的batch输入，不产生拷贝
+        self.batch = self.obs[np.newaxis]
+        self.feeds = {self.input_name: self.batch}
+    def build(self, phase: float, commands: np.ndarray, dof_pos: np.ndarray, dof_vel: np.ndarray, actions: np.ndarray, base_ang_vel: np.ndarray, base_euler: np.ndarray) -> np.ndarray:
+        signals = self.signals
+        gait = signals['gait']
+        gait[0] = math.sin(2*math.pi*phase)
+        gait[1] = math.cos(2*math.pi*phase)
+        signals['command'][:] = commands
+        signals['dof_pos'][:] = dof_pos
+        signals['dof_vel'][:] = dof_vel
+        prev_actions = signals['prev_actions']
+        prev_actions[:] = actions[:len(prev_actions)]
+        signals['ang_vel'][:] = base_ang_vel
+        signals['euler'][:] = base_euler
+        self.compute()
+        return self.obs
+
+
+class DebugPrinter:
+    '''
+        限频的调试输出，默认控制循环中不打印任何内容
+        eg:
+        kos.debug = DebugPrinter(1.0)  # 每秒最多打印一次推理输入输出
+    '''
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self.last_time = -math.inf
+    def ready(self) -> bool:
+        now = time.monotonic()
+        if now - self.last_time < self.interval:
+            return False
+        self.last_time = now
+        return True
+
+
+def onnx_inference(session:ort.InferenceSession, phase:float, commands:np.ndarray, obs_scales: OBS_Scales, dof_pos: np.ndarray, dof_vel: np.ndarray, actions: np.ndarray, base_ang_vel: np.ndarray, base_euler: np.ndarray, default_dof_pos: np.ndarray, builder: ObservationBuilder | None = None, debug: DebugPrinter | None = None):
     '''
         1. 输入：
             session: 已加载的onnx模型
@@ -229,6 +668,8 @@ def onnx_inference(session:ort.InferenceSession, phase:float, commands:np.ndarra
             base_ang_vel: 角速度 [x, y, z]
             base_euler: 姿态欧拉角 [roll, pitch, yaw]
             default_dof_pos: 默认关节位置(10)
+            builder: 复用的观测向量构建器，传入时忽略obs_scales和default_dof_pos(使用构建器中的值)
+            debug: 限频调试输出，为None时不打印
         2. 输出
             0   right_hip_pitch
             1   left_hip_pitch
@@ -243,56 +684,14 @@ def onnx_inference(session:ort.InferenceSession, phase:float, commands:np.ndarra
             10  RESERVED
             11  RESERVED
     '''
-    obs = np.zeros(45).astype(np.float32)
-    obs[0] = math.sin(2*math.pi*phase)     # 步态周期的正弦值
-    obs[1] = math.cos(2*math.pi*phase)     # 步态周期的余弦值
-    obs[2] = commands[0] * obs_scales["lin_vel"]  # X方向线速度命令
-    obs[3] = commands[1] * obs_scales["lin_vel"]  # Y方向线速度命令
-    obs[4] = commands[2] * obs_scales["ang_vel"]  # Yaw方向角速度命令
-    # 6-15: 关节位置 (10维)
-    obs[5] = (dof_pos[0] - default_dof_pos[0]) * obs_scales["dof_pos"]  # right_hip_pitch
-    obs[6] = (dof_pos[1] - default_dof_pos[1]) * obs_scales["dof_pos"]  # left_hip_pitch
-    obs[7] = (dof_pos[2] - default_dof_pos[2]) * obs_scales["dof_pos"]  # right_hip_yaw
-    obs[8] = (dof_pos[3] - default_dof_pos[3]) * obs_scales["dof_pos"]  # left_hip_yaw
-    obs[9] = (dof_pos[4] - default_dof_pos[4]) * obs_scales["dof_pos"]  # right_hip_roll
-    obs[10] = (dof_pos[5] - default_dof_pos[5]) * obs_scales["dof_pos"] # left_hip_roll
-    obs[11] = (dof_pos[6] - default_dof_pos[6]) * obs_scales["dof_pos"] # right_knee_pitch
-    obs[12] = (dof_pos[7] - default_dof_pos[7]) * obs_scales["dof_pos"] # left_knee_pitch
-    obs[13] = (dof_pos[8] - default_dof_pos[8]) * obs_scales["dof_pos"] # right_ankle_pitch
-    obs[14] = (dof_pos[9] - default_dof_pos[9]) * obs_scales["dof_pos"] # left_ankle_pitch
-    # 16-25: 关节速度 (10维)
-    obs[15] = dof_vel[0] * obs_scales["dof_vel"]  # right_hip_pitch 速度
-    obs[16] = dof_vel[1] * obs_scales["dof_vel"]  # left_hip_pitch 速度
-    obs[17] = dof_vel[2] * obs_scales["dof_vel"]  # right_hip_yaw 速度
-    obs[18] = dof_vel[3] * obs_scales["dof_vel"]  # left_hip_yaw 速度
-    obs[19] = dof_vel[4] * obs_scales["dof_vel"]  # right_hip_roll 速度
-    obs[20] = dof_vel[5] * obs_scales["dof_vel"]  # left_hip_roll 速度
-    obs[21] = dof_vel[6] * obs_scales["dof_vel"]  # right_knee_pitch 速度
-    obs[22] = dof_vel[7] * obs_scales["dof_vel"]  # left_knee_pitch 速度
-    obs[23] = dof_vel[8] * obs_scales["dof_vel"]  # right_ankle_pitch 速度
-    obs[24] = dof_vel[9] * obs_scales["dof_vel"]  # left_ankle_pitch 速度
-    # 26-35: 上一步动作 (10维)
-    obs[25] = actions[0]  # right_hip_pitch 动作
-    obs[26] = actions[1]  # left_hip_pitch 动作
-    obs[27] = actions[2]  # right_hip_yaw 动作
-    obs[28] = actions[3]  # left_hip_yaw 动作
-    obs[29] = actions[4]  # right_hip_roll 动作
-    obs[30] = actions[5]  # left_hip_roll 动作
-    obs[31] = actions[6]  # right_knee_pitch 动作
-    obs[32] = actions[7]  # left_knee_pitch 动作
-    obs[33] = actions[8]  # right_ankle_pitch 动作
-    obs[34] = actions[9]  # left_ankle_pitch 动作
-    # 36-38: 角速度 (3维)
-    obs[35] = base_ang_vel[0] * obs_scales["ang_vel"]  # X轴角速度
-    obs[36] = base_ang_vel[1] * obs_scales["ang_vel"]  # Y轴角速度
-    obs[37] = base_ang_vel[2] * obs_scales["ang_vel"]  # Z轴角速度
-    # 39-41: 姿态欧拉角 (3维)
-    obs[38] = base_euler[0] * obs_scales["quat"]  # Roll角（横滚）
-    obs[39] = base_euler[1] * obs_scales["quat"]  # Pitch角（俯仰）
-    obs[40] = base_euler[2] * obs_scales["quat"]  # Yaw角（偏航）
-    # Reserved for future use(4)
-    print('[Inference Input]', obs)
+    if builder is None:
+        builder = ObservationBuilder(obs_scales, default_dof_pos)
+    obs = builder.build(phase, commands, dof_pos, dof_vel, actions, base_ang_vel, base_euler)
+    dump = debug is not None and debug.ready()
+    if dump:
+        print('[Inference Input]', obs)
     # 执行推理
-    results = session.run(None, {'obs': [obs]})[0][0]
-    print('[Inference Output]', results)
-    return results
\ No newline at end of file
+    results = session.run(None, {'obs': builder.batch})[0][0]
+    if dump:
+        print('[Inference Output]', results)
+    return results
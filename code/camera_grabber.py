@@ -0,0 +1,584 @@
+'''
+常驻的摄像头采集
+
+V4L2设备只打开一次，用驱动分配并mmap映射的缓冲区流式采集(ioctl通过fcntl + ctypes调用，不依赖v4l2-ctl/fswebcam/OpenCV)，
+每帧从驱动缓冲区拷贝到固定的NumPy帧环中后立即归还驱动；asyncio事件循环监听设备可读，不需要额外线程
+消费者随时取最新一帧(latest)或等待下一帧(next_frame)，每帧带时间戳(单调时钟，秒)和序号，
+统计驱动丢帧(序号不连续)和消费者错过的帧
+没有摄像头时可以用SyntheticSource(合成画面)或FileSource(原始帧文件，例如 v4l2-ctl --stream-to=frames.raw 录制)代替
+eg:
+async with CameraGrabber(V4L2Source('/dev/video0', 640, 480, 'YUYV')) as camera:
+    frame = await camera.next_frame()
+    print(frame.sequence, frame.timestamp, frame.data.shape)    # (480, 640, 2)
+    print(camera.stats())
+注意：Frame.data是帧环中的视图，之后的第slots帧会覆盖它，需要长时间保留时请拷贝
+'''
+
+import asyncio
+import ctypes
+import fcntl
+import glob
+import mmap
+import os
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from profiler import Histogram
+
+
+# 像素格式 -> 每个像素的通道数，None为压缩格式(每帧长度不固定)
+PIXEL_FORMATS = {'YUYV': 2, 'GREY': 1, 'RGB3': 3, 'BGR3': 3, 'MJPG': None}
+
+
+def fourcc(code: str) -> int:
+    return int.from_bytes(code.encode('ascii'), 'little')
+
+
+def frame_shape(width: int, height: int, pixel_format: str) -> tuple[int, ...]:
+    if pixel_format not in PIXEL_FORMATS:
+        raise ValueError(f'不支持的像素格式: {pixel_format}，可选 {tuple(PIXEL_FORMATS)}')
+    channels = PIXEL_FORMATS[pixel_format]
+    if channels is None:
+        # 压缩格式按未压缩YUYV的大小预留空间
+        return (width * height * 2,)
+    if channels == 1:
+        return (height, width)
+    return (height, width, channels)
+
+
+# ---- V4L2(linux/videodev2.h) ----
+
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+V4L2_MEMORY_MMAP = 1
+V4L2_FIELD_NONE = 1
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_STREAMING = 0x04000000
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+
+
+class v4l2_capability(ctypes.Structure):
+    _fields_ = [
+        ('driver', ctypes.c_char * 16),
+        ('card', ctypes.c_char * 32),
+        ('bus_info', ctypes.c_char * 32),
+        ('version', ctypes.c_uint32),
+        ('capabilities', ctypes.c_uint32),
+        ('device_caps', ctypes.c_uint32),
+        ('reserved', ctypes.c_uint32 * 3),
+    ]
+
+
+class v4l2_pix_format(ctypes.Structure):
+    _fields_ = [
+        ('width', ctypes.c_uint32),
+        ('height', ctypes.c_uint32),
+        ('pixelformat', ctypes.c_uint32),
+        ('field', ctypes.c_uint32),
+        ('bytesperline', ctypes.c_uint32),
+        ('sizeimage', ctypes.c_uint32),
+        ('colorspace', ctypes.c_uint32),
+        ('priv', ctypes.c_uint32),
+        ('flags', ctypes.c_uint32),
+        ('ycbcr_enc', ctypes.c_uint32),
+        ('quantization', ctypes.c_uint32),
+        ('xfer_func', ctypes.c_uint32),
+    ]
+
+
+class _v4l2_format_union(ctypes.Union):
+    # 内核中的联合体包含指针成员，按指针对齐
+    _fields_ = [('pix', v4l2_pix_format), ('raw_data', ctypes.c_uint8 * 200), ('_align', ctypes.c_void_p)]
+
+
+class v4l2_format(ctypes.Structure):
+    _fields_ = [('type', ctypes.c_uint32), ('fmt', _v4l2_format_union)]
+
+
+class v4l2_fract(ctypes.Structure):
+    _fields_ = [('numerator', ctypes.c_uint32), ('denominator', ctypes.c_uint32)]
+
+
+class v4l2_captureparm(ctypes.Structure):
+    _fields_ = [
+        ('capability', ctypes.c_uint32),
+        ('capturemode', ctypes.c_uint32),
+        ('timeperframe', v4l2_fract),
+        ('extendedmode', ctypes.c_uint32),
+        ('readbuffers', ctypes.c_uint32),
+        ('reserved', ctypes.c_uint32 * 4),
+    ]
+
+
+class _v4l2_streamparm_union(ctypes.Union):
+    _fields_ = [('capture', v4l2_captureparm), ('raw_data', ctypes.c_uint8 * 200)]
+
+
+class v4l2_streamparm(ctypes.Structure):
+    _fields_ = [('type', ctypes.c_uint32), ('parm', _v4l2_streamparm_union)]
+
+
+class v4l2_requestbuffers(ctypes.Structure):
+    _fields_ = [
+        ('count', ctypes.c_uint32),
+        ('type', ctypes.c_uint32),
+        ('memory', ctypes.c_uint32),
+        ('capabilities', ctypes.c_uint32),
+        ('flags', ctypes.c_uint8),
+        ('reserved', ctypes.c_uint8 * 3),
+    ]
+
+
+class timeval(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_usec', ctypes.c_long)]
+
+
+class v4l2_timecode(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_uint32),
+        ('flags', ctypes.c_uint32),
+        ('frames', ctypes.c_uint8),
+        ('seconds', ctypes.c_uint8),
+        ('minutes', ctypes.c_uint8),
+        ('hours', ctypes.c_uint8),
+        ('userbits', ctypes.c_uint8 * 4),
+    ]
+
+
+class _v4l2_buffer_m(ctypes.Union):
+    _fields_ = [('offset', ctypes.c_uint32), ('userptr', ctypes.c_ulong), ('planes', ctypes.c_void_p), ('fd', ctypes.c_int32)]
+
+
+class v4l2_buffer(ctypes.Structure):
+    _fields_ = [
+        ('index', ctypes.c_uint32),
+        ('type', ctypes.c_uint32),
+        ('bytesused', ctypes.c_uint32),
+        ('flags', ctypes.c_uint32),
+        ('field', ctypes.c_uint32),
+        ('timestamp', timeval),
+        ('timecode', v4l2_timecode),
+        ('sequence', ctypes.c_uint32),
+        ('memory', ctypes.c_uint32),
+        ('m', _v4l2_buffer_m),
+        ('length', ctypes.c_uint32),
+        ('reserved2', ctypes.c_uint32),
+        ('request_fd', ctypes.c_int32),
+    ]
+
+
+def _ioc(direction: int, number: int, struct) -> int:
+    size = struct if isinstance(struct, int) else ctypes.sizeof(struct)
+    return (direction << 30) | (size << 16) | (ord('V') << 8) | number
+
+
+_IOW, _IOR, _IOWR = 1, 2, 3
+VIDIOC_QUERYCAP = _ioc(_IOR, 0, v4l2_capability)
+VIDIOC_S_FMT = _ioc(_IOWR, 5, v4l2_format)
+VIDIOC_REQBUFS = _ioc(_IOWR, 8, v4l2_requestbuffers)
+VIDIOC_QUERYBUF = _ioc(_IOWR, 9, v4l2_buffer)
+VIDIOC_QBUF = _ioc(_IOWR, 15, v4l2_buffer)
+VIDIOC_DQBUF = _ioc(_IOWR, 17, v4l2_buffer)
+VIDIOC_STREAMON = _ioc(_IOW, 18, ctypes.sizeof(ctypes.c_int))
+VIDIOC_STREAMOFF = _ioc(_IOW, 19, ctypes.sizeof(ctypes.c_int))
+VIDIOC_S_PARM = _ioc(_IOWR, 22, v4l2_streamparm)
+
+
+def _ioctl(fd: int, request: int, arg):
+    # 被信号打断时重试
+    while True:
+        try:
+            return fcntl.ioctl(fd, request, arg)
+        except InterruptedError:
+            continue
+
+
+def query_device(path: str) -> dict | None:
+    '''
+        查询一个/dev/video*设备，不是视频采集设备时返回None
+    '''
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+    except OSError:
+        return None
+    try:
+        cap = v4l2_capability()
+        _ioctl(fd, VIDIOC_QUERYCAP, cap)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    caps = cap.device_caps if cap.capabilities & V4L2_CAP_DEVICE_CAPS else cap.capabilities
+    if not caps & V4L2_CAP_VIDEO_CAPTURE:
+        return None
+    return {
+        'path': path,
+        'driver': cap.driver.decode(errors='replace'),
+        'card': cap.card.decode(errors='replace'),
+        'bus_info': cap.bus_info.decode(errors='replace'),
+        'streaming': bool(caps & V4L2_CAP_STREAMING),
+    }
+
+
+def list_devices() -> list[dict]:
+    # 代替 v4l2-ctl --list-devices
+    devices = (query_device(path) for path in sorted(glob.glob('/dev/video*')))
+    return [device for device in devices if device is not None]
+
+
+# ---- 帧源 ----
+
+Deliver = Callable[[np.ndarray, float, int], None]
+
+
+class FrameSource:
+    '''
+        帧源接口: open()后确定width/height/pixel_format，start(loop, deliver)后每来一帧调用
+        deliver(data, timestamp, sequence)，data只在回调期间有效
+    '''
+    width: int
+    height: int
+    pixel_format: str
+
+    def open(self):
+        pass
+
+    def start(self, loop: asyncio.AbstractEventLoop, deliver: Deliver):
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class V4L2Source(FrameSource):
+    '''
+        V4L2 mmap流式采集
+        device: 设备路径
+        width / height / pixel_format: 请求的分辨率和像素格式，驱动可能调整，以open()之后的属性为准
+        fps: 请求的帧率，None时使用驱动默认值
+        buffers: 驱动缓冲区个数
+    '''
+    def __init__(self, device: str = '/dev/video0', width: int = 640, height: int = 480, pixel_format: str = 'YUYV',
+                 fps: float | None = None, buffers: int = 4):
+        frame_shape(width, height, pixel_format)
+        self.device = device
+        self.width = width
+        self.height = height
+        self.pixel_format = pixel_format
+        self.fps = fps
+        self.buffer_count = buffers
+        self.fd = -1
+        self._maps: list[mmap.mmap] = []
+        self._views: list[np.ndarray] = []
+        self._buffer = v4l2_buffer(type=V4L2_BUF_TYPE_VIDEO_CAPTURE, memory=V4L2_MEMORY_MMAP)
+        self._loop = None
+        self._deliver = None
+
+    def open(self):
+        self.fd = os.open(self.device, os.O_RDWR | os.O_NONBLOCK)
+        try:
+            self._configure()
+        except Exception:
+            self.close()
+            raise
+
+    def _configure(self):
+        fd = self.fd
+        cap = v4l2_capability()
+        _ioctl(fd, VIDIOC_QUERYCAP, cap)
+        caps = cap.device_caps if cap.capabilities & V4L2_CAP_DEVICE_CAPS else cap.capabilities
+        if not caps & V4L2_CAP_VIDEO_CAPTURE or not caps & V4L2_CAP_STREAMING:
+            raise OSError(f'{self.device}不支持视频流式采集')
+
+        fmt = v4l2_format(type=V4L2_BUF_TYPE_VIDEO_CAPTURE)
+        fmt.fmt.pix.width = self.width
+        fmt.fmt.pix.height = self.height
+        fmt.fmt.pix.pixelformat = fourcc(self.pixel_format)
+        fmt.fmt.pix.field = V4L2_FIELD_NONE
+        _ioctl(fd, VIDIOC_S_FMT, fmt)
+        pixel_format = fmt.fmt.pix.pixelformat.to_bytes(4, 'little').decode('ascii', errors='replace')
+        if pixel_format != self.pixel_format:
+            raise OSError(f'{self.device}不支持像素格式{self.pixel_format}(驱动返回{pixel_format})')
+        self.width, self.height = fmt.fmt.pix.width, fmt.fmt.pix.height
+        if PIXEL_FORMATS[self.pixel_format] is not None and fmt.fmt.pix.bytesperline not in (0, self.width * PIXEL_FORMATS[self.pixel_format]):
+            raise OSError(f'{self.device}的行有填充(bytesperline={fmt.fmt.pix.bytesperline})，暂不支持')
+
+        if self.fps:
+            parm = v4l2_streamparm(type=V4L2_BUF_TYPE_VIDEO_CAPTURE)
+            parm.parm.capture.timeperframe.numerator = 1000
+            parm.parm.capture.timeperframe.denominator = round(self.fps * 1000)
+            _ioctl(fd, VIDIOC_S_PARM, parm)
+
+        request = v4l2_requestbuffers(count=self.buffer_count, type=V4L2_BUF_TYPE_VIDEO_CAPTURE, memory=V4L2_MEMORY_MMAP)
+        _ioctl(fd, VIDIOC_REQBUFS, request)
+        if request.count < 2:
+            raise OSError(f'{self.device}的驱动缓冲区不足: {request.count}')
+        for index in range(request.count):
+            buffer = v4l2_buffer(index=index, type=V4L2_BUF_TYPE_VIDEO_CAPTURE, memory=V4L2_MEMORY_MMAP)
+            _ioctl(fd, VIDIOC_QUERYBUF, buffer)
+            mapped = mmap.mmap(fd, buffer.length, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE, offset=buffer.m.offset)
+            self._maps.append(mapped)
+            self._views.append(np.frombuffer(mapped, dtype=np.uint8))
+
+    def start(self, loop: asyncio.AbstractEventLoop, deliver: Deliver):
+        self._loop = loop
+        self._deliver = deliver
+        for index in range(len(self._maps)):
+            buffer = v4l2_buffer(index=index, type=V4L2_BUF_TYPE_VIDEO_CAPTURE, memory=V4L2_MEMORY_MMAP)
+            _ioctl(self.fd, VIDIOC_QBUF, buffer)
+        _ioctl(self.fd, VIDIOC_STREAMON, ctypes.c_int(V4L2_BUF_TYPE_VIDEO_CAPTURE))
+        loop.add_reader(self.fd, self._on_readable)
+
+    def _on_readable(self):
+        # 取出所有已就绪的帧，交给消费者后立即归还驱动
+        buffer = self._buffer
+        while True:
+            try:
+                _ioctl(self.fd, VIDIOC_DQBUF, buffer)
+            except BlockingIOError:
+                return
+            timestamp = buffer.timestamp.tv_sec + buffer.timestamp.tv_usec * 1e-6
+            try:
+                self._deliver(self._views[buffer.index][:buffer.bytesused], timestamp, buffer.sequence)
+            finally:
+                _ioctl(self.fd, VIDIOC_QBUF, buffer)
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.remove_reader(self.fd)
+            self._loop = None
+            _ioctl(self.fd, VIDIOC_STREAMOFF, ctypes.c_int(V4L2_BUF_TYPE_VIDEO_CAPTURE))
+
+    def close(self):
+        self._views.clear()
+        for mapped in self._maps:
+            mapped.close()
+        self._maps.clear()
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class _TimedSource(FrameSource):
+    # 按固定帧率在事件循环中产出帧，按绝对时间排程，不累积漂移
+    def __init__(self, fps: float):
+        self.fps = fps
+        self._handle = None
+        self._sequence = 0
+
+    def start(self, loop: asyncio.AbstractEventLoop, deliver: Deliver):
+        self._deliver = deliver
+        self._sequence = 0
+        self._next = loop.time()
+        self._loop = loop
+        self._handle = loop.call_at(self._next, self._tick)
+
+    def _tick(self):
+        now = time.monotonic()
+        frame = self.produce(self._sequence)
+        if frame is not None:
+            self._deliver(frame, now, self._sequence)
+        if self._handle is None:    # produce()中已停止
+            return
+        self._sequence += 1
+        self._next += 1 / self.fps
+        self._handle = self._loop.call_at(self._next, self._tick)
+
+    def produce(self, sequence: int) -> np.ndarray | None:
+        raise NotImplementedError
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+
+class SyntheticSource(_TimedSource):
+    '''
+        合成画面: 水平滚动的渐变条纹，画面内容由序号决定，便于检查取到的是哪一帧
+        drop_every: 每隔多少帧跳过一帧(模拟驱动丢帧)，0为不丢帧
+    '''
+    def __init__(self, width: int = 640, height: int = 480, pixel_format: str = 'YUYV', fps: float = 30, drop_every: int = 0):
+        super().__init__(fps)
+        self.width = width
+        self.height = height
+        self.pixel_format = pixel_format
+        self.drop_every = drop_every
+        shape = frame_shape(width, height, pixel_format)
+        if PIXEL_FORMATS[pixel_format] is None:
+            raise ValueError('SyntheticSource不支持压缩格式')
+        # 预先生成加宽的图案，每帧只取其中的一个窗口
+        self._period = 256
+        ramp = (np.arange(width + self._period) % self._period).astype(np.uint8)
+        ramp = ramp[None, :, None] if len(shape) == 3 else ramp[None, :]
+        self._pattern = np.ascontiguousarray(np.broadcast_to(ramp, (height, width + self._period) + shape[2:]))
+
+    def produce(self, sequence: int) -> np.ndarray | None:
+        if self.drop_every and sequence % self.drop_every == self.drop_every - 1:
+            return None
+        offset = sequence % self._period
+        return self._pattern[:, offset:offset + self.width]
+
+
+class FileSource(_TimedSource):
+    '''
+        原始帧文件(多帧连续存放，没有文件头)，例如 v4l2-ctl --stream-mmap --stream-to=frames.raw 录制的YUYV数据
+        文件用np.memmap映射，按fps循环播放
+    '''
+    def __init__(self, path: str | Path, width: int, height: int, pixel_format: str = 'YUYV', fps: float = 30, loop: bool = True):
+        super().__init__(fps)
+        shape = frame_shape(width, height, pixel_format)
+        if PIXEL_FORMATS[pixel_format] is None:
+            raise ValueError('FileSource不支持压缩格式')
+        self.path = Path(path)
+        self.width = width
+        self.height = height
+        self.pixel_format = pixel_format
+        self.loop = loop
+        self._shape = shape
+        self._frames = None
+
+    def open(self):
+        frame_bytes = int(np.prod(self._shape))
+        count = os.path.getsize(self.path) // frame_bytes
+        if count == 0:
+            raise ValueError(f'{self.path}中没有完整的帧')
+        self._frames = np.memmap(self.path, dtype=np.uint8, mode='r', shape=(count,) + self._shape)
+
+    def produce(self, sequence: int) -> np.ndarray | None:
+        count = len(self._frames)
+        if sequence >= count and not self.loop:
+            self.stop()
+            return None
+        return self._frames[sequence % count]
+
+    def close(self):
+        self._frames = None
+
+
+# ---- 帧环 ----
+
+@dataclass
+class Frame:
+    data: np.ndarray        # 帧环中的视图，压缩格式为有效字节
+    timestamp: float        # 采集时间(单调时钟，秒)
+    sequence: int           # 帧源序号
+    index: int              # 本采集器收到的第几帧
+
+
+class CameraGrabber:
+    '''
+        把帧源的每一帧拷贝进固定的帧环
+        slots: 帧环大小，消费者持有的Frame在之后的第slots帧到来时被覆盖
+        latest(): 最新一帧(没有时为None)，不等待
+        next_frame(): 等待比上一次取到的更新的一帧，期间错过的帧计入missed
+    '''
+    def __init__(self, source: FrameSource, slots: int = 4):
+        if slots < 2:
+            raise ValueError('slots至少为2')
+        self.source = source
+        self.slots = slots
+        self.ring: np.ndarray | None = None
+        self.timestamps = np.zeros(slots, dtype=np.float64)
+        self.sequences = np.zeros(slots, dtype=np.int64)
+        self.sizes = np.zeros(slots, dtype=np.int64)
+        self.count = 0          # 收到的帧数
+        self.dropped = 0        # 帧源丢帧数(序号不连续)
+        self.missed = 0         # next_frame的消费者没有取到的帧数
+        self.latency = Histogram()      # 采集时间到拷贝进帧环的延迟(秒)
+        self.copy_time = Histogram()
+        self._compressed = False
+        self._last_sequence = None
+        self._consumed = 0      # next_frame上一次取到的帧的index+1
+        self._event: asyncio.Event | None = None
+        self._running = False
+
+    async def start(self):
+        source = self.source
+        source.open()
+        self._compressed = PIXEL_FORMATS[source.pixel_format] is None
+        shape = frame_shape(source.width, source.height, source.pixel_format)
+        if self.ring is None or self.ring.shape[1:] != shape:
+            self.ring = np.zeros((self.slots,) + shape, dtype=np.uint8)
+        self._event = asyncio.Event()
+        source.start(asyncio.get_running_loop(), self._deliver)
+        self._running = True
+
+    def _deliver(self, data: np.ndarray, timestamp: float, sequence: int):
+        start = time.perf_counter()
+        slot = self.count % self.slots
+        target = self.ring[slot]
+        if self._compressed:
+            n = min(len(data), len(target))
+            target[:n] = data[:n]
+            self.sizes[slot] = n
+        else:
+            np.copyto(target, data.reshape(target.shape))
+        self.timestamps[slot] = timestamp
+        self.sequences[slot] = sequence
+        if self._last_sequence is not None and sequence > self._last_sequence + 1:
+            self.dropped += sequence - self._last_sequence - 1
+        self._last_sequence = sequence
+        self.count += 1
+        self.copy_time.record(time.perf_counter() - start)
+        self.latency.record(time.monotonic() - timestamp)
+        self._event.set()
+
+    def _frame(self, index: int) -> Frame:
+        slot = index % self.slots
+        data = self.ring[slot]
+        if self._compressed:
+            data = data[:self.sizes[slot]]
+        return Frame(data, float(self.timestamps[slot]), int(self.sequences[slot]), index)
+
+    def latest(self) -> Frame | None:
+        if self.count == 0:
+            return None
+        return self._frame(self.count - 1)
+
+    async def next_frame(self, timeout: float | None = None) -> Frame:
+        while self.count <= self._consumed:
+            if not self._running:
+                raise RuntimeError('采集未启动或已停止')
+            self._event.clear()
+            await asyncio.wait_for(self._event.wait(), timeout)
+        index = self.count - 1
+        self.missed += index - self._consumed
+        self._consumed = index + 1
+        return self._frame(index)
+
+    async def frames(self):
+        # 逐帧迭代(总是最新的一帧)
+        while self._running:
+            yield await self.next_frame()
+
+    def stats(self) -> dict:
+        frame = self.latest()
+        return {
+            'frames': self.count,
+            'dropped': self.dropped,
+            'missed': self.missed,
+            'last_sequence': None if frame is None else frame.sequence,
+            'latency': self.latency.summary(),
+            'copy_time': self.copy_time.summary(),
+        }
+
+    async def stop(self):
+        if self._running:
+            self._running = False
+            self.source.stop()
+            self._event.set()
+        self.source.close()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.stop()
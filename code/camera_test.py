@@ -3,46 +3,68 @@
 '''
 本代码包括：
 1.读取摄像头
-2.提供测试,录制一段视频
+2.提供测试,连续采集一段时间并统计帧率、丢帧
+3.可选:把画面实时显示到LED点阵屏(--led，没有点阵屏时用模拟屏)
+设备只打开一次，用camera_grabber.py的mmap帧环采集，不再每张照片调用一次fswebcam
+没有摄像头时加 --synthetic 使用合成画面测试
 '''
 
-# kos\kos_sim均未提供摄像头调用的库，故在此尝试使用通用的方法去检查设备
-import subprocess
+# kos\kos_sim均未提供摄像头调用的库，故在此直接通过V4L2访问设备
+import argparse
+import asyncio
+import time
+
+from camera_grabber import CameraGrabber, SyntheticSource, V4L2Source, list_devices
+from led_display import LEDDisplay, MockMatrix, RGBMatrixBackend
+
 
 # 检查设备
 def list_cameras():
-    result = subprocess.run(
-        ["v4l2-ctl", "--list-devices"],
-        capture_output=True, text=True, check=True
-    )
-    print(result.stdout)
+    for device in list_devices():
+        print(f"{device['card']} ({device['driver']}, {device['bus_info']}): {device['path']}")
+
+
+async def grab(source, seconds: float, matrix=None):
+    async with CameraGrabber(source) as camera:
+        display = None
+        if matrix is not None:
+            # 直接从帧环取最新一帧缩小后推送，不经过磁盘
+            display = LEDDisplay(matrix, camera.latest, source.width, source.height, source.pixel_format, fps=30)
+            task = asyncio.create_task(display.run(seconds))
+        start = time.monotonic()
+        frames = 0
+        while time.monotonic() - start < seconds:
+            frame = await camera.next_frame(timeout=2.0)
+            frames += 1
+        elapsed = time.monotonic() - start
+        print(f"last frame: sequence={frame.sequence} shape={frame.data.shape} timestamp={frame.timestamp:.3f}")
+        print(f"rate: {frames / elapsed:.1f} fps")
+        print("stats:", camera.stats())
+        if display is not None:
+            await task
+            display.close()
+            print("led:", display.stats())
+
 
 if __name__ == "__main__":
-    list_cameras()
-
-import subprocess
-
-# # 拍照测试
-# subprocess.run(
-#     ["fswebcam", "-d", "/dev/video0", "-r", "640x480",
-#      "--no-banner", "test.jpg"],
-#     check=True
-# )
-
-# # 打印到显示屏
-# from rgbmatrix import RGBMatrix, RGBMatrixOptions
-# from PIL import Image
-# import time
-
-# options = RGBMatrixOptions()
-# options.rows = 32
-# options.cols = 32
-# options.chain_length = 1
-# matrix = RGBMatrix(options=options)
-
-# img = Image.open("test.jpg").resize(
-#     (options.cols, options.rows)
-# )
-# matrix.SetImage(img)
-# time.sleep(5)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--device', default='/dev/video0')
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--format', default='YUYV')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--synthetic', action='store_true')
+    parser.add_argument('--led', choices=['mock', 'rgbmatrix'], default=None, help='同时显示到32x32 LED点阵屏')
+    args = parser.parse_args()
 
+    if args.synthetic:
+        source = SyntheticSource(args.width, args.height, args.format)
+    else:
+        list_cameras()
+        source = V4L2Source(args.device, args.width, args.height, args.format)
+    matrix = None
+    if args.led == 'rgbmatrix':
+        matrix = RGBMatrixBackend(rows=32, cols=32, chain_length=1)
+    elif args.led == 'mock':
+        matrix = MockMatrix(rows=32, cols=32, chain_length=1)
+    asyncio.run(grab(source, args.seconds, matrix))
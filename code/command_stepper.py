@@ -0,0 +1,164 @@
+'''
+策略帧之间的命令插值
+
+策略以50Hz输出目标位置，CommandStepper在独立的任务中以更高的频率(例如200Hz)从上一个目标线性插值到新目标，
+每个子步只发送一次批量command_actuators；新的策略输出到来时从当前插值位置重新开始(抢占)，运动更平滑而不需要更快的策略
+插值在电机原始位置(度)上进行，wrap为True时沿最短方向插值并回绕到(-180, 180]
+eg:
+stepper = CommandStepper(kos.actuator, [31, 32, 33], frequency=200, policy_period=0.02)
+stepper.start()
+stepper.set_target(raw_positions)     # 每个策略帧调用一次
+...
+await stepper.stop()
+print(stepper.stats())
+'''
+
+import asyncio
+import time
+
+import numpy as np
+
+from profiler import Histogram
+from rate_scheduler import RateScheduler
+
+
+class CommandStepper:
+    '''
+        命令子步进器
+        actuator: ActuatorServiceClient
+        ids: 电机ID，顺序与set_target的目标一致
+        frequency: 下发频率(Hz)
+        policy_period: 插值时长(秒)，通常为策略周期；None时使用两次set_target的实测间隔
+        fields: 每条命令附带的固定字段，例如{'torque': 0.1}
+    '''
+    def __init__(self, actuator, ids, frequency: float = 200, policy_period: float | None = 0.02,
+                 wrap: bool = True, fields: dict | None = None):
+        self.actuator = actuator
+        self.ids = [int(i) for i in ids]
+        self.frequency = frequency
+        self.policy_period = policy_period
+        self.wrap = wrap
+        n = len(self.ids)
+        self.start_pos = np.zeros(n)
+        self.target = np.zeros(n)
+        self.delta = np.zeros(n)
+        self.position = np.zeros(n)     # 最近一次下发的位置
+        self._work = np.zeros(n)
+        self.velocities: np.ndarray | None = None
+        # 命令字典只构建一次，每个子步原地更新位置
+        self._commands = [{'actuator_id': actuator_id, 'position': 0.0, **(fields or {})} for actuator_id in self.ids]
+        self._start_time = 0.0
+        self._duration = policy_period or 0.0
+        self._last_set: float | None = None
+        self._has_target = False
+        self._dirty = False
+        self._task: asyncio.Task | None = None
+        self._stop_time: float | None = None
+        self.scheduler: RateScheduler | None = None
+        # 统计
+        self.targets = 0        # 收到的策略目标数
+        self.preempted = 0      # 插值未完成就被新目标打断的次数
+        self.rpcs = 0           # 下发的command_actuators次数
+        self.skipped = 0        # 到达目标后位置没有变化而不下发的子步数
+        self.rpc_time = Histogram()
+
+    def _wrap(self, values: np.ndarray) -> np.ndarray:
+        np.remainder(values, 360, out=values)
+        np.subtract(values, 360, out=values, where=values > 180)
+        return values
+
+    def _alpha(self, now: float) -> float:
+        if self._duration <= 0:
+            return 1.0
+        return min(max((now - self._start_time) / self._duration, 0.0), 1.0)
+
+    def _interpolate(self, alpha: float, out: np.ndarray) -> np.ndarray:
+        # out可以是start_pos本身
+        np.multiply(self.delta, alpha, out=self._work)
+        np.add(self.start_pos, self._work, out=out)
+        return self._wrap(out) if self.wrap else out
+
+    def set_target(self, positions: np.ndarray, velocities: np.ndarray | None = None):
+        '''
+            设置新的目标位置(电机原始位置，度)，从当前插值位置开始插值
+            velocities: 随命令下发的各电机速度，None时不下发速度
+        '''
+        now = time.monotonic()
+        if self.policy_period is None and self._last_set is not None:
+            self._duration = now - self._last_set
+        self._last_set = now
+        if self._has_target:
+            alpha = self._alpha(now)
+            if alpha < 1.0:
+                self.preempted += 1
+            self._interpolate(alpha, self.start_pos)
+        else:
+            self.start_pos[:] = positions
+            self._has_target = True
+        self.target[:] = positions
+        np.subtract(self.target, self.start_pos, out=self.delta)
+        if self.wrap:
+            self._wrap(self.delta)
+        if velocities is not None:
+            if self.velocities is None:
+                self.velocities = np.zeros(len(self.ids))
+            self.velocities[:] = velocities
+        self._start_time = now
+        self._dirty = True
+        self.targets += 1
+
+    async def step(self):
+        # 下发一个子步；已到达目标且之后没有新目标时不再重复下发
+        if not self._has_target or not self._dirty:
+            self.skipped += self._has_target
+            return None
+        alpha = self._alpha(time.monotonic())
+        if alpha >= 1.0:
+            self._dirty = False
+        self._interpolate(alpha, self.position)
+        commands = self._commands
+        for command, position in zip(commands, self.position.tolist()):
+            command['position'] = position
+        if self.velocities is not None:
+            for command, velocity in zip(commands, self.velocities.tolist()):
+                command['velocity'] = velocity
+        start = time.perf_counter()
+        response = await self.actuator.command_actuators(commands)
+        self.rpc_time.record(time.perf_counter() - start)
+        self.rpcs += 1
+        return response
+
+    async def run(self):
+        self.scheduler = RateScheduler(self.frequency)
+        async for _ in self.scheduler:
+            await self.step()
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._stop_time = None
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._stop_time = time.monotonic()
+
+    def stats(self) -> dict:
+        scheduler = {} if self.scheduler is None else self.scheduler.stats()
+        elapsed = 0.0
+        if self.scheduler is not None and self.scheduler.start_time is not None:
+            elapsed = (self._stop_time or time.monotonic()) - self.scheduler.start_time
+        return {
+            'frequency': self.frequency,
+            'tick_rate': scheduler['ticks'] / elapsed if elapsed > 0 else 0.0,
+            'rpc_rate': self.rpcs / elapsed if elapsed > 0 else 0.0,
+            'rpcs': self.rpcs,
+            'targets': self.targets,
+            'preempted': self.preempted,
+            'skipped': self.skipped,
+            'overruns': scheduler.get('overruns', 0),
+            'rpc_time': self.rpc_time.summary(),
+        }
@@ -0,0 +1,329 @@
+'''
+本地KOS替身服务器
+
+在本机提供actuator、imu、sim、sound四个gRPC服务，pykos.KOS可以直接连接，用于在没有机器人和kos-sim的机器上测试、压测控制循环
+- 关节动力学: 每个电机以一阶惯性跟随目标位置(时间常数tau)
+- 可注入RPC延迟、抖动和失败(返回UNAVAILABLE)
+- realtime=True时按墙钟时间推进；False时只在sim.step时推进(步进锁定)
+- 录音按实时速度产生440Hz正弦波，播放的数据只计数并保留最近的若干块
+eg:
+python fake_kos.py --port 50051 --latency 0.002 --jitter 0.0005
+或在代码中:
+async with FakeKOSServer(latency=0.002) as server:
+    async with KOS('127.0.0.1', server.port) as kos:
+        ...
+'''
+
+import argparse
+import asyncio
+import collections
+import math
+import random
+import time
+
+import grpc
+import grpc.aio
+import numpy as np
+from kos_protos import (actuator_pb2, actuator_pb2_grpc, common_pb2, imu_pb2, imu_pb2_grpc, sim_pb2, sim_pb2_grpc,
+                        sound_pb2, sound_pb2_grpc)
+
+
+DEFAULT_ACTUATOR_IDS = (11, 12, 13, 21, 22, 23, 31, 32, 33, 34, 35, 41, 42, 43, 44, 45)
+
+
+class FakeRobot:
+    '''
+        简单的关节与IMU模型，角度单位均为度
+    '''
+    def __init__(self, actuator_ids=DEFAULT_ACTUATOR_IDS, tau: float = 0.05, dt: float = 0.001, seed: int | None = None):
+        self.ids = list(actuator_ids)
+        self.index = {actuator_id: i for i, actuator_id in enumerate(self.ids)}
+        self.tau = tau
+        self.dt = dt                    # sim.step未指定step_size时的步长
+        self.rng = np.random.default_rng(seed)
+        n = len(self.ids)
+        self.position = self.rng.uniform(-5, 5, n)     # 上电位置不为0，便于检查零位处理
+        self.velocity = np.zeros(n)
+        self.target = self.position.copy()
+        self.torque_enabled = np.zeros(n, dtype=bool)
+        self.sim_time = 0.0
+        self.steps = 0
+        self.joint_names: dict[str, int] = {}
+        self.leg_slots = [i for i, actuator_id in enumerate(self.ids) if actuator_id // 10 in (3, 4)] or list(range(n))
+
+    def advance(self, dt: float):
+        if dt <= 0:
+            return
+        alpha = 1 - math.exp(-dt / self.tau)
+        delta = np.where(self.torque_enabled, (self.target - self.position) * alpha, 0.0)
+        self.position += delta
+        self.velocity = delta / dt
+        self.sim_time += dt
+
+    def gyro(self) -> np.ndarray:
+        # 腿部关节运动在机身上引起的小幅角速度(度/秒)，加少量噪声
+        base = 0.01 * float(np.sum(self.velocity[self.leg_slots]))
+        return np.array([base, -base, 0.5 * base]) + self.rng.normal(0, 0.05, 3)
+
+
+class _Faults:
+    def __init__(self, latency: float, jitter: float, failure_rate: float, seed: int | None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+
+    async def __call__(self, context):
+        self.calls += 1
+        delay = self.latency + (self.random.uniform(-self.jitter, self.jitter) if self.jitter > 0 else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.failure_rate > 0 and self.random.random() < self.failure_rate:
+            self.failures += 1
+            await context.abort(grpc.StatusCode.UNAVAILABLE, 'injected failure')
+
+
+class _Clock:
+    def __init__(self, robot: FakeRobot, realtime: bool):
+        self.robot = robot
+        self.realtime = realtime
+        self.last = time.monotonic()
+
+    def sync(self):
+        if self.realtime:
+            now = time.monotonic()
+            self.robot.advance(now - self.last)
+            self.last = now
+
+
+class ActuatorService(actuator_pb2_grpc.ActuatorServiceServicer):
+    def __init__(self, robot: FakeRobot, clock: _Clock, faults: _Faults):
+        self.robot = robot
+        self.clock = clock
+        self.faults = faults
+
+    async def CommandActuators(self, request, context):
+        await self.faults(context)
+        self.clock.sync()
+        robot = self.robot
+        results = []
+        for command in request.commands:
+            i = robot.index.get(command.actuator_id)
+            if i is not None and command.HasField('position'):
+                robot.target[i] = command.position
+            results.append(common_pb2.ActionResult(actuator_id=command.actuator_id, success=i is not None))
+        return actuator_pb2.CommandActuatorsResponse(results=results)
+
+    async def ConfigureActuator(self, request, context):
+        await self.faults(context)
+        robot = self.robot
+        i = robot.index.get(request.actuator_id)
+        if i is not None and request.HasField('torque_enabled'):
+            robot.torque_enabled[i] = request.torque_enabled
+        return common_pb2.ActionResult(actuator_id=request.actuator_id, success=i is not None)
+
+    async def GetActuatorsState(self, request, context):
+        await self.faults(context)
+        self.clock.sync()
+        robot = self.robot
+        ids = list(request.actuator_ids) or robot.ids
+        states = []
+        for actuator_id in ids:
+            i = robot.index.get(actuator_id)
+            if i is None:
+                continue
+            states.append(actuator_pb2.ActuatorStateResponse(
+                actuator_id=actuator_id,
+                online=True,
+                position=float(robot.position[i]),
+                velocity=float(robot.velocity[i]),
+                torque_enabled=bool(robot.torque_enabled[i]),
+            ))
+        return actuator_pb2.GetActuatorsStateResponse(states=states)
+
+
+class IMUService(imu_pb2_grpc.IMUServiceServicer):
+    def __init__(self, robot: FakeRobot, clock: _Clock, faults: _Faults):
+        self.robot = robot
+        self.clock = clock
+        self.faults = faults
+
+    async def GetValues(self, request, context):
+        await self.faults(context)
+        self.clock.sync()
+        gyro = self.robot.gyro()
+        return imu_pb2.IMUValuesResponse(accel_x=0.0, accel_y=0.0, accel_z=9.81,
+                                         gyro_x=gyro[0], gyro_y=gyro[1], gyro_z=gyro[2])
+
+    async def GetAdvancedValues(self, request, context):
+        await self.faults(context)
+        return imu_pb2.IMUAdvancedValuesResponse(grav_z=-9.81)
+
+    async def GetEuler(self, request, context):
+        await self.faults(context)
+        noise = self.robot.rng.normal(0, 0.1, 3)
+        return imu_pb2.EulerAnglesResponse(roll=noise[0], pitch=noise[1], yaw=noise[2])
+
+    async def GetQuaternion(self, request, context):
+        await self.faults(context)
+        return imu_pb2.QuaternionResponse(x=0.0, y=0.0, z=0.0, w=1.0)
+
+
+class SimService(sim_pb2_grpc.SimulationServiceServicer):
+    def __init__(self, robot: FakeRobot, clock: _Clock, faults: _Faults):
+        self.robot = robot
+        self.clock = clock
+        self.faults = faults
+        self.paused = False
+
+    async def Reset(self, request, context):
+        await self.faults(context)
+        robot = self.robot
+        robot.velocity[:] = 0
+        robot.sim_time = 0.0
+        robot.steps = 0
+        for joint in request.joints.values:
+            # kos-sim按关节名设置位置(弧度)，替身服务器把新出现的关节名依次绑定到腿部电机(31~45)
+            if joint.name not in robot.joint_names:
+                robot.joint_names[joint.name] = robot.leg_slots[len(robot.joint_names) % len(robot.leg_slots)]
+            i = robot.joint_names[joint.name]
+            robot.position[i] = robot.target[i] = math.degrees(joint.pos)
+        self.clock.last = time.monotonic()
+        return common_pb2.ActionResponse(success=True)
+
+    async def SetPaused(self, request, context):
+        await self.faults(context)
+        self.paused = request.paused
+        return common_pb2.ActionResponse(success=True)
+
+    async def Step(self, request, context):
+        await self.faults(context)
+        step_size = request.step_size if request.HasField('step_size') else self.robot.dt
+        for _ in range(request.num_steps):
+            self.robot.advance(step_size)
+        self.robot.steps += request.num_steps
+        return common_pb2.ActionResponse(success=True)
+
+    async def SetParameters(self, request, context):
+        await self.faults(context)
+        return common_pb2.ActionResponse(success=True)
+
+    async def GetParameters(self, request, context):
+        await self.faults(context)
+        return sim_pb2.GetParametersResponse(parameters=sim_pb2.SimulationParameters(time_scale=1.0, gravity=9.81))
+
+
+class SoundService(sound_pb2_grpc.SoundServiceServicer):
+    RATES = [8000, 16000, 22050, 44100, 48000]
+    CHUNK_SECONDS = 0.01
+
+    def __init__(self, faults: _Faults, frequency: float = 440.0):
+        self.faults = faults
+        self.frequency = frequency
+        self.recording = False
+        self.played_bytes = 0
+        self.played = collections.deque(maxlen=1000)    # 最近播放的数据块
+
+    async def GetAudioInfo(self, request, context):
+        await self.faults(context)
+        capability = sound_pb2.AudioCapabilities(sample_rates=self.RATES, bit_depths=[16, 32], channels=[1, 2], available=True)
+        return sound_pb2.GetAudioInfoResponse(playback=capability, recording=capability)
+
+    async def RecordAudio(self, request, context):
+        await self.faults(context)
+        config = request.config
+        dtype = np.dtype({16: np.int16, 32: np.int32}[config.bit_depth]).newbyteorder('<')
+        amplitude = 0.3 * np.iinfo(dtype).max
+        frames = max(1, round(config.sample_rate * self.CHUNK_SECONDS))
+        start = time.monotonic()
+        sent = 0
+        self.recording = True
+        while self.recording and (request.duration_ms == 0 or sent * 1000 < request.duration_ms * config.sample_rate):
+            t = (sent + np.arange(frames)) / config.sample_rate
+            tone = (amplitude * np.sin(2 * math.pi * self.frequency * t)).astype(dtype)
+            yield sound_pb2.RecordAudioResponse(audio_data=np.repeat(tone, config.channels).tobytes())
+            sent += frames
+            # 按实时速度产生数据
+            await asyncio.sleep(max(0.0, start + sent / config.sample_rate - time.monotonic()))
+        self.recording = False
+
+    async def StopRecording(self, request, context):
+        await self.faults(context)
+        self.recording = False
+        return common_pb2.ActionResponse(success=True)
+
+    async def PlayAudio(self, request_iterator, context):
+        await self.faults(context)
+        async for request in request_iterator:
+            if request.audio_data:
+                self.played_bytes += len(request.audio_data)
+                self.played.append(request.audio_data)
+        return common_pb2.ActionResponse(success=True)
+
+
+class FakeKOSServer:
+    '''
+        KOS替身服务器
+        latency / jitter: 每次RPC的附加延迟及其均匀抖动范围(秒)
+        failure_rate: RPC失败概率
+        realtime: 是否按墙钟时间推进关节模型
+        port=0时自动分配端口，启动后从server.port读取
+    '''
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 failure_rate: float = 0.0, realtime: bool = True, seed: int | None = None, robot: FakeRobot | None = None):
+        self.host = host
+        self.port = port
+        self.robot = FakeRobot(seed=seed) if robot is None else robot
+        self.clock = _Clock(self.robot, realtime)
+        self.faults = _Faults(latency, jitter, failure_rate, seed)
+        self.sound = SoundService(self.faults)
+        self.server: grpc.aio.Server | None = None
+
+    async def start(self) -> int:
+        self.server = grpc.aio.server()
+        actuator_pb2_grpc.add_ActuatorServiceServicer_to_server(ActuatorService(self.robot, self.clock, self.faults), self.server)
+        imu_pb2_grpc.add_IMUServiceServicer_to_server(IMUService(self.robot, self.clock, self.faults), self.server)
+        sim_pb2_grpc.add_SimulationServiceServicer_to_server(SimService(self.robot, self.clock, self.faults), self.server)
+        sound_pb2_grpc.add_SoundServiceServicer_to_server(self.sound, self.server)
+        self.port = self.server.add_insecure_port(f'{self.host}:{self.port}')
+        await self.server.start()
+        return self.port
+
+    async def stop(self):
+        if self.server is not None:
+            await self.server.stop(grace=None)
+            self.server = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+
+async def serve(host: str, port: int, **kwargs):
+    server = FakeKOSServer(host, port, **kwargs)
+    await server.start()
+    print(f'Fake KOS listening on {host}:{server.port}', flush=True)
+    await server.server.wait_for_termination()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=50051)
+    parser.add_argument('--latency', type=float, default=0.0, help='每次RPC的附加延迟(秒)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='延迟抖动范围(秒)')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--step-locked', action='store_true', help='只在sim.step时推进关节模型')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                      failure_rate=args.failure_rate, realtime=not args.step_locked, seed=args.seed))
+
+
+if __name__ == '__main__':
+    main()
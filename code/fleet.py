@@ -0,0 +1,165 @@
+'''
+多机器人批量推理
+
+一个进程同时控制多台机器人：每帧并发采集所有机器人的传感器数据，观测值直接写入(N, 45)矩阵的对应行，
+一次session.run完成整批推理，再把动作分发回各台机器人
+读取超时或断线的机器人本帧跳过，命令下发不等待，慢的机器人不会拖住整批
+eg:
+python fleet.py --hosts 192.168.42.1:50051 192.168.42.2:50051 --model model_100.onnx
+'''
+
+import argparse
+import asyncio
+import contextlib
+
+import numpy as np
+
+from better_utils import BetterKOS, ObservationBuilder
+from policy_session import InferenceExecutor, load_policy_session
+from profiler import LoopProfiler
+from rate_scheduler import RateScheduler
+
+
+class RobotStats:
+    def __init__(self):
+        self.ticks = 0          # 参与推理并下发命令的帧数
+        self.timeouts = 0       # 传感器读取超时
+        self.errors = 0         # 读取或命令RPC异常
+        self.busy = 0           # 上一帧的命令仍未完成而跳过的帧数
+
+
+class FleetController:
+    '''
+        多机器人批量推理控制器
+        robots: 已连接并完成init的BetterKOS实例，使用同一个策略布局(robots[0].policy_layout)
+        session: 共用的ONNX会话，obs输入的batch维需要是动态的；batch维固定为1时退化为逐台推理
+        read_timeout: 传感器读取超时(秒)，超时的机器人本帧不参与推理
+    '''
+    def __init__(self, robots: list[BetterKOS], session, read_timeout: float = 0.015):
+        self.robots = robots
+        self.session = session
+        self.executor = InferenceExecutor(session)
+        self.read_timeout = read_timeout
+        layout = robots[0].policy_layout
+        builder = ObservationBuilder(layout=layout)
+        self.input_name = builder.input_name
+        self.obs = np.zeros((len(robots), builder.obs.size), dtype=np.float32)
+        for i, robot in enumerate(robots):
+            robot.obs_builder = ObservationBuilder(buffer=self.obs[i], layout=layout)
+        output = layout.action_output
+        self.action_output = session.get_outputs()[output].name if isinstance(output, int) else output
+        batch_dim = session.get_inputs()[0].shape[0]
+        self.batched = not (isinstance(batch_dim, int) and batch_dim == 1)
+        self.stats = [RobotStats() for _ in robots]
+        self.profiler = LoopProfiler()
+        self._commands: list[asyncio.Task | None] = [None] * len(robots)
+
+    async def _read(self, i: int):
+        robot = self.robots[i]
+        try:
+            return await asyncio.wait_for(robot.read_sensors(), self.read_timeout)
+        except asyncio.TimeoutError:
+            self.stats[i].timeouts += 1
+        except Exception:
+            self.stats[i].errors += 1
+        return None
+
+    def _command_done(self, i: int, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            self.stats[i].errors += 1
+
+    async def _infer(self, ready: list[int]) -> np.ndarray:
+        if self.batched:
+            # 整批推理，未就绪机器人的行是上一帧的旧数据，其输出直接丢弃
+            return (await self.executor.run({self.input_name: self.obs}, [self.action_output]))[0]
+        outputs = [None] * len(self.robots)
+        for i in ready:
+            outputs[i] = (await self.executor.run({self.input_name: self.obs[i:i+1]}, [self.action_output]))[0][0]
+        return outputs
+
+    async def tick(self, dt: float):
+        profiler = self.profiler
+        profiler.start_tick()
+        with profiler.stage('sensors'):
+            readers = []
+            for i, task in enumerate(self._commands):
+                if task is not None and not task.done():
+                    self.stats[i].busy += 1
+                    readers.append(None)
+                else:
+                    readers.append(self._read(i))
+            snapshots = [None] * len(self.robots)
+            active = [i for i, reader in enumerate(readers) if reader is not None]
+            for i, snapshot in zip(active, await asyncio.gather(*(readers[i] for i in active))):
+                snapshots[i] = snapshot
+        # 所有机器人每帧都推进步态相位(包括本帧读取超时或命令未完成的)，保持与调度时钟和其他机器人同步
+        for robot in self.robots:
+            robot.advance_phase(dt)
+        ready = [i for i, snapshot in enumerate(snapshots) if snapshot is not None]
+        if not ready:
+            profiler.tick()
+            return
+        with profiler.stage('obs'):
+            dof = {}
+            for i in ready:
+                robot = self.robots[i]
+                dof_pos, dof_vel = robot.layout.from_states(snapshots[i].actuator_states)
+                robot.build_observation(snapshots[i], dof_pos, dof_vel)
+                dof[i] = dof_pos
+        with profiler.stage('inference'):
+            actions = await self._infer(ready)
+        with profiler.stage('command'):
+            for i in ready:
+                robot = self.robots[i]
+                targets = robot.actions_to_targets(actions[i], dof[i])
+                task = asyncio.create_task(robot.command_positions(targets, snapshots[i]))
+                task.add_done_callback(lambda t, i=i: self._command_done(i, t))
+                self._commands[i] = task
+                self.stats[i].ticks += 1
+        profiler.tick()
+
+    async def run(self, frequency: float = 50, num_seconds: float | None = None):
+        scheduler = RateScheduler(frequency)
+        overruns = 0
+        async for dt in scheduler:
+            if num_seconds is not None and scheduler.time >= num_seconds:
+                break
+            self.profiler.miss(scheduler.overruns - overruns)
+            overruns = scheduler.overruns
+            await self.tick(dt)
+        await asyncio.gather(*(task for task in self._commands if task is not None), return_exceptions=True)
+
+    def close(self):
+        self.executor.close()
+
+    def report(self):
+        for robot, stats in zip(self.robots, self.stats):
+            print(f'[Fleet] {robot.ip}:{robot.port} ticks={stats.ticks} timeouts={stats.timeouts} errors={stats.errors} busy={stats.busy}')
+        self.profiler.dump()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hosts', nargs='+', required=True, help='host:port 列表')
+    parser.add_argument('--model', type=str, default='model_100.onnx')
+    parser.add_argument('--frequency', type=float, default=50)
+    parser.add_argument('--num-seconds', type=float, default=None)
+    parser.add_argument('--read-timeout', type=float, default=0.015)
+    args = parser.parse_args()
+
+    session = await load_policy_session(args.model)
+    async with contextlib.AsyncExitStack() as stack:
+        robots = []
+        for address in args.hosts:
+            host, _, port = address.partition(':')
+            robots.append(await stack.enter_async_context(BetterKOS(host, int(port or 50051))))
+        fleet = FleetController(robots, session, args.read_timeout)
+        try:
+            await fleet.run(args.frequency, args.num_seconds)
+        finally:
+            fleet.close()
+            fleet.report()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
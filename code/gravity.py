@@ -0,0 +1,55 @@
+'''
+IMU四元数 -> 机体坐标系下的重力方向(projected gravity)
+
+等价于 Rotation.from_quat([x, y, z, w]).apply([0, 0, -1], inverse=True)，只计算用得到的旋转矩阵第三行，
+每帧没有对象构造和数组分配，结果直接写入观测缓冲区
+IMU坐标系到训练坐标系的轴映射(轴顺序、符号)在构造时确定
+eg:
+projector = GravityProjector(axis_signs=(-1, -1, 1))
+projector(quat.x, quat.y, quat.z, quat.w, out=inputs['projected_gravity.1'])
+与scipy的对比测试见tests/test_gravity.py
+'''
+
+from pathlib import Path
+
+import numpy as np
+
+
+class GravityProjector:
+    '''
+        axis_order: 训练坐标系第i轴取IMU坐标系的第axis_order[i]轴
+        axis_signs: 映射后各轴的符号
+    '''
+    def __init__(self, axis_order=(0, 1, 2), axis_signs=(1, 1, 1)):
+        if sorted(axis_order) != [0, 1, 2]:
+            raise ValueError(f'axis_order必须是0,1,2的排列: {axis_order}')
+        self.axis_order = tuple(int(i) for i in axis_order)
+        self.axis_signs = tuple(float(s) for s in axis_signs)
+        self._buffer = [0.0, 0.0, 0.0]
+
+    @classmethod
+    def from_config(cls, config_path: str | Path) -> 'GravityProjector':
+        # 读取配置文件中的imu段(gravity_axis_order, gravity_axis_signs)
+        import yaml
+        with open(config_path, encoding='utf-8') as f:
+            config = (yaml.safe_load(f) or {}).get('imu') or {}
+        return cls(config.get('gravity_axis_order', (0, 1, 2)), config.get('gravity_axis_signs', (1, 1, 1)))
+
+    def __call__(self, x: float, y: float, z: float, w: float, out: np.ndarray | None = None) -> np.ndarray:
+        n = x*x + y*y + z*z + w*w
+        if n <= 0:
+            raise ValueError('四元数模长为0')
+        s = 2 / n   # 未归一化的四元数按单位四元数处理，与scipy一致
+        # R^T·[0, 0, -1] = -(旋转矩阵第三行)
+        g = self._buffer
+        g[0] = -s * (x*z - w*y)
+        g[1] = -s * (y*z + w*x)
+        g[2] = s * (x*x + y*y) - 1
+        if out is None:
+            out = np.empty(3, dtype=np.float32)
+        order = self.axis_order
+        signs = self.axis_signs
+        out[0] = signs[0] * g[order[0]]
+        out[1] = signs[1] * g[order[1]]
+        out[2] = signs[2] * g[order[2]]
+        return out
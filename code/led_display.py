@@ -0,0 +1,275 @@
+'''
+LED点阵屏显示管线
+
+从内存中取帧(例如camera_grabber.CameraGrabber.latest)，按预先计算的分块边界用np.add.reduceat做面积平均，
+缩小到点阵分辨率(rows × parallel, cols × chain_length)，再以固定帧率推送到屏幕，全程不经过磁盘和PIL缩放
+YUYV帧先在低分辨率下平均Y/U/V，再做颜色转换，转换的像素数只有点阵大小
+渲染(面积平均、颜色转换)和推送(SwapOnVSync会等待刷新)都在单独的工作线程中执行，上一帧还没推送完时跳过本帧，不阻塞事件循环里的控制任务
+没有点阵屏时使用MockMatrix
+eg:
+async with CameraGrabber(V4L2Source('/dev/video0', 640, 480, 'YUYV')) as camera:
+    display = LEDDisplay(RGBMatrixBackend(rows=32, cols=32), camera.latest, 640, 480, 'YUYV', fps=30)
+    await display.run(seconds=10)
+    print(display.stats())
+'''
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from profiler import LoopProfiler
+from rate_scheduler import RateScheduler
+
+
+# BT.601有限范围YUV -> RGB
+YUV_TO_RGB = np.array([
+    [1.164, 0.0, 1.596],
+    [1.164, -0.392, -0.813],
+    [1.164, 2.017, 0.0],
+], dtype=np.float32)
+YUV_OFFSET = np.array([16, 128, 128], dtype=np.float32)
+
+
+class AreaDownsampler:
+    '''
+        面积平均缩小: 把src_shape(高, 宽)均匀分成dst_shape(行, 列)块，每块取平均
+        分块边界和每块像素数的倒数在构造时算好，中间结果和输出都是预分配的float32缓冲区
+        目标比源大时退化为最近邻
+    '''
+    def __init__(self, src_shape: tuple[int, int], dst_shape: tuple[int, int], channels: int | None = None):
+        (height, width), (rows, cols) = src_shape, dst_shape
+        self.rows_index, row_counts = self._edges(height, rows)
+        self.cols_index, col_counts = self._edges(width, cols)
+        extra = () if channels is None else (channels,)
+        self.src_shape = (height, width) + extra
+        self._cols = np.zeros((height, cols) + extra, dtype=np.float32)
+        self.out = np.zeros((rows, cols) + extra, dtype=np.float32)
+        inverse = 1 / np.outer(row_counts, col_counts).astype(np.float32)
+        self._inverse = inverse.reshape((rows, cols) + (1,) * len(extra))
+
+    @staticmethod
+    def _edges(size: int, blocks: int) -> tuple[np.ndarray, np.ndarray]:
+        edges = np.arange(blocks) * size // blocks
+        counts = np.diff(np.append(edges, size))
+        # reduceat在相邻下标相等时直接取该元素，相当于1个像素
+        return edges.astype(np.intp), np.maximum(counts, 1)
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        if image.shape != self.src_shape:
+            raise ValueError(f'输入形状{image.shape}与{self.src_shape}不一致')
+        # 先沿宽度方向累加(对行连续的图像更快)，再沿高度方向
+        np.add.reduceat(image, self.cols_index, axis=1, dtype=np.float32, out=self._cols)
+        np.add.reduceat(self._cols, self.rows_index, axis=0, out=self.out)
+        self.out *= self._inverse
+        return self.out
+
+
+class FrameRenderer:
+    '''
+        帧(YUYV / GREY / RGB3 / BGR3，与camera_grabber的格式一致) -> 点阵大小的RGB uint8图像
+        返回内部缓冲区，下一次调用时会被覆盖
+    '''
+    def __init__(self, width: int, height: int, pixel_format: str, rows: int, cols: int):
+        self.pixel_format = pixel_format
+        self.out = np.zeros((rows, cols, 3), dtype=np.uint8)
+        self._work = np.zeros((rows, cols, 3), dtype=np.float32)
+        if pixel_format == 'YUYV':
+            if width % 2:
+                raise ValueError('YUYV的宽度必须是偶数')
+            self._luma = AreaDownsampler((height, width), (rows, cols))
+            # 每两个像素共用一组[U, V]
+            self._chroma = AreaDownsampler((height, width // 2), (rows, cols), channels=2)
+            self._yuv = np.zeros((rows, cols, 3), dtype=np.float32)
+        elif pixel_format == 'GREY':
+            self._down = AreaDownsampler((height, width), (rows, cols))
+        elif pixel_format in ('RGB3', 'BGR3'):
+            self._down = AreaDownsampler((height, width), (rows, cols), channels=3)
+        else:
+            raise ValueError(f'不支持的像素格式: {pixel_format}')
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        work = self._work
+        if self.pixel_format == 'YUYV':
+            yuv = self._yuv
+            yuv[..., 0] = self._luma(frame[..., 0])
+            yuv[..., 1:] = self._chroma(frame[..., 1].reshape(frame.shape[0], -1, 2))
+            yuv -= YUV_OFFSET
+            np.matmul(yuv, YUV_TO_RGB.T, out=work)
+        elif self.pixel_format == 'GREY':
+            work[...] = self._down(frame)[..., None]
+        elif self.pixel_format == 'BGR3':
+            work[...] = self._down(frame)[..., ::-1]
+        else:
+            work[...] = self._down(frame)
+        np.clip(work, 0, 255, out=work)
+        np.rint(work, out=work)
+        np.copyto(self.out, work, casting='unsafe')
+        return self.out
+
+
+class MockMatrix:
+    '''
+        模拟点阵屏，保存最后一帧
+        push_cost: 每次推送的模拟耗时(秒)，用于模拟SwapOnVSync的等待
+    '''
+    def __init__(self, rows: int = 32, cols: int = 32, chain_length: int = 1, parallel: int = 1, push_cost: float = 0.0):
+        self.height = rows * parallel
+        self.width = cols * chain_length
+        self.push_cost = push_cost
+        self.frame = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        self.pushes = 0
+
+    def push(self, rgb: np.ndarray):
+        np.copyto(self.frame, rgb)
+        if self.push_cost:
+            time.sleep(self.push_cost)
+        self.pushes += 1
+
+    def close(self):
+        pass
+
+
+class RGBMatrixBackend:
+    '''
+        rpi-rgb-led-matrix(rgbmatrix)点阵屏，使用离屏画布双缓冲
+        options: 其他RGBMatrixOptions属性，例如brightness=50, hardware_mapping='adafruit-hat'
+    '''
+    def __init__(self, rows: int = 32, cols: int = 32, chain_length: int = 1, parallel: int = 1, **options):
+        from PIL import Image
+        from rgbmatrix import RGBMatrix, RGBMatrixOptions
+        matrix_options = RGBMatrixOptions()
+        matrix_options.rows = rows
+        matrix_options.cols = cols
+        matrix_options.chain_length = chain_length
+        matrix_options.parallel = parallel
+        for name, value in options.items():
+            setattr(matrix_options, name, value)
+        self._image = Image
+        self.matrix = RGBMatrix(options=matrix_options)
+        self.canvas = self.matrix.CreateFrameCanvas()
+        self.height = rows * parallel
+        self.width = cols * chain_length
+
+    def push(self, rgb: np.ndarray):
+        # frombuffer与数组共享内存，不额外拷贝
+        image = self._image.frombuffer('RGB', (self.width, self.height), rgb, 'raw', 'RGB', 0, 1)
+        self.canvas.SetImage(image)
+        self.canvas = self.matrix.SwapOnVSync(self.canvas)
+
+    def close(self):
+        self.matrix.Clear()
+
+
+class LEDDisplay:
+    '''
+        固定帧率的显示循环
+        backend: MockMatrix / RGBMatrixBackend，或任何有width、height和push(rgb)的对象
+        source: 无参可调用对象，返回要显示的帧(camera_grabber.Frame或数组)，返回None时不更新；
+                Frame的序号没有变化时也不重新渲染
+        threaded: 渲染和推送在工作线程中执行，上一帧未推送完时跳过本帧；渲染期间帧环中的帧不能被覆盖，CameraGrabber的slots至少为2即可满足
+    '''
+    def __init__(self, backend, source, frame_width: int, frame_height: int, pixel_format: str = 'RGB3',
+                 fps: float = 30, threaded: bool = True):
+        self.backend = backend
+        self.source = source
+        self.fps = fps
+        self.renderer = FrameRenderer(frame_width, frame_height, pixel_format, backend.height, backend.width)
+        self.scheduler: RateScheduler | None = None
+        self.profiler = LoopProfiler()
+        self.pushes = 0
+        self.repeated = 0       # 没有新帧，不重新渲染的次数
+        self.busy = 0           # 上一帧还在推送而跳过的次数
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='led-display') if threaded else None
+        self._pending: asyncio.Future | None = None
+        self._last_sequence = None
+        self._running = False
+        self._start_time = None
+        self._end_time = None
+
+    def _push(self, rgb: np.ndarray):
+        start = time.perf_counter()
+        self.backend.push(rgb)
+        self.profiler.record('push', time.perf_counter() - start)
+        self.pushes += 1
+
+    def _render_push(self, frame: np.ndarray):
+        # 工作线程中执行：渲染的耗时记入profiler的render，不计入事件循环中的tick
+        start = time.perf_counter()
+        rgb = self.renderer(frame)
+        self.profiler.record('render', time.perf_counter() - start)
+        self._push(rgb)
+
+    def _next_frame(self) -> np.ndarray | None:
+        frame = self.source()
+        if frame is None:
+            return None
+        sequence = getattr(frame, 'sequence', None)
+        if sequence is not None:
+            if sequence == self._last_sequence:
+                return None
+            self._last_sequence = sequence
+        return getattr(frame, 'data', frame)
+
+    async def run(self, seconds: float | None = None):
+        '''
+            运行显示循环，seconds为None时持续运行直到stop()或任务被取消
+        '''
+        profiler = self.profiler
+        self.scheduler = RateScheduler(self.fps)
+        self._running = True
+        self._start_time = time.monotonic()
+        self._end_time = None
+        loop = asyncio.get_running_loop()
+        try:
+            async for _ in self.scheduler:
+                if not self._running or (seconds is not None and time.monotonic() - self._start_time >= seconds):
+                    break
+                profiler.start_tick()
+                if self._pending is not None and not self._pending.done():
+                    self.busy += 1
+                    profiler.tick()
+                    continue
+                with profiler.stage('fetch'):
+                    frame = self._next_frame()
+                if frame is None:
+                    self.repeated += 1
+                    profiler.tick()
+                    continue
+                if self._pool is not None:
+                    self._pending = loop.run_in_executor(self._pool, self._render_push, frame)
+                else:
+                    with profiler.stage('render'):
+                        rgb = self.renderer(frame)
+                    self._push(rgb)
+                profiler.tick()
+        finally:
+            self._running = False
+            self._end_time = time.monotonic()
+            if self._pending is not None:
+                await asyncio.gather(self._pending, return_exceptions=True)
+                self._pending = None
+
+    def show(self, frame: np.ndarray):
+        # 立即渲染并推送一帧(同步)
+        self._push(self.renderer(getattr(frame, 'data', frame)))
+
+    def stop(self):
+        self._running = False
+
+    def stats(self) -> dict:
+        elapsed = 0.0 if self._start_time is None else (self._end_time or time.monotonic()) - self._start_time
+        return {
+            'fps': self.pushes / elapsed if elapsed > 0 else 0.0,
+            'target_fps': self.fps,
+            'pushes': self.pushes,
+            'repeated': self.repeated,
+            'busy': self.busy,
+            'stages': self.profiler.summary()['stages'],
+        }
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        self.backend.close()
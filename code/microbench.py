@@ -0,0 +1,341 @@
+'''
+热路径微基准测试
+
+逐个测量控制循环里的小函数，报告每秒操作数(ops/s)和内存分配(tracemalloc)，结果可保存为基线JSON并与其他提交比较：
+    transform_position / transform_position2: 单个角度的回绕，wrap_degrees为16个角度的向量化版本
+    onnx_inference: 生成的小模型(obs[1, 45] -> actions[1, 12])，分为每次新建观测构建器和复用构建器两种
+    better_kos_update: BetterKOS.update一帧(传感器解析、观测、推理、动作解码、命令生成)，服务为直接返回预置protobuf响应的替身，推理在当前线程执行
+    walking_prepare: simple_walking每帧的输入准备pykos_controller.prepare_observation(电机状态转弧度、重力方向、按布局写入输入缓冲区)
+    gravity: 四元数 -> 训练坐标系下的重力方向
+内存分配列: alloc为单次操作期间的峰值分配字节数(临时数组等)，retained为多次操作后平均每次留下的字节数(应为0)
+eg:
+python microbench.py                                  # 运行全部用例
+python microbench.py -k onnx --save before.json       # 只运行名称包含onnx的用例并保存基线
+python microbench.py --compare before.json            # 与基线比较，ops/s下降超过阈值的标记为REGRESSION
+python microbench.py --compare before.json --check    # 有回退时返回非0，用于CI
+'''
+
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+
+CASES = {}
+CONFIG_PATH = Path(__file__).resolve().parent / 'onnx' / 'config.yaml'
+
+
+def case(name: str):
+    '''
+        注册用例；被装饰的函数接收临时目录，返回无参的被测函数(普通函数或协程函数)
+    '''
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+@case('transform_position')
+def _transform_position(workdir: Path):
+    from better_utils import transform_position
+    return lambda: transform_position(-543.21)
+
+
+@case('transform_position2')
+def _transform_position2(workdir: Path):
+    from better_utils import transform_position2
+    return lambda: transform_position2(-7.5)
+
+
+@case('wrap_degrees[16]')
+def _wrap_degrees(workdir: Path):
+    from better_utils import wrap_degrees
+    values = np.random.default_rng(0).uniform(-720, 720, 16)
+    out = np.empty_like(values)
+    return lambda: wrap_degrees(values, out)
+
+
+def _sensor_values(rng: np.random.Generator, joints: int) -> tuple[np.ndarray, ...]:
+    return (rng.uniform(-0.5, 0.5, joints), rng.uniform(-1, 1, joints), rng.uniform(-0.5, 0.5, joints),
+            rng.uniform(-0.2, 0.2, 3), rng.uniform(-0.1, 0.1, 3))
+
+
+@case('onnx_inference')
+def _onnx_inference(workdir: Path):
+    from better_utils import OBS_SCALES, onnx_inference
+    from policy_session import create_session
+    from synthetic_policy import make_obs_policy
+    session = create_session(make_obs_policy(workdir / 'obs_policy.onnx'), {'cache_optimized_model': False})
+    dof_pos, dof_vel, actions, ang_vel, euler = _sensor_values(np.random.default_rng(0), 10)
+    commands = np.array([0.1, 0.0, 0.0], dtype=np.float32)
+    default = np.zeros(10)
+    return lambda: onnx_inference(session, 0.25, commands, OBS_SCALES, dof_pos, dof_vel, actions, ang_vel, euler, default)
+
+
+@case('onnx_inference[builder]')
+def _onnx_inference_builder(workdir: Path):
+    from better_utils import OBS_SCALES, ObservationBuilder, onnx_inference
+    from policy_session import create_session
+    from synthetic_policy import make_obs_policy
+    session = create_session(make_obs_policy(workdir / 'obs_policy.onnx'), {'cache_optimized_model': False})
+    dof_pos, dof_vel, actions, ang_vel, euler = _sensor_values(np.random.default_rng(0), 10)
+    commands = np.array([0.1, 0.0, 0.0], dtype=np.float32)
+    default = np.zeros(10)
+    builder = ObservationBuilder(OBS_SCALES, default)
+    return lambda: onnx_inference(session, 0.25, commands, OBS_SCALES, dof_pos, dof_vel, actions, ang_vel, euler,
+                                  default, builder)
+
+
+class _ActuatorService:
+    # 直接返回预置响应的电机服务替身，没有网络和事件循环调度开销
+    def __init__(self, ids, rng: np.random.Generator):
+        from kos_protos import actuator_pb2
+        self.response = actuator_pb2.GetActuatorsStateResponse(states=[
+            actuator_pb2.ActuatorStateResponse(actuator_id=i, position=p, velocity=v, online=True)
+            for i, p, v in zip(ids, rng.uniform(-30, 30, len(ids)), rng.uniform(-5, 5, len(ids)))
+        ])
+
+    async def get_actuators_state(self, actuator_ids=None):
+        return self.response
+
+    async def command_actuators(self, commands):
+        return None
+
+
+class _IMUService:
+    def __init__(self):
+        from kos_protos import imu_pb2
+        self.euler = imu_pb2.EulerAnglesResponse(roll=1.5, pitch=-2.0, yaw=10.0)
+        self.values = imu_pb2.IMUValuesResponse(accel_z=9.81, gyro_x=0.5, gyro_y=-0.3, gyro_z=0.1)
+
+    async def get_euler_angles(self):
+        return self.euler
+
+    async def get_imu_values(self):
+        return self.values
+
+
+class _InlineExecutor:
+    # 在当前线程推理，只测量update本身的计算
+    def __init__(self, session):
+        self.session = session
+
+    async def run(self, feeds: dict, output_names=None) -> list:
+        return self.session.run(output_names, feeds)
+
+
+@case('better_kos_update')
+def _better_kos_update(workdir: Path):
+    from better_utils import ACTUATOR_MAPPING, BetterKOS
+    from policy_session import create_session
+    from synthetic_policy import make_obs_policy
+    rng = np.random.default_rng(0)
+    kos = BetterKOS('127.0.0.1', 0)
+    ids = list(ACTUATOR_MAPPING.values())
+    kos._actuator = _ActuatorService(ids, rng)
+    kos._imu = _IMUService()
+    kos.source_positions.update({i: float(p) for i, p in zip(ids, rng.uniform(-5, 5, len(ids)))})
+    kos._build_joint_layout()
+    kos.session = create_session(make_obs_policy(workdir / 'obs_policy.onnx'), {'cache_optimized_model': False})
+    kos.executor = _InlineExecutor(kos.session)
+    kos.action_output = kos.session.get_outputs()[0].name
+    return lambda: kos.update(0.02)
+
+
+@case('walking_prepare')
+def _walking_prepare(workdir: Path):
+    # 直接测量simple_walking每帧调用的pykos_controller.prepare_observation
+    from kos_protos import actuator_pb2, imu_pb2
+    from gravity import GravityProjector
+    from policy_layout import ObservationEngine, compile_layout, read_layout_spec
+    from policy_session import BoundPolicy, create_session
+    from synthetic_policy import make_walking_policy
+    sys.path.insert(0, str(Path(__file__).resolve().parent / 'onnx'))
+    from pykos_controller import prepare_observation
+    layout = compile_layout(read_layout_spec(CONFIG_PATH))
+    session = create_session(make_walking_policy(workdir / 'walking_policy.onnx'), {'cache_optimized_model': False})
+    policy = BoundPolicy(session, recurrent=layout.recurrent)
+    engine = ObservationEngine(layout, policy.inputs)
+    gravity = GravityProjector.from_config(CONFIG_PATH)
+    rng = np.random.default_rng(0)
+    response = actuator_pb2.GetActuatorsStateResponse(states=[
+        actuator_pb2.ActuatorStateResponse(actuator_id=i, position=p, velocity=v)
+        for i, p, v in zip(layout.ids, rng.uniform(-30, 30, len(layout.ids)), rng.uniform(-5, 5, len(layout.ids)))
+    ])
+    quat = imu_pb2.QuaternionResponse(x=0.02, y=-0.01, z=0.1, w=0.99)
+    signs = layout.signs
+    return lambda: prepare_observation(engine, signs, gravity, response, quat, 1.0)
+
+
+@case('gravity')
+def _gravity(workdir: Path):
+    from gravity import GravityProjector
+    gravity = GravityProjector.from_config(CONFIG_PATH)
+    out = np.zeros(3, dtype=np.float32)
+    return lambda: gravity(0.02, -0.01, 0.1, 0.99, out=out)
+
+
+def _batch(fn, is_async: bool):
+    # 返回执行n次被测函数并返回耗时(秒)的函数；协程函数在同一个事件循环中依次await
+    if is_async:
+        loop = asyncio.new_event_loop()
+
+        async def _repeat(n: int):
+            for _ in range(n):
+                await fn()
+
+        def run(n: int) -> float:
+            start = time.perf_counter()
+            loop.run_until_complete(_repeat(n))
+            return time.perf_counter() - start
+        return run, loop
+
+    def run(n: int) -> float:
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        return time.perf_counter() - start
+    return run, None
+
+
+def measure(fn, min_time: float = 0.2, repeat: int = 5, alloc_runs: int = 100) -> dict:
+    '''
+        测量一个用例
+        先把循环次数翻倍直到一批耗时不少于min_time，再重复repeat批，ops/s取最好的一批和中位数
+        内存分配在计时之后单独用tracemalloc测量(开启tracemalloc会拖慢执行，不影响计时结果)
+    '''
+    # 被测函数返回协程时按异步用例处理
+    result = fn()
+    is_async = asyncio.iscoroutine(result)
+    if is_async:
+        result.close()
+    run, loop = _batch(fn, is_async)
+    try:
+        run(10)     # 预热
+        n = 1
+        while run(n) < min_time / 10:
+            n *= 2
+        n = max(1, int(n * min_time / max(run(n), 1e-9)))
+        rates = sorted(n / run(n) for _ in range(repeat))
+        tracemalloc.start()
+        try:
+            run(1)
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            run(1)
+            _, peak = tracemalloc.get_traced_memory()
+            alloc = peak - before
+            before, _ = tracemalloc.get_traced_memory()
+            run(alloc_runs)
+            after, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        if loop is not None:
+            loop.close()
+    best = rates[-1]
+    return {
+        'ops': best,
+        'ops_median': rates[len(rates) // 2],
+        'us_per_op': 1e6 / best,
+        'loops': n,
+        'alloc_bytes': alloc,
+        'retained_bytes': (after - before) / alloc_runs,
+    }
+
+
+def run_cases(names: list[str], min_time: float = 0.2, repeat: int = 5) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in names:
+            fn = CASES[name](Path(workdir))
+            results[name] = measure(fn, min_time, repeat)
+            print_result(name, results[name])
+    return results
+
+
+def environment() -> dict:
+    # 基线附带的环境信息，只在同一台机器上的结果之间比较才有意义
+    import onnxruntime
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).resolve().parent, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'onnxruntime': onnxruntime.__version__,
+    }
+
+
+def print_result(name: str, result: dict):
+    print(f'[Microbench] {name:<26} {result["ops"]:>12,.0f} ops/s ({result["us_per_op"]:.3f}us/op, '
+          f'median {result["ops_median"]:,.0f}) alloc={result["alloc_bytes"]}B retained={result["retained_bytes"]:.1f}B')
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.1) -> list[str]:
+    '''
+        与基线比较，ops/s下降超过threshold(比例)的用例视为回退，返回回退的用例名
+    '''
+    regressions = []
+    print(f'[Microbench] 与基线比较: commit={baseline["environment"].get("commit")} time={baseline["environment"].get("time")}')
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f'[Microbench] {name:<26} 基线中没有该用例')
+            continue
+        change = result['ops'] / base['ops'] - 1
+        mark = ''
+        if change < -threshold:
+            mark = ' REGRESSION'
+            regressions.append(name)
+        elif change > threshold:
+            mark = ' faster'
+        print(f'[Microbench] {name:<26} {base["ops"]:>12,.0f} -> {result["ops"]:>12,.0f} ops/s ({change:+.1%}) '
+              f'alloc {base["alloc_bytes"]} -> {result["alloc_bytes"]}B{mark}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-k', dest='pattern', default=None, help='只运行名称包含该字符串的用例')
+    parser.add_argument('--list', action='store_true', help='列出用例')
+    parser.add_argument('--min-time', type=float, default=0.2, help='每批的最短耗时(秒)')
+    parser.add_argument('--repeat', type=int, default=5, help='每个用例的批数')
+    parser.add_argument('--save', default=None, help='结果保存为基线JSON')
+    parser.add_argument('--compare', default=None, help='与基线JSON比较')
+    parser.add_argument('--threshold', type=float, default=0.1, help='ops/s下降超过该比例视为回退')
+    parser.add_argument('--check', action='store_true', help='有回退时以返回码1退出')
+    args = parser.parse_args()
+
+    names = [name for name in CASES if args.pattern is None or args.pattern in name]
+    if args.list:
+        print('\n'.join(names))
+        return
+    results = run_cases(names, args.min_time, args.repeat)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions and args.check:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,441 @@
+'''
+多进程控制运行时
+
+BetterKOS.loop中gRPC I/O、观测构建、推理和遥测共用一个asyncio线程和一个GIL；多进程模式下拆成：
+    I/O进程(调用run的进程): 按固定频率读取传感器、发布快照、等待动作并下发命令
+    推理进程: 等待新快照，构建观测、推理、解码动作并发布
+    遥测进程(可选): 按顺序取出每一帧的观测、动作和传感器读数写入遥测文件
+进程之间通过multiprocessing.shared_memory中的环形槽交换定长记录(SharedRing)，不经过pickle；
+每个槽带写入前后两个序号，读者拷贝后校验序号，读到正在被改写的槽时丢弃；新数据用信号量通知
+每个进程可以绑定到单独的CPU核(cpus)，避免与其他进程互相抢占
+eg:
+runtime = MultiProcessRuntime('model_100.onnx', cpus={'io': 1, 'inference': 2, 'telemetry': 3}, telemetry_path='run.tlm')
+async with BetterKOS('192.168.42.1') as kos:
+    await runtime.run(kos, seconds=60)
+print(runtime.stats())
+'''
+
+import asyncio
+import multiprocessing
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+
+from profiler import Histogram, LoopProfiler
+from rate_scheduler import RateScheduler
+
+
+ROLES = ('io', 'inference', 'telemetry')
+_HEADER = np.dtype([('head', '<i8')])
+
+
+def pin_to_cpu(cpu: int | None) -> set[int] | None:
+    # 把当前进程绑定到指定的CPU核，返回原来的亲和性(用于恢复)；没有绑定或不支持的平台上返回None
+    if cpu is None or not hasattr(os, 'sched_setaffinity'):
+        return None
+    previous = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, {cpu})
+    return previous
+
+
+class SharedRing:
+    '''
+        共享内存中的定长记录环
+        fields: 记录的字段(numpy结构化dtype的字段列表)，会自动加上序号字段begin/end
+        写入: slot = ring.begin(); ring.fields['x'][slot] = ...; ring.commit(slot)
+        读取: seq = ring.read_latest(out) 或 ring.read(seq, out)，out为长度1的结构化数组
+        只允许一个写者；spec可传给子进程用attach重新打开
+    '''
+    def __init__(self, fields: list, slots: int = 8, name: str | None = None, create: bool = True):
+        self.dtype = np.dtype([('begin', '<i8')] + list(fields) + [('end', '<i8')], align=True)
+        self.slots = slots
+        size = _HEADER.itemsize + self.dtype.itemsize * slots
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            # 子进程由multiprocessing启动，与创建者共用resource_tracker，由创建者负责unlink
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.owner = create
+        buffer = self.shm.buf
+        self._head = np.ndarray((1,), dtype='<i8', buffer=buffer)
+        self.records = np.ndarray((slots,), dtype=self.dtype, buffer=buffer, offset=_HEADER.itemsize)
+        if create:
+            self._head[0] = 0
+            self.records['begin'] = -1
+            self.records['end'] = -1
+        self.fields = {name: self.records[name] for name in self.dtype.names}
+        self._begin = self.fields['begin']
+        self._end = self.fields['end']
+
+    @property
+    def spec(self) -> tuple:
+        return ([(name, *field) for name, field in self._payload()], self.slots, self.shm.name)
+
+    def _payload(self):
+        for name in self.dtype.names[1:-1]:
+            base, shape = self.dtype.fields[name][0].base, self.dtype.fields[name][0].shape
+            yield name, (base.str, shape) if shape else (base.str,)
+
+    @classmethod
+    def attach(cls, spec: tuple) -> 'SharedRing':
+        fields, slots, name = spec
+        return cls([tuple(field) for field in fields], slots, name, create=False)
+
+    @property
+    def head(self) -> int:
+        # 已提交的最新序号(从1开始，0为还没有数据)
+        return int(self._head[0])
+
+    def begin(self) -> int:
+        seq = self.head + 1
+        slot = seq % self.slots
+        self._end[slot] = -1
+        self._begin[slot] = seq
+        return slot
+
+    def commit(self, slot: int):
+        seq = self._begin[slot]
+        self._end[slot] = seq
+        self._head[0] = seq
+
+    def read(self, seq: int, out: np.ndarray) -> bool:
+        # 读取序号为seq的记录，已被覆盖或正在被改写时返回False
+        slot = seq % self.slots
+        if self._end[slot] != seq:
+            return False
+        out[0] = self.records[slot]
+        # 拷贝期间写者开始改写这个槽时begin会变化
+        return self._begin[slot] == seq and self._end[slot] == seq
+
+    def read_latest(self, out: np.ndarray) -> int:
+        # 读取最新的记录，返回其序号，没有数据时返回0
+        for _ in range(3):
+            seq = self.head
+            if seq == 0 or self.read(seq, out):
+                return seq
+        return 0
+
+    def empty_record(self) -> np.ndarray:
+        return np.zeros(1, dtype=self.dtype)
+
+    def close(self):
+        self.fields.clear()
+        del self._head, self._begin, self._end, self.records
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def sensor_fields(joint_count: int) -> list:
+    return [
+        ('timestamp', '<f8'),           # 传感器读数返回的时间(单调时钟)
+        ('phase', '<f8'),
+        ('commands', '<f4', (3,)),
+        ('raw_pos', '<f8', (joint_count,)),     # 策略顺序的电机原始位置(度)
+        ('raw_vel', '<f8', (joint_count,)),
+        ('imu', '<f4', (6,)),           # [gyro_x, gyro_y, gyro_z, roll, pitch, yaw]，度/秒、度
+    ]
+
+
+def action_fields(joint_count: int, action_size: int, obs_size: int) -> list:
+    return [
+        ('sensor_seq', '<i8'),          # 对应的传感器快照序号
+        ('timestamp', '<f8'),           # 对应快照的时间
+        ('inference_time', '<f8'),
+        ('targets', '<f8', (joint_count,)),     # 策略空间的目标位置(度)
+        ('actions', '<f4', (action_size,)),
+        ('obs', '<f4', (obs_size,)),
+        ('raw_pos', '<f8', (joint_count,)),
+        ('raw_vel', '<f8', (joint_count,)),
+        ('imu', '<f4', (6,)),
+    ]
+
+
+def _output_size(model_path: str | Path, output: str | int) -> tuple[str, int]:
+    # 在父进程中读取动作输出的名称和长度，用于确定共享内存记录的布局(不做图优化，不预热)
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+    session = ort.InferenceSession(str(model_path), options, providers=['CPUExecutionProvider'])
+    outputs = session.get_outputs()
+    info = outputs[output] if isinstance(output, int) else next(o for o in outputs if o.name == output)
+    size = info.shape[-1]
+    if not isinstance(size, int):
+        raise ValueError(f'动作输出{info.name}的长度不固定: {info.shape}')
+    return info.name, size
+
+
+def _inference_main(config: dict, sensor_spec, action_spec, sensor_ready, action_ready, ready, stop, results):
+    # 推理进程入口
+    pin_to_cpu(config['cpu'])
+    from better_utils import JointLayout, ObservationBuilder
+    from policy_session import create_session, warmup_session
+
+    sensors = SharedRing.attach(sensor_spec)
+    actions = SharedRing.attach(action_spec)
+    layout = config['layout']
+    session = create_session(config['model_path'], config['session_options'])
+    warmup_session(session, config['session_options'].get('warmup_runs', 0))
+    builder = ObservationBuilder(layout=layout)
+    joints = JointLayout(layout.ids, config['wrong_direction'], config['source_positions'])
+    output_names = [config['action_output']]
+    record = sensors.empty_record()
+    last_actions = np.zeros(config['action_size'], dtype=np.float32)
+    fields = actions.fields
+    inference_time = Histogram()
+    runs = skipped = torn = 0
+    last_seq = 0
+    ready.set()
+    try:
+        while not stop.is_set():
+            if not sensor_ready.acquire(timeout=0.05):
+                continue
+            while sensor_ready.acquire(False):
+                pass
+            seq = sensors.read_latest(record)
+            if seq == 0:
+                torn += 1
+                continue
+            if seq <= last_seq:
+                continue
+            skipped += max(seq - last_seq - 1, 0) if last_seq else 0
+            last_seq = seq
+            r = record[0]
+            dof_pos, dof_vel = joints.from_raw(r['raw_pos'], r['raw_vel'])
+            imu = r['imu'].astype(np.float64) * (np.pi / 180)
+            builder.build(float(r['phase']), r['commands'], dof_pos, dof_vel, last_actions, imu[:3], imu[3:])
+            start = time.perf_counter()
+            outputs = session.run(output_names, builder.feeds)
+            elapsed = time.perf_counter() - start
+            inference_time.record(elapsed)
+            # 与BetterKOS.actions_to_targets一致: 解码(可能原地回绕)后的动作作为下一帧的prev_actions
+            targets = builder.decode(outputs[0][0], dof_pos)
+            last_actions[:] = outputs[0][0]
+            slot = actions.begin()
+            fields['sensor_seq'][slot] = seq
+            fields['timestamp'][slot] = r['timestamp']
+            fields['inference_time'][slot] = elapsed
+            fields['targets'][slot] = targets
+            fields['actions'][slot] = last_actions
+            fields['obs'][slot] = builder.obs
+            fields['raw_pos'][slot] = r['raw_pos']
+            fields['raw_vel'][slot] = r['raw_vel']
+            fields['imu'][slot] = r['imu']
+            actions.commit(slot)
+            action_ready.release()
+            runs += 1
+    finally:
+        results.put(('inference', {'runs': runs, 'skipped': skipped, 'torn': torn, 'inference': inference_time.summary()}))
+        sensors.close()
+        actions.close()
+
+
+def _telemetry_main(config: dict, action_spec, ready, stop, results):
+    # 遥测进程入口：按序号顺序取出每一帧，环被覆盖的部分计入dropped
+    pin_to_cpu(config['cpu'])
+    from telemetry import TelemetryRecorder, record_dtype
+
+    actions = SharedRing.attach(action_spec)
+    dtype = record_dtype(config['obs_size'], config['action_size'], config['joint_count'])
+    recorder = TelemetryRecorder(config['path'], dtype)
+    record = actions.empty_record()
+    written = dropped = 0
+    next_seq = 1
+    ready.set()
+    try:
+        while True:
+            stopping = stop.is_set()
+            head = actions.head
+            if head - next_seq >= actions.slots:
+                dropped += head - next_seq - actions.slots + 1
+                next_seq = head - actions.slots + 1
+            while next_seq <= head:
+                if actions.read(next_seq, record):
+                    r = record[0]
+                    recorder.record(r['timestamp'], r['obs'], r['actions'], r['raw_pos'], r['raw_vel'], r['imu'])
+                    written += 1
+                else:
+                    dropped += 1
+                next_seq += 1
+            if stopping:
+                break
+            time.sleep(config['interval'])
+    finally:
+        recorder.close()
+        results.put(('telemetry', {'records': written, 'dropped': dropped + recorder.dropped}))
+        actions.close()
+
+
+class MultiProcessRuntime:
+    '''
+        多进程运行时
+        model_path: 策略模型
+        session_options: 推理会话配置(见policy_session.SESSION_OPTIONS)
+        frequency: 控制频率(Hz)
+        cpus: 角色('io'/'inference'/'telemetry') -> CPU核编号，不指定的角色不绑定
+        telemetry_path: 遥测文件，None时不启动遥测进程
+        action_timeout: 每帧等待本帧动作的最长时间(秒)，默认半个周期；超时时下发最近一次的动作并计入stale
+        slots: 共享内存环的槽数
+    '''
+    def __init__(self, model_path: str | Path, session_options: dict | None = None, frequency: float = 50,
+                 cpus: dict[str, int] | None = None, telemetry_path: str | Path | None = None,
+                 action_timeout: float | None = None, slots: int = 64, start_timeout: float = 60.0):
+        self.model_path = Path(model_path)
+        self.session_options = dict(session_options or {})
+        self.frequency = frequency
+        self.cpus = dict(cpus or {})
+        unknown = set(self.cpus) - set(ROLES)
+        if unknown:
+            raise ValueError(f'未知的进程角色: {unknown}，可选 {ROLES}')
+        self.telemetry_path = None if telemetry_path is None else Path(telemetry_path)
+        self.action_timeout = 0.5 / frequency if action_timeout is None else action_timeout
+        self.slots = slots
+        self.start_timeout = start_timeout
+        self.scheduler: RateScheduler | None = None
+        self.profiler = LoopProfiler()
+        self.stale = 0          # 超时未等到本帧动作、下发旧动作的帧数
+        self.missing = 0        # 还没有任何动作可下发的帧数
+        self.children: dict[str, dict] = {}
+
+    async def run(self, kos, seconds: float | None = None):
+        '''
+            kos: 已初始化的BetterKOS(零位已读取)，在本进程中负责I/O
+            seconds: 运行时长，None时持续运行直到任务被取消
+        '''
+        layout = kos.policy_layout
+        joints = kos.layout
+        n = joints.size
+        obs_size = sum(compiled.size for compiled in layout.inputs.values())
+        action_output, action_size = _output_size(self.model_path, kos.action_output)
+        context = multiprocessing.get_context('spawn')
+        sensors = SharedRing(sensor_fields(n), self.slots)
+        actions = SharedRing(action_fields(n, action_size, obs_size), self.slots)
+        sensor_ready, action_ready = context.Semaphore(0), context.Semaphore(0)
+        stop = context.Event()
+        results = context.Queue()
+        processes = []
+        previous_cpus = None
+        try:
+            inference_ready = context.Event()
+            processes.append(context.Process(target=_inference_main, name='kos-inference', daemon=True, args=({
+                'cpu': self.cpus.get('inference'),
+                'model_path': str(self.model_path),
+                'session_options': self.session_options,
+                'layout': layout,
+                'wrong_direction': {int(i) for i, s in zip(joints.id_list, joints.signs) if s < 0},
+                'source_positions': dict(kos.source_positions),
+                'action_output': action_output,
+                'action_size': action_size,
+            }, sensors.spec, actions.spec, sensor_ready, action_ready, inference_ready, stop, results)))
+            waits = [inference_ready]
+            if self.telemetry_path is not None:
+                telemetry_ready = context.Event()
+                processes.append(context.Process(target=_telemetry_main, name='kos-telemetry', daemon=True, args=({
+                    'cpu': self.cpus.get('telemetry'),
+                    'path': str(self.telemetry_path),
+                    'obs_size': obs_size,
+                    'action_size': action_size,
+                    'joint_count': n,
+                    'interval': 0.05,
+                }, actions.spec, telemetry_ready, stop, results)))
+                waits.append(telemetry_ready)
+            for process in processes:
+                process.start()
+            # 子进程启动后再绑定I/O核(子进程会继承亲和性)，结束时恢复，不影响调用方之后的工作
+            previous_cpus = pin_to_cpu(self.cpus.get('io'))
+            # 子进程加载模型、预热完成后再开始控制循环
+            deadline = time.monotonic() + self.start_timeout
+            for event in waits:
+                while not event.is_set():
+                    if time.monotonic() > deadline or not all(p.is_alive() for p in processes):
+                        raise RuntimeError('子进程启动失败')
+                    await asyncio.sleep(0.05)
+            if kos.command_stepper is not None:
+                kos.command_stepper.start()
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix='action-wait') as waiter:
+                await self._loop(kos, sensors, actions, sensor_ready, action_ready, waiter, seconds)
+        finally:
+            if previous_cpus is not None:
+                os.sched_setaffinity(0, previous_cpus)
+            if kos.command_stepper is not None:
+                await kos.command_stepper.stop()
+            stop.set()
+            for process in processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            while True:
+                try:
+                    role, stats = results.get_nowait()
+                except queue.Empty:
+                    break
+                self.children[role] = stats
+            sensors.close()
+            actions.close()
+
+    async def _loop(self, kos, sensors: SharedRing, actions: SharedRing, sensor_ready, action_ready, waiter, seconds):
+        loop = asyncio.get_running_loop()
+        joints = kos.layout
+        profiler = self.profiler
+        fields = sensors.fields
+        action = actions.empty_record()
+        action_seq = 0
+        self.scheduler = scheduler = RateScheduler(self.frequency)
+        overruns = 0
+        async for dt in scheduler:
+            if seconds is not None and scheduler.time >= seconds:
+                break
+            profiler.miss(scheduler.overruns - overruns)
+            overruns = scheduler.overruns
+            profiler.start_tick()
+            kos.advance_phase(dt)
+            with profiler.stage('sensors'):
+                snapshot = await kos.read_sensors()
+            with profiler.stage('publish'):
+                joints.load_states(snapshot.actuator_states)
+                imu = snapshot.imu_values
+                euler = snapshot.euler_angles
+                slot = sensors.begin()
+                fields['timestamp'][slot] = snapshot.timestamp
+                fields['phase'][slot] = kos.phase
+                fields['commands'][slot] = kos.move_commands
+                fields['raw_pos'][slot] = joints.raw_pos
+                fields['raw_vel'][slot] = joints.raw_vel
+                fields['imu'][slot] = (imu.gyro_x, imu.gyro_y, imu.gyro_z, euler.roll, euler.pitch, euler.yaw)
+                sensors.commit(slot)
+                seq = sensors.head
+                sensor_ready.release()
+            with profiler.stage('wait'):
+                # 在线程中等待信号量，事件循环不被阻塞
+                deadline = time.monotonic() + self.action_timeout
+                while action_seq < seq:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not await loop.run_in_executor(waiter, action_ready.acquire, True, remaining):
+                        break
+                    latest = actions.read_latest(action)
+                    if latest:
+                        action_seq = int(action['sensor_seq'][0])
+            if action_seq == 0:
+                self.missing += 1
+                profiler.tick()
+                continue
+            if action_seq < seq:
+                self.stale += 1
+            with profiler.stage('command'):
+                await kos.command_positions(action['targets'][0], snapshot)
+            profiler.record('action_age', time.monotonic() - float(action['timestamp'][0]))
+            profiler.tick()
+
+    def stats(self) -> dict:
+        return {
+            'scheduler': None if self.scheduler is None else self.scheduler.stats(),
+            'stale': self.stale,
+            'missing': self.missing,
+            'stages': self.profiler.summary()['stages'],
+            **self.children,
+        }
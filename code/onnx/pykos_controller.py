@@ -4,119 +4,184 @@ import argparse
 import asyncio
 import logging
 import math
-import time
-from dataclasses import dataclass
+import sys
 from pathlib import Path
 
 import colorlogging
 import numpy as np
-import onnxruntime as ort
 from pykos import KOS
-from scipy.spatial.transform import Rotation as R
+
+# 共享code目录下的工具模块
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from actuator_setup import configure_actuators  # noqa: E402
+from command_stepper import CommandStepper  # noqa: E402
+from gravity import GravityProjector  # noqa: E402
+from policy_layout import ObservationEngine, compile_layout, read_layout_spec  # noqa: E402
+from policy_session import POLICY_VARIANTS, BoundPolicy, InferenceExecutor, load_policy_session, read_session_options  # noqa: E402
+from profiler import LoopProfiler  # noqa: E402
+from rate_scheduler import RateScheduler, SimStepScheduler  # noqa: E402
 
 logger = logging.getLogger(__name__)
 # 设置一个日志记录器，用于日志输出，__name__表示当前模块的名字
 
 
-@dataclass
-class Actuator:
-    actuator_id: int
-    nn_id: int
-    kp: float
-    kd: float
-    max_torque: float
-    joint_name: str
-"""
-这是一个数据类，表示机器人中的一个执行器（例如，机器人关节的电动机）具体参数：
-actuator_id: 执行器的ID
-nn_id: 神经网络中的ID
-kp: 比例增益
-kd: 微分增益
-max_torque: 最大扭矩
-joint_name: 执行器对应的关节名称
-"""
-
-# ACTUATOR_LIST 是一个包含多个 Actuator 实例的列表，表示机器人不同关节的执行器
+# 关节映射(策略顺序、电机ID、增益、默认位置)、观测输入和动作解码都在config.yaml的policy段中声明
 # 映射关系已经对应实机进行修改
 # 本控制代码是行走的控制，故上肢锁定
-ACTUATOR_LIST: list[Actuator] = [
-    Actuator(actuator_id=31, nn_id=0, kp=300.0, kd=5.0, max_torque=40.0, joint_name="left_hip_pitch_04"),
-    Actuator(actuator_id=32, nn_id=1, kp=120.0, kd=5.0, max_torque=30.0, joint_name="left_hip_roll_03"),
-    Actuator(actuator_id=33, nn_id=2, kp=120.0, kd=5.0, max_torque=30.0, joint_name="left_hip_yaw_03"),
-    Actuator(actuator_id=34, nn_id=3, kp=300.0, kd=5.0, max_torque=40.0, joint_name="left_knee_04"),
-    Actuator(actuator_id=35, nn_id=4, kp=40.0, kd=5.0, max_torque=10.0, joint_name="left_ankle_02"),
-    Actuator(actuator_id=41, nn_id=5, kp=300.0, kd=5.0, max_torque=40.0, joint_name="right_hip_pitch_04"),
-    Actuator(actuator_id=42, nn_id=6, kp=120.0, kd=5.0, max_torque=30.0, joint_name="right_hip_roll_03"),
-    Actuator(actuator_id=43, nn_id=7, kp=120.0, kd=5.0, max_torque=30.0, joint_name="right_hip_yaw_03"),
-    Actuator(actuator_id=44, nn_id=8, kp=300.0, kd=5.0, max_torque=40.0, joint_name="right_knee_04"),
-    Actuator(actuator_id=45, nn_id=9, kp=40.0, kd=5.0, max_torque=10.0, joint_name="right_ankle_02"),
-    # Actuator(actuator_id=11, nn_id=10, kp=..., kd=..., max_torque=..., joint_name="left_shoulder_yaw"),
-    # Actuator(actuator_id=12, nn_id=11, kp=..., kd=..., max_torque=..., joint_name="left_shoulder_pitch"),
-    # Actuator(actuator_id=13, nn_id=12, kp=..., kd=..., max_torque=..., joint_name="left_elbow"),
-    # Actuator(actuator_id=21, nn_id=13, kp=..., kd=..., max_torque=..., joint_name="right_shoulder_yaw"),
-    # Actuator(actuator_id=22, nn_id=14, kp=..., kd=..., max_torque=..., joint_name="right_shoulder_pitch"),
-    # Actuator(actuator_id=23, nn_id=15, kp=..., kd=..., max_torque=..., joint_name="right_elbow"),
-
-]
-# 将执行器ID映射到对应的神经网络ID。这个字典方便后续将执行器的动作与神经网络的输出进行对应
-ACTUATOR_ID_TO_POLICY_IDX = {actuator.actuator_id: actuator.nn_id for actuator in ACTUATOR_LIST}
-
-# 提取出所有执行器的ID，生成一个列表
-ACTUATOR_IDS = [actuator.actuator_id for actuator in ACTUATOR_LIST]
+CONFIG_PATH = Path(__file__).parent / "config.yaml"
+
+# 每帧的观测准备，控制循环和microbench.py的walking_prepare用例共用
+def prepare_observation(
+    engine: ObservationEngine,
+    signs: np.ndarray,
+    gravity: GravityProjector,
+    response,
+    quat,
+    time: float,
+) -> np.ndarray:
+    """Writes one tick of sensor readings into the policy inputs.
+
+    Args:
+        engine: The observation engine whose signals feed the bound input buffers.
+        signs: The per-joint direction signs of the policy layout.
+        gravity: Projects the IMU quaternion to the gravity vector in the training frame.
+        response: The GetActuatorsStateResponse, states in the policy joint order.
+        quat: The IMU quaternion response.
+        time: The control loop time in seconds.
+
+    Returns:
+        The projected gravity vector (a view of the "gravity" signal).
+    """
+    signals = engine.signals
+    dof_pos = signals["dof_pos"]
+    dof_vel = signals["dof_vel"]
+    # 执行器的角度(度)一次遍历原地写入，不构建中间列表，然后转换为弧度(策略方向)
+    for i, state in enumerate(response.states):
+        dof_pos[i] = state.position
+        dof_vel[i] = state.velocity
+    np.radians(dof_pos, out=dof_pos)
+    np.radians(dof_vel, out=dof_vel)
+    dof_pos *= signs
+    dof_vel *= signs
+    # 由IMU四元数计算机体坐标系下的重力方向，轴映射到训练时的坐标系
+    g = gravity(quat.x, quat.y, quat.z, quat.w, out=signals["gravity"])
+    signals["time"][0] = time
+    # 由观测引擎按布局写入各输入缓冲区
+    engine.compute()
+    return g
+
 
 """
 这是一个异步函数，模拟机器人行走的过程。参数：
 model_path: ONNX模型文件的路径
-default_position: 机器人的默认关节位置
+default_position: 机器人的默认关节位置，None时使用config.yaml中的默认位置
 host: 连接的主机地址
 port: 连接的端口
 num_seconds: 模拟运行的时长
+profiler: 分段耗时统计(传感器、观测构建、推理、后处理、命令)
+command_rate: 命令子步进频率(Hz)，设置后策略帧之间插值并按该频率下发，None时每个策略帧下发一次
+variant: 模型变体(fp32 / int8 / fp16，由quantize_policy.py生成)，None时使用config.yaml中onnx段的设置
+step_locked: 步进锁定，不按墙钟时间等待，每帧调用sim.step推进仿真一个周期，仿真能算多快就跑多快(仿真评估用)
+command: 运动指令[x_vel, y_vel, yaw_vel]，None时使用config.yaml中的指令
 """
 async def simple_walking(
     model_path: str | Path,
-    default_position: list[float],
+    default_position: list[float] | None,
     host: str,
     port: int,
     num_seconds: float | None = 10.0,
-) -> None:
+    profiler: LoopProfiler | None = None,
+    command_rate: float | None = None,
+    variant: str | None = None,
+    step_locked: bool = False,
+    command: list[float] | None = None,
+) -> dict:
     """Runs a simple walking policy.
 
     Args:
         model_path: The path to the ONNX model.
-        default_position: The default joint positions for the legs.
+        default_position: The default joint positions for the legs, overrides the
+            defaults of the policy layout in config.yaml if given.
         host: The host to connect to.
         port: The port to connect to.
         num_seconds: The number of seconds to run the policy for.
+        profiler: Collects per-stage latency histograms, a default one is created if None.
+        command_rate: If given, targets are interpolated between policy ticks and
+            streamed at this rate (Hz) by a command sub-stepper.
+        variant: The model variant to load (fp32, int8 or fp16, see quantize_policy.py),
+            overrides the variant in the onnx section of config.yaml.
+        step_locked: If True, the loop advances the simulator by one policy
+            period with sim.step every tick instead of waiting for the clock.
+        command: The [x_vel, y_vel, yaw_vel] command, overrides config.yaml if given.
+
+    Returns:
+        The scheduler statistics of the control loop, the episode metrics under
+        "episode", plus the sub-stepper statistics under "command" when
+        command_rate is given.
     """
-    assert len(default_position) == len(ACTUATOR_LIST)
+    if profiler is None:
+        profiler = LoopProfiler()
+    if step_locked and command_rate is not None:
+        raise ValueError("command_rate is not supported in step-locked mode")
+
+# 读取并编译策略布局
+    config_path = CONFIG_PATH
+    spec = read_layout_spec(config_path)
+    if default_position is not None:
+        assert len(default_position) == len(spec["joints"])
+        for joint, pos in zip(spec["joints"], default_position):
+            joint["default"] = pos
+    if command is not None:
+        spec["command"] = list(command)
+    layout = compile_layout(spec)
+    actuator_ids = layout.ids
+    signs = layout.signs
 
 # 检查指定的模型文件是否存在，如果不存在，则抛出
     model_path = Path(model_path)
     if not model_path.exists():
         raise FileNotFoundError(f"Model file not found: {model_path}")
 
-# 使用ONNX Runtime加载并创建一个会话，用于推理
-    session = ort.InferenceSession(model_path)
-
-# 获取模型输出的详细信息
-    output_details = [{"name": x.name, "shape": x.shape, "type": x.type} for x in session.get_outputs()]
-
-# 接受输入数据并通过ONNX模型运行推理，返回输出
-    def policy(input_data: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
-        results = session.run(None, input_data)
-        return {output_details[i]["name"]: results[i] for i in range(len(output_details))}
+# 按config.yaml中的onnx段创建会话(图优化、线程数、优化模型缓存)，并在进入控制循环前预热
+    session_options = read_session_options(config_path)
+    if variant is not None:
+        session_options["variant"] = variant
+    session = await load_policy_session(model_path, session_options)
+
+# IMU坐标系到训练坐标系的轴映射见config.yaml的imu段
+    gravity = GravityProjector.from_config(config_path)
+
+# IO binding推理：输入输出都是预分配的float32缓冲区，循环输出(x.3历史缓冲、actions)双缓冲后直接作为下一帧的输入
+    # 其余输入由观测引擎按布局直接写入绑定的缓冲区
+    policy = BoundPolicy(session, recurrent=layout.recurrent)
+    engine = ObservationEngine(layout, policy.inputs)
+    dof_pos = engine.signals["dof_pos"]
+    outputs = policy.outputs
+    action_output = layout.action_output
+    if isinstance(action_output, int):
+        action_output = session.get_outputs()[action_output].name
 
 # 之后的部分即为配置执行器（电机）和仿真运行
     # 通过 KOS 与模拟器建立连接，并配置每个执行器的参数
     async with KOS(ip=host, port=port) as sim_kos:
-        for actuator in ACTUATOR_LIST:
-            await sim_kos.actuator.configure_actuator(
-                actuator_id=actuator.actuator_id,
-                kp=actuator.kp,
-                kd=actuator.kd,
-                max_torque=actuator.max_torque,
-                torque_enabled=True,
-            )
+        # 并发配置所有腿部电机(带重试)，仿真中会reset到默认位姿，不需要读取零位
+        report = await configure_actuators(
+            sim_kos.actuator,
+            [
+                {
+                    "actuator_id": joint.actuator_id,
+                    "kp": joint.kp,
+                    "kd": joint.kd,
+                    "max_torque": joint.max_torque,
+                    "torque_enabled": True,
+                }
+                for joint in layout.joints
+            ],
+            read_positions=False,
+        )
+        if not report.ok:
+            raise RuntimeError(f"Failed to configure actuators: {report.failed}")
+        logger.info("Configured %d actuators in %.1f ms (%d retries)", len(actuator_ids), report.elapsed * 1e3, report.retries)
 
         try:
             # 设置初始位姿
@@ -125,95 +190,102 @@ async def simple_walking(
                 quat={"x": 0.0, "y": 0.0, "z": 0.0, "w": 1.0},
                 joints=[
                     {
-                        "name": actuator.joint_name,
-                        "pos": pos,
+                        "name": joint.name,
+                        "pos": joint.default,
                     }
-                    for actuator, pos in zip(ACTUATOR_LIST, default_position)
+                    for joint in layout.joints
                 ],
             )
         except Exception:
             logger.warning("Failed to reset simulation")
 
-        start_time = time.time()
-        end_time = None if num_seconds is None else start_time + num_seconds
-
-        default = np.array(default_position)
-        target_q = np.zeros(10, dtype=np.double)
-        prev_actions = np.zeros(10, dtype=np.double)
-        hist_obs = np.zeros(570, dtype=np.double)
-
-        input_data = {
-            "x_vel.1": np.zeros(1).astype(np.float32),
-            "y_vel.1": np.zeros(1).astype(np.float32),
-            "rot.1": np.zeros(1).astype(np.float32),
-            "t.1": np.zeros(1).astype(np.float32),
-            "dof_pos.1": np.zeros(10).astype(np.float32),
-            "dof_vel.1": np.zeros(10).astype(np.float32),
-            "prev_actions.1": np.zeros(10).astype(np.float32),
-            "projected_gravity.1": np.zeros(3).astype(np.float32),
-            "buffer.1": np.zeros(570).astype(np.float32),
-    }
-
-        x_vel_cmd = 1.0
-        y_vel_cmd = 0.0
-        yaw_vel_cmd = 0.0
+        raw_targets = np.zeros(len(actuator_ids), dtype=np.float32)
         frequency = 50
 
-        start_time = time.time()
-        next_time = start_time + 1 / frequency
-
-        while end_time is None or time.time() < end_time:
-            # 获取执行器的状态和IMU（惯性测量单元）的四元数
-            response, raw_quat = await asyncio.gather(
-                sim_kos.actuator.get_actuators_state(ACTUATOR_IDS),
-                sim_kos.imu.get_quaternion(),
-            )
-            # 将执行器的角度转换为弧度，获取IMU的旋转四元数并转换为旋转矩阵
-            positions = np.array([math.radians(state.position) for state in response.states])
-            velocities = np.array([math.radians(state.velocity) for state in response.states])
-            r = R.from_quat([raw_quat.x, raw_quat.y, raw_quat.z, raw_quat.w])
-
-            gvec = r.apply(np.array([0.0, 0.0, -1.0]), inverse=True).astype(np.double)
-
-            # Need to apply a transformation from the IMU frame to the frame
-            # that we used to train the original model.
-            gvec[0] = -gvec[0]
-            gvec[1] = -gvec[1]
-            # 构造输入数据，包含机器人的当前速度、角速度、关节位置等信息
-            cur_pos_obs = positions - default
-            cur_vel_obs = velocities
-            input_data["x_vel.1"] = np.array([x_vel_cmd], dtype=np.float32)
-            input_data["y_vel.1"] = np.array([y_vel_cmd], dtype=np.float32)
-            input_data["rot.1"] = np.array([yaw_vel_cmd], dtype=np.float32)
-            input_data["t.1"] = np.array([time.time() - start_time], dtype=np.float32)
-            input_data["dof_pos.1"] = cur_pos_obs.astype(np.float32)
-            input_data["dof_vel.1"] = cur_vel_obs.astype(np.float32)
-            input_data["prev_actions.1"] = prev_actions.astype(np.float32)
-            input_data["projected_gravity.1"] = gvec.astype(np.float32)
-            input_data["buffer.1"] = hist_obs.astype(np.float32)
-
-            # 推理当前的动作
-            policy_output = policy(input_data)
-            positions = policy_output["actions_scaled"]
-            curr_actions = policy_output["actions"]
-            hist_obs = policy_output["x.3"]
-            prev_actions = curr_actions
-
-            target_q = positions + default
-            
-            # 根据推理结果计算目标位置，并将目标位置转换为角度，生成命令发送给执行器
-            commands = []
-            for actuator_id in ACTUATOR_IDS:
-                policy_idx = ACTUATOR_ID_TO_POLICY_IDX[actuator_id]
-                raw_value = target_q[policy_idx]
-                command_deg = raw_value
-                command_deg = math.degrees(raw_value)
-                commands.append({"actuator_id": actuator_id, "position": command_deg})
-
-            # 根据频率控制模拟器更新的时间间隔
-            await sim_kos.actuator.command_actuators(commands)
-            await asyncio.sleep(max(0, next_time - time.time()))
-            next_time += 1 / frequency
+        # 固定频率调度，t.1使用固定步长累计时间；步进锁定时t.1为仿真时间
+        if step_locked:
+            scheduler = SimStepScheduler(frequency, sim_kos.sim.step)
+        else:
+            scheduler = RateScheduler(frequency)
+
+        # 评估指标: 关节跟踪误差(上一帧目标与本帧读数之差，度)和机身倾角(由重力方向计算，度)
+        tracking = np.zeros(len(actuator_ids))
+        tracking_sum = 0.0
+        tracking_max = 0.0
+        tilt_max = 0.0
+
+        # 可选的命令子步进：在策略帧之间插值，按command_rate批量下发
+        stepper = None
+        if command_rate is not None:
+            stepper = CommandStepper(sim_kos.actuator, actuator_ids, command_rate, 1 / frequency, wrap=False)
+
+        # 推理在工作线程中运行(不阻塞事件循环)；循环异常退出或被取消时也要停止子步进并关闭工作线程
+        executor = InferenceExecutor(session)
+        try:
+            if stepper is not None:
+                stepper.start()
+            overruns = 0
+            async for _ in scheduler:
+                if num_seconds is not None and scheduler.time >= num_seconds:
+                    break
+                profiler.miss(scheduler.overruns - overruns)
+                overruns = scheduler.overruns
+                profiler.start_tick()
+                with profiler.stage("sensors"):
+                    # 获取执行器的状态和IMU（惯性测量单元）的四元数
+                    response, raw_quat = await asyncio.gather(
+                        sim_kos.actuator.get_actuators_state(actuator_ids),
+                        sim_kos.imu.get_quaternion(),
+                    )
+                with profiler.stage("obs"):
+                    g = prepare_observation(engine, signs, gravity, response, raw_quat, scheduler.time)
+                    if scheduler.ticks > 1:
+                        # 本帧读数转回度、电机方向后与上一帧下发的目标比较
+                        np.degrees(dof_pos, out=tracking)
+                        tracking *= signs
+                        tracking -= raw_targets
+                        np.abs(tracking, out=tracking)
+                        tracking_sum += float(tracking.mean())
+                        tracking_max = max(tracking_max, float(tracking.max()))
+                    tilt_max = max(tilt_max, math.degrees(math.atan2(math.hypot(g[0], g[1]), abs(g[2]))))
+
+                with profiler.stage("inference"):
+                    # 推理当前的动作，循环输出会作为下一帧的输入
+                    await executor.run_bound(policy)
+
+                with profiler.stage("post"):
+                    # 根据推理结果计算目标位置(度)，生成命令发送给执行器
+                    targets = engine.decode(outputs[action_output])
+                    np.multiply(targets, signs, out=raw_targets)
+                    if stepper is None:
+                        commands = [
+                            {"actuator_id": actuator_id, "position": command_deg}
+                            for actuator_id, command_deg in zip(actuator_ids, raw_targets.tolist())
+                        ]
+
+                with profiler.stage("command"):
+                    if stepper is None:
+                        await sim_kos.actuator.command_actuators(commands)
+                    else:
+                        stepper.set_target(raw_targets)
+                profiler.tick()
+        finally:
+            if stepper is not None:
+                await stepper.stop()
+            executor.close()
+
+        stats = scheduler.stats()
+        stats["episode"] = {
+            "sim_time": scheduler.time,
+            "tracking_error_mean": tracking_sum / max(scheduler.ticks - 1, 1),
+            "tracking_error_max": tracking_max,
+            "tilt_max": tilt_max,
+        }
+        if stepper is not None:
+            stats["command"] = stepper.stats()
+        logger.info("Scheduler stats: %s", stats)
+        profiler.dump()
+    return stats
 
 
 async def main() -> None:
@@ -222,15 +294,20 @@ async def main() -> None:
     parser.add_argument("--port", type=int, default=50051)
     parser.add_argument("--num-seconds", type=float, default=None)
     parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--profile-interval", type=float, default=0.0, help="Dump stage latencies every N seconds")
+    parser.add_argument("--command-rate", type=float, default=None, help="Interpolate and stream commands at this rate (Hz)")
+    parser.add_argument("--step-locked", action="store_true", help="Advance the simulator with sim.step instead of the clock")
+    parser.add_argument("--variant", choices=POLICY_VARIANTS, default=None, help="Model variant made by quantize_policy.py")
     args = parser.parse_args()
 
     colorlogging.configure(level=logging.DEBUG if args.debug else logging.INFO)
 
     model_path = Path(__file__).parent / "simple_walking.onnx"
 
-    # Defines the default joint positions for the legs.
-    default_position = [0.23, 0.0, 0.0, 0.441, -0.195, -0.23, 0.0, 0.0, -0.441, 0.195]
-    await simple_walking(model_path, default_position, args.host, args.port, args.num_seconds)
+    # The default joint positions for the legs are defined in config.yaml.
+    profiler = LoopProfiler(dump_interval=args.profile_interval)
+    await simple_walking(model_path, None, args.host, args.port, args.num_seconds, profiler, args.command_rate, args.variant,
+                         args.step_locked)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,229 @@
+'''
+声明式的策略输入输出布局
+
+在配置中描述策略的关节顺序、默认位置、方向、每个输入张量由哪些信号按什么顺序和缩放拼成，以及动作如何转换为目标位置，
+启动时编译成下标和缩放数组；每帧控制器只把原始信号写入固定缓冲区，
+ObservationEngine.compute()用一次np.take、一次减法、一次乘法完成每个输入张量的构建，换策略只需要换配置
+信号(均为SI单位，弧度、弧度/秒):
+    gait(2): 步态相位的[sin, cos]
+    command(3): 运动指令[X方向线速度，Y方向线速度，Yaw方向角速度]
+    time(1): 控制循环时间(秒)
+    dof_pos / dof_vel / prev_actions(关节数): 策略顺序的关节位置、速度、上一步动作
+    ang_vel(3): IMU角速度[x, y, z]
+    euler(3): IMU欧拉角[roll, pitch, yaw]
+    gravity(3): 机体坐标系下的重力方向
+    zero(1): 常量0，用于保留位
+eg(yaml):
+policy:
+  joints:
+    - {name: left_hip_pitch_04, actuator_id: 31, default: 0.23, sign: 1, kp: 300.0, kd: 5.0, max_torque: 40.0}
+  inputs:
+    obs:
+      - {signal: gait}
+      - {signal: dof_pos, subtract_default: true, scale: 1.0}
+      - {signal: ang_vel, index: [2, 0, 1], sign: [-1, -1, 1]}
+      - {signal: zero, size: 4}
+  recurrent: {x.3: buffer.1}
+  actions: {output: actions_scaled, mode: absolute}
+'''
+
+import math
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+
+SIGNAL_SIZES = {'gait': 2, 'command': 3, 'time': 1, 'ang_vel': 3, 'euler': 3, 'gravity': 3, 'zero': 1}
+JOINT_SIGNALS = ('dof_pos', 'dof_vel', 'prev_actions')
+ACTION_MODES = ('absolute', 'delta')    # absolute: 目标=默认位置+动作；delta: 目标=当前位置+动作
+
+
+@dataclass
+class Joint:
+    name: str
+    actuator_id: int
+    default: float = 0.0    # 默认位置(弧度)
+    sign: float = 1.0       # 电机方向与策略方向相反时为-1
+    kp: float | None = None
+    kd: float | None = None
+    max_torque: float | None = None
+
+
+@dataclass
+class CompiledInput:
+    '''
+        一个输入张量: value = (signals[index] - offset) * scale
+    '''
+    name: str
+    index: np.ndarray
+    offset: np.ndarray
+    scale: np.ndarray
+
+    @property
+    def size(self) -> int:
+        return len(self.index)
+
+
+@dataclass
+class PolicyLayout:
+    joints: list[Joint]
+    inputs: dict[str, CompiledInput]
+    signal_slices: dict[str, slice]     # 信号在扁平信号向量中的位置
+    signal_size: int
+    recurrent: dict[str, str] = field(default_factory=dict)
+    action_output: str | int = 0        # 动作输出的名称或序号
+    action_mode: str = 'absolute'
+    action_scale: np.ndarray | None = None
+    action_wrap: bool = False           # 动作先回绕到(-pi, pi]
+    command: np.ndarray | None = None   # 默认运动指令
+
+    @property
+    def ids(self) -> list[int]:
+        return [joint.actuator_id for joint in self.joints]
+
+    @property
+    def defaults(self) -> np.ndarray:
+        return np.array([joint.default for joint in self.joints], dtype=np.float32)
+
+    @property
+    def signs(self) -> np.ndarray:
+        return np.array([joint.sign for joint in self.joints], dtype=np.float32)
+
+
+def _vector(value, size: int, what: str) -> np.ndarray:
+    array = np.broadcast_to(np.asarray(1.0 if value is None else value, dtype=np.float32), (size,))
+    if array.shape != (size,):
+        raise ValueError(f'{what}的长度应为{size}')
+    return array
+
+
+def compile_layout(spec: dict) -> PolicyLayout:
+    '''
+        把布局配置(dict，通常来自yaml)编译为PolicyLayout
+    '''
+    joints = [Joint(**joint) for joint in spec['joints']]
+    n = len(joints)
+    sizes = {**SIGNAL_SIZES, **{name: n for name in JOINT_SIGNALS}}
+    signal_slices = {}
+    start = 0
+    for name, size in sizes.items():
+        signal_slices[name] = slice(start, start + size)
+        start += size
+    defaults = np.array([joint.default for joint in joints], dtype=np.float32)
+
+    inputs = {}
+    for input_name, fields in (spec.get('inputs') or {}).items():
+        index, offset, scale = [], [], []
+        for f in fields:
+            signal = f['signal']
+            if signal not in sizes:
+                raise ValueError(f'未知的信号: {signal}，可选 {tuple(sizes)}')
+            if signal == 'zero':
+                components = [0] * int(f.get('size', 1))
+            else:
+                components = list(f.get('index', range(sizes[signal])))
+                if any(not 0 <= i < sizes[signal] for i in components):
+                    raise ValueError(f'{input_name}: 信号{signal}的下标越界 {components}')
+            m = len(components)
+            base = signal_slices[signal].start
+            index.extend(base + i for i in components)
+            if f.get('subtract_default'):
+                if signal != 'dof_pos':
+                    raise ValueError(f'{input_name}: 只有dof_pos可以减默认位置')
+                offset.extend(defaults[components])
+            else:
+                offset.extend([0.0] * m)
+            scale.extend(_vector(f.get('scale'), m, f'{input_name}.{signal}.scale') * _vector(f.get('sign'), m, f'{input_name}.{signal}.sign'))
+        inputs[input_name] = CompiledInput(
+            input_name,
+            np.array(index, dtype=np.int64),
+            np.array(offset, dtype=np.float32),
+            np.array(scale, dtype=np.float32),
+        )
+
+    actions = spec.get('actions') or {}
+    mode = actions.get('mode', 'absolute')
+    if mode not in ACTION_MODES:
+        raise ValueError(f'未知的动作模式: {mode}，可选 {ACTION_MODES}')
+    command = spec.get('command')
+    return PolicyLayout(
+        joints=joints,
+        inputs=inputs,
+        signal_slices=signal_slices,
+        signal_size=start,
+        recurrent=dict(spec.get('recurrent') or {}),
+        action_output=actions.get('output', 0),
+        action_mode=mode,
+        action_scale=_vector(actions.get('scale'), n, 'actions.scale').copy(),
+        action_wrap=bool(actions.get('wrap', False)),
+        command=None if command is None else _vector(command, 3, 'command').copy(),
+    )
+
+
+def read_layout_spec(config_path: str | Path, section: str = 'policy') -> dict:
+    '''
+        读取配置文件中的布局段(未编译，可在编译前修改)
+    '''
+    import yaml
+    with open(config_path, encoding='utf-8') as f:
+        config = yaml.safe_load(f) or {}
+    if section not in config:
+        raise KeyError(f'{config_path}中没有{section}段')
+    return config[section]
+
+
+def load_layout(config_path: str | Path, section: str = 'policy') -> PolicyLayout:
+    return compile_layout(read_layout_spec(config_path, section))
+
+
+class ObservationEngine:
+    '''
+        按编译好的布局构建策略输入、解码动作
+        signals: 信号名 -> 扁平信号向量中的视图，控制器每帧把原始信号写入这里
+        inputs: 输入名 -> 输入缓冲区，可通过buffers传入外部缓冲区(例如BoundPolicy.inputs或批量矩阵中的一行)
+        compute(): 由信号计算全部输入
+        decode(actions, dof_pos): 动作 -> 策略空间的目标位置(度)
+    '''
+    def __init__(self, layout: PolicyLayout, buffers: dict[str, np.ndarray] | None = None):
+        self.layout = layout
+        self.flat = np.zeros(layout.signal_size, dtype=np.float32)
+        self.signals = {name: self.flat[s] for name, s in layout.signal_slices.items()}
+        buffers = buffers or {}
+        self.inputs = {}
+        self._compiled = []
+        for name, compiled in layout.inputs.items():
+            buffer = buffers.get(name)
+            if buffer is None:
+                buffer = np.zeros(compiled.size, dtype=np.float32)
+            elif buffer.size != compiled.size:
+                raise ValueError(f'输入{name}的缓冲区长度{buffer.size}与布局长度{compiled.size}不一致')
+            self.inputs[name] = buffer
+            # 写入一维视图，缓冲区可以是(1, N)等形状
+            self._compiled.append((compiled, buffer.reshape(-1)))
+        if layout.command is not None:
+            self.signals['command'][:] = layout.command
+        self.defaults = layout.defaults
+        self.targets = np.zeros(len(layout.joints), dtype=np.float32)
+
+    def compute(self):
+        flat = self.flat
+        for compiled, out in self._compiled:
+            np.take(flat, compiled.index, out=out)
+            out -= compiled.offset
+            out *= compiled.scale
+
+    def decode(self, actions: np.ndarray, dof_pos: np.ndarray | None = None) -> np.ndarray:
+        '''
+            actions: 策略输出的动作(弧度)，action_wrap为True时原地回绕
+            dof_pos: 当前关节位置(弧度)，delta模式需要
+            返回内部缓冲区，下一次调用时会被覆盖
+        '''
+        layout = self.layout
+        if layout.action_wrap:
+            np.remainder(actions, 2*math.pi, out=actions)
+            np.subtract(actions, 2*math.pi, out=actions, where=actions > math.pi)
+        out = self.targets
+        np.multiply(actions[:len(out)], layout.action_scale, out=out)
+        out += dof_pos if layout.action_mode == 'delta' else self.defaults
+        return np.multiply(out, 180/math.pi, out=out)
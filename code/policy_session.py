@@ -0,0 +1,258 @@
+'''
+ONNX策略推理工具
+
+load_policy_session: 按配置创建会话(图优化级别、线程数、模型变体)，缓存优化后的模型，并在进入控制循环前预热
+InferenceExecutor: 在独立工作线程中执行session.run，onnxruntime推理期间会释放GIL，事件循环可以继续处理gRPC I/O
+BoundPolicy: 使用IO binding的推理，输入输出都是预分配的float32缓冲区，循环输出(历史缓冲)双缓冲后直接作为下一帧输入
+eg:
+session = await load_policy_session('model_100.onnx', read_session_options('config.yaml'))
+executor = InferenceExecutor(session)
+outputs = await executor.run({'obs': obs})
+'''
+
+import asyncio
+import hashlib
+import os
+import platform
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+
+
+# 会话默认配置，可由config.yaml的onnx段覆盖
+SESSION_OPTIONS = {
+    'graph_optimization_level': 'all',  # disable / basic / extended / all
+    'intra_op_num_threads': 1,          # 小模型在SBC上单线程通常最快，且不与控制循环抢核
+    'inter_op_num_threads': 1,
+    'cache_optimized_model': True,      # 保存优化后的模型，下次启动直接加载
+    'warmup_runs': 5,                   # 进入控制循环前的预热推理次数
+    'variant': 'fp32',                  # 模型变体: fp32 / int8 / fp16，量化变体由quantize_policy.py生成
+}
+# 模型变体: fp32为原模型，其余为放在原模型旁边的 <模型名>.<变体>.onnx
+POLICY_VARIANTS = ('fp32', 'int8', 'fp16')
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+ONNX_DTYPES = {
+    'tensor(float)': np.float32,
+    'tensor(float16)': np.float16,
+    'tensor(double)': np.float64,
+    'tensor(int64)': np.int64,
+    'tensor(int32)': np.int32,
+    'tensor(bool)': np.bool_,
+}
+
+
+def read_session_options(config_path: str | Path) -> dict:
+    '''
+        读取配置文件中的onnx段，与SESSION_OPTIONS合并
+    '''
+    import yaml
+    with open(config_path, encoding='utf-8') as f:
+        config = yaml.safe_load(f) or {}
+    return {**SESSION_OPTIONS, **(config.get('onnx') or {})}
+
+
+def variant_path(model_path: str | Path, variant: str = 'fp32') -> Path:
+    model_path = Path(model_path)
+    if variant not in POLICY_VARIANTS:
+        raise ValueError(f'未知的模型变体: {variant}，可选{POLICY_VARIANTS}')
+    if variant == 'fp32':
+        return model_path
+    return model_path.with_name(f'{model_path.stem}.{variant}.onnx')
+
+
+_HOST_TAG: str | None = None
+
+
+def host_tag() -> str:
+    '''
+        本机的CPU架构和指令集指纹，例如 aarch64-3f2a9c1e
+        all级别的优化结果与CPU相关(例如NCHWc布局、AVX512内核)，缓存文件名带上它，从开发机拷过来的缓存不会在机器人上被误用
+    '''
+    global _HOST_TAG
+    if _HOST_TAG is None:
+        features = platform.processor()
+        try:
+            with open('/proc/cpuinfo', encoding='utf-8', errors='replace') as f:
+                # x86为flags，ARM为Features；只取第一个核的指令集
+                features = next((line for line in f if line.startswith(('flags', 'Features'))), features)
+        except OSError:
+            pass
+        digest = hashlib.sha1(features.encode()).hexdigest()[:8]
+        _HOST_TAG = f'{platform.machine() or "unknown"}-{digest}'
+    return _HOST_TAG
+
+
+def optimized_model_path(model_path: str | Path, level: str) -> Path:
+    # 缓存文件名包含优化级别、onnxruntime版本和本机指纹，升级onnxruntime或换机器后会重新优化
+    model_path = Path(model_path)
+    return model_path.with_name(f'{model_path.stem}.{level}.ort-{ort.__version__}.{host_tag()}.onnx')
+
+
+def create_session(model_path: str | Path, options: dict | None = None) -> ort.InferenceSession:
+    '''
+        按配置创建推理会话(同步)，options['variant']选择模型变体
+        cache_optimized_model为True时，首次启动把优化后的图保存在模型旁边，之后直接加载并跳过图优化
+        缓存先写入临时文件再原子替换，多个进程同时冷启动时不会读到写了一半的缓存
+    '''
+    options = {**SESSION_OPTIONS, **(options or {})}
+    model_path = variant_path(model_path, options['variant'])
+    if not model_path.exists():
+        if options['variant'] != 'fp32':
+            raise FileNotFoundError(f'Model file not found: {model_path} (先运行 python quantize_policy.py 生成变体)')
+        raise FileNotFoundError(f'Model file not found: {model_path}')
+    level = options['graph_optimization_level']
+    sess_options = ort.SessionOptions()
+    sess_options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[level]
+    sess_options.intra_op_num_threads = options['intra_op_num_threads']
+    sess_options.inter_op_num_threads = options['inter_op_num_threads']
+    sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    load_path = model_path
+    cache_path = temp_path = None
+    if options['cache_optimized_model'] and level != 'disable':
+        cache_path = optimized_model_path(model_path, level)
+        if cache_path.exists() and cache_path.stat().st_mtime >= model_path.stat().st_mtime:
+            load_path = cache_path
+            sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        else:
+            temp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+            sess_options.optimized_model_filepath = str(temp_path)
+    try:
+        session = ort.InferenceSession(str(load_path), sess_options, providers=['CPUExecutionProvider'])
+        if temp_path is not None:
+            os.replace(temp_path, cache_path)
+    finally:
+        if temp_path is not None and temp_path.exists():
+            temp_path.unlink()
+    return session
+
+
+def warmup_session(session: ort.InferenceSession, runs: int):
+    # 用全零输入预热，避免首次推理的冷启动开销落在控制循环里；动态维度按1处理
+    feeds = {
+        x.name: np.zeros([d if isinstance(d, int) else 1 for d in x.shape], dtype=ONNX_DTYPES.get(x.type, np.float32))
+        for x in session.get_inputs()
+    }
+    for _ in range(runs):
+        session.run(None, feeds)
+
+
+async def load_policy_session(model_path: str | Path, options: dict | None = None) -> ort.InferenceSession:
+    '''
+        在线程中创建并预热会话，不阻塞事件循环
+    '''
+    options = {**SESSION_OPTIONS, **(options or {})}
+
+    def _load():
+        session = create_session(model_path, options)
+        warmup_session(session, options['warmup_runs'])
+        return session
+    return await asyncio.to_thread(_load)
+
+
+class InferenceExecutor:
+    '''
+        单工作线程的推理执行器
+        run(feeds): 在工作线程中推理并等待结果
+        submit(feeds): 提交推理并立即返回asyncio.Future，用于流水线模式(推理与下一帧的传感器读取重叠)
+        注意：推理完成前不要修改feeds中的缓冲区
+    '''
+    def __init__(self, session: ort.InferenceSession):
+        self.session = session
+        self.last_run_time = 0.0    # 最近一次session.run在工作线程中的耗时(秒)
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='onnx-inference')
+
+    def _run(self, feeds: dict, output_names: list[str] | None):
+        start = time.perf_counter()
+        outputs = self.session.run(output_names, feeds)
+        self.last_run_time = time.perf_counter() - start
+        return outputs
+
+    def _run_bound(self, policy: 'BoundPolicy'):
+        start = time.perf_counter()
+        policy.run()
+        self.last_run_time = time.perf_counter() - start
+
+    def submit(self, feeds: dict, output_names: list[str] | None = None) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(self._pool, self._run, feeds, output_names)
+
+    async def run(self, feeds: dict, output_names: list[str] | None = None) -> list:
+        return await self.submit(feeds, output_names)
+
+    async def run_bound(self, policy: 'BoundPolicy'):
+        # 在工作线程中执行BoundPolicy.run，结果在policy.outputs中
+        await asyncio.get_running_loop().run_in_executor(self._pool, self._run_bound, policy)
+
+    async def drain(self):
+        # 等待已提交的推理全部执行完(单工作线程按顺序执行，排在后面的空任务完成即表示之前的都已完成)
+        # 取消submit返回的future不会中断工作线程中正在进行的推理，复用feeds前需要先drain
+        await asyncio.get_running_loop().run_in_executor(self._pool, lambda: None)
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+class BoundPolicy:
+    '''
+        使用IO binding的推理，每帧没有数组分配和类型转换
+        inputs / outputs: 名称到预分配缓冲区的映射，推理前直接写inputs中的数组，推理后从outputs读取
+        recurrent: {输出名: 输入名}，该输出在下一帧作为对应输入，两块缓冲区交替绑定(双缓冲)，不需要拷贝
+            推理后inputs[输入名]和outputs[输出名]指向同一块(最新的)缓冲区，不要长期持有它们的引用
+        动态维度按1分配
+        eg:
+        policy = BoundPolicy(session, recurrent={'x.3': 'buffer.1'})
+        policy.inputs['t.1'][0] = t
+        policy.run()
+        policy.outputs['actions_scaled']
+    '''
+    def __init__(self, session: ort.InferenceSession, recurrent: dict[str, str] | None = None):
+        self.session = session
+        self.recurrent = dict(recurrent or {})
+        self.inputs = {x.name: self._allocate(x) for x in session.get_inputs()}
+        self.outputs = {x.name: self._allocate(x) for x in session.get_outputs()}
+        self._buffers = {}      # 循环输出名 -> (缓冲区0, 缓冲区1)
+        for output_name, input_name in self.recurrent.items():
+            state, spare = self.inputs[input_name], self.outputs[output_name]
+            if state.shape != spare.shape or state.dtype != spare.dtype:
+                raise ValueError(f'循环输出{output_name}与输入{input_name}的形状或类型不一致')
+            self._buffers[output_name] = (state, spare)
+        # 第p套绑定从缓冲区p读取循环输入，写入缓冲区1-p
+        self._bindings = [self._bind(0), self._bind(1)]
+        self._parity = 0
+
+    @staticmethod
+    def _allocate(node) -> np.ndarray:
+        shape = [d if isinstance(d, int) else 1 for d in node.shape]
+        return np.zeros(shape, dtype=ONNX_DTYPES.get(node.type, np.float32))
+
+    def _bind(self, parity: int) -> ort.IOBinding:
+        inputs = dict(self.inputs)
+        outputs = dict(self.outputs)
+        for output_name, input_name in self.recurrent.items():
+            inputs[input_name] = self._buffers[output_name][parity]
+            outputs[output_name] = self._buffers[output_name][1 - parity]
+        binding = self.session.io_binding()
+        for name, array in inputs.items():
+            binding.bind_input(name, 'cpu', 0, array.dtype, array.shape, array.ctypes.data)
+        for name, array in outputs.items():
+            binding.bind_output(name, 'cpu', 0, array.dtype, array.shape, array.ctypes.data)
+        return binding
+
+    def run(self):
+        self.session.run_with_iobinding(self._bindings[self._parity])
+        self._parity ^= 1
+        # 本帧的循环输出就是下一帧的输入
+        for output_name, input_name in self.recurrent.items():
+            self.inputs[input_name] = self.outputs[output_name] = self._buffers[output_name][self._parity]
+
+    def reset(self):
+        # 清零所有输入(包括循环状态)
+        for array in self.inputs.values():
+            array[...] = 0
@@ -0,0 +1,169 @@
+'''
+控制循环分段耗时统计
+
+每个阶段使用固定分桶的直方图记录耗时(对数分桶，10us~1s)，热路径上只有一次time.perf_counter和一次整数计数，可在50~200Hz下常开
+eg:
+profiler = LoopProfiler()
+with profiler.stage('sensors'):
+    ...
+profiler.dump()
+'''
+
+import math
+import time
+
+import numpy as np
+
+
+# 分桶上界(秒)，每个数量级4个桶，最后一个桶记录所有超过1s的样本
+BUCKET_BOUNDS = np.concatenate([10.0 ** np.arange(-5, 0.01, 0.25), [math.inf]])
+_LOG_MIN = -5.0
+_BUCKETS_PER_DECADE = 4
+
+
+class Histogram:
+    '''
+        固定分桶耗时直方图
+    '''
+    def __init__(self):
+        self.counts = np.zeros(len(BUCKET_BOUNDS), dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        if seconds <= 1e-5:
+            index = 0
+        else:
+            index = min(math.ceil((math.log10(seconds) - _LOG_MIN) * _BUCKETS_PER_DECADE), len(BUCKET_BOUNDS) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> float:
+        '''
+            q分位数(0~100)，返回所在分桶的上界，精度为分桶宽度
+        '''
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(self.count * q / 100)
+        index = int(np.searchsorted(np.cumsum(self.counts), max(rank, 1)))
+        return min(float(BUCKET_BOUNDS[index]), self.max)
+
+    def reset(self):
+        self.counts[:] = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class _Stage:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.record(time.perf_counter() - self.start)
+        return False
+
+
+class LoopProfiler:
+    '''
+        控制循环分段耗时统计
+        stage(name): 计时上下文，同名阶段复用同一个直方图
+        miss(): 记录一次错过截止时间
+        start_tick() / tick(): 帧开始/结束时调用，start_tick被调用过时整帧耗时记入'tick'
+        dump(): 打印各阶段统计；dump_interval>0时，tick()会按该间隔(秒)自动打印
+        enabled=False时所有计时直接跳过
+    '''
+    def __init__(self, enabled: bool = True, dump_interval: float = 0.0):
+        self.enabled = enabled
+        self.dump_interval = dump_interval
+        self.histograms: dict[str, Histogram] = {}
+        self.stages: dict[str, _Stage] = {}
+        self.missed_deadlines = 0
+        self.ticks = 0
+        self._last_dump = time.monotonic()
+        self._tick_start = None
+        self._null = _NullStage()
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return self._null
+        stage = self.stages.get(name)
+        if stage is None:
+            histogram = self.histograms[name] = Histogram()
+            stage = self.stages[name] = _Stage(histogram)
+        return stage
+
+    def record(self, name: str, seconds: float):
+        # 记录在别处测得的耗时(例如在工作线程中测得的推理时间)
+        if self.enabled:
+            self.stage(name).histogram.record(seconds)
+
+    def miss(self, count: int = 1):
+        self.missed_deadlines += count
+
+    def start_tick(self):
+        if self.enabled:
+            self._tick_start = time.perf_counter()
+
+    def tick(self):
+        # 每帧结束时调用，负责计数、记录整帧耗时和定期打印
+        self.ticks += 1
+        if self._tick_start is not None:
+            self.record('tick', time.perf_counter() - self._tick_start)
+            self._tick_start = None
+        if self.dump_interval > 0:
+            now = time.monotonic()
+            if now - self._last_dump >= self.dump_interval:
+                self._last_dump = now
+                self.dump()
+
+    def summary(self) -> dict:
+        return {
+            'ticks': self.ticks,
+            'missed_deadlines': self.missed_deadlines,
+            'stages': {name: histogram.summary() for name, histogram in self.histograms.items()},
+        }
+
+    def dump(self, file=None):
+        print(f'[Profiler] ticks={self.ticks} missed_deadlines={self.missed_deadlines}', file=file)
+        for name, histogram in self.histograms.items():
+            s = histogram.summary()
+            print(f'[Profiler] {name:<12} n={s["count"]:<7} mean={s["mean"]*1e3:.3f}ms p50<={s["p50"]*1e3:.3f}ms '
+                  f'p90<={s["p90"]*1e3:.3f}ms p99<={s["p99"]*1e3:.3f}ms max={s["max"]*1e3:.3f}ms', file=file)
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+        self.missed_deadlines = 0
+        self.ticks = 0
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
@@ -0,0 +1,204 @@
+'''
+策略模型的量化变体与基准测试(需要安装onnx: pip install onnx)
+
+由fp32模型生成两种变体，放在原模型旁边，加载时用会话配置的variant选择(见policy_session.variant_path)：
+    int8: 动态量化，MatMul/Gemm等的权重存为int8，激活在运行时按帧量化
+    fp16: 浮点权重存为float16，图中插入Cast转回float32计算，输入输出仍为float32
+然后在CPU上分别测量推理延迟分位数，并与fp32模型比较同一批观测下的动作误差
+观测可以来自遥测文件(.tlm，只适用于单输入模型，如model_100.onnx)、npz文件(键为输入名，第一维为样本)，或随机生成
+eg:
+python quantize_policy.py model_100.onnx --observations run.tlm
+python quantize_policy.py onnx/simple_walking.onnx --output actions_scaled --json quantize.json
+然后：config.yaml的onnx段设置 variant: int8，或 await kos.load_session('model_100.onnx', variant='int8')
+'''
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from policy_session import ONNX_DTYPES, SESSION_OPTIONS, create_session, read_session_options, variant_path, warmup_session
+
+
+def quantize_int8(model_path: str | Path, output_path: str | Path | None = None) -> Path:
+    '''
+        动态int8量化，权重按张量对称量化为int8
+    '''
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    output_path = Path(output_path or variant_path(model_path, 'int8'))
+    quantize_dynamic(str(model_path), str(output_path), weight_type=QuantType.QInt8)
+    return output_path
+
+
+def convert_fp16(model_path: str | Path, output_path: str | Path | None = None, min_size: int = 16) -> Path:
+    '''
+        float32权重(元素数不少于min_size)改存为float16，并插入Cast节点转回float32
+        标量和形状一类的小常量保持不变；超出float16范围的值截断到±65504
+    '''
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+    model = onnx.load(str(model_path))
+    graph = model.graph
+    casts = []
+    for index, initializer in enumerate(graph.initializer):
+        if initializer.data_type != TensorProto.FLOAT:
+            continue
+        array = numpy_helper.to_array(initializer)
+        if array.size < min_size:
+            continue
+        name = initializer.name
+        half = np.clip(array, -65504, 65504).astype(np.float16)
+        graph.initializer[index].CopyFrom(numpy_helper.from_array(half, f'{name}_fp16'))
+        casts.append(helper.make_node('Cast', [f'{name}_fp16'], [name], to=TensorProto.FLOAT, name=f'{name}_cast'))
+    # Cast节点放在最前面，保持节点的拓扑顺序
+    nodes = casts + list(graph.node)
+    del graph.node[:]
+    graph.node.extend(nodes)
+    onnx.checker.check_model(model)
+    output_path = Path(output_path or variant_path(model_path, 'fp16'))
+    onnx.save(model, str(output_path))
+    return output_path
+
+
+QUANTIZERS = {
+    'int8': quantize_int8,
+    'fp16': convert_fp16,
+}
+
+
+def make_variants(model_path: str | Path, variants=('int8', 'fp16')) -> dict[str, Path]:
+    '''
+        生成指定的变体，返回{变体名: 路径}
+    '''
+    return {variant: QUANTIZERS[variant](model_path) for variant in variants}
+
+
+def _shape(node) -> list[int]:
+    return [d if isinstance(d, int) else 1 for d in node.shape]
+
+
+def sample_feeds(session, count: int = 200, observations: str | Path | None = None, seed: int = 0) -> list[dict]:
+    '''
+        生成count组推理输入
+        observations: .tlm遥测文件(使用其中的obs，要求模型只有一个输入)或.npz文件(键为输入名，缺少的输入随机生成)
+        随机输入为标准正态分布乘0.5，样本数不足count时循环使用
+    '''
+    inputs = session.get_inputs()
+    recorded = {}
+    if observations is not None:
+        observations = Path(observations)
+        if observations.suffix == '.npz':
+            with np.load(observations) as data:
+                recorded = {name: data[name] for name in data.files}
+        else:
+            from telemetry import load_telemetry
+            if len(inputs) != 1:
+                raise ValueError(f'遥测文件只能用于单输入模型，该模型有{len(inputs)}个输入，请改用npz')
+            recorded = {inputs[0].name: np.array(load_telemetry(observations)['obs'])}
+    rng = np.random.default_rng(seed)
+    feeds = [{} for _ in range(count)]
+    for node in inputs:
+        shape = _shape(node)
+        dtype = ONNX_DTYPES.get(node.type, np.float32)
+        if node.name in recorded:
+            samples = recorded[node.name]
+            if len(samples) == 0:
+                raise ValueError(f'{observations}中没有{node.name}的样本')
+            for i, feed in enumerate(feeds):
+                feed[node.name] = np.asarray(samples[i % len(samples)], dtype=dtype).reshape(shape)
+        else:
+            for feed in feeds:
+                feed[node.name] = (rng.standard_normal(shape) * 0.5).astype(dtype)
+    return feeds
+
+
+def measure(session, feeds: list[dict], output: str, runs: int = 1000) -> tuple[dict, np.ndarray]:
+    '''
+        测量推理延迟，返回(延迟统计(秒)，每组输入的输出)
+        输出先对每组输入各推理一次收集，延迟在之后的runs次推理中测量(循环使用输入)
+    '''
+    outputs = np.stack([session.run([output], feed)[0] for feed in feeds])
+    times = np.empty(runs)
+    run = session.run
+    for i in range(runs):
+        feed = feeds[i % len(feeds)]
+        start = time.perf_counter()
+        run([output], feed)
+        times[i] = time.perf_counter() - start
+    p50, p90, p99 = np.percentile(times, [50, 90, 99])
+    latency = {'mean': float(times.mean()), 'p50': float(p50), 'p90': float(p90), 'p99': float(p99), 'max': float(times.max())}
+    return latency, outputs
+
+
+def compare_variants(model_path: str | Path, variants=('int8', 'fp16'), options: dict | None = None,
+                     observations: str | Path | None = None, samples: int = 200, runs: int = 1000,
+                     output: str | int = 0, seed: int = 0) -> list[dict]:
+    '''
+        生成变体并与fp32模型比较
+        output: 比较的输出(名称或下标)，默认第一个输出
+        返回每个模型(fp32在前)的文件大小、延迟统计和相对fp32的动作误差(最大/平均绝对误差)
+    '''
+    options = {**SESSION_OPTIONS, **(options or {})}
+    paths = {'fp32': Path(model_path), **make_variants(model_path, variants)}
+    results = []
+    reference = feeds = None
+    for variant, path in paths.items():
+        session = create_session(model_path, {**options, 'variant': variant})
+        warmup_session(session, options['warmup_runs'])
+        if feeds is None:
+            feeds = sample_feeds(session, samples, observations, seed)
+            if isinstance(output, int):
+                output = session.get_outputs()[output].name
+        latency, outputs = measure(session, feeds, output, runs)
+        if reference is None:
+            reference = outputs
+        error = np.abs(outputs.astype(np.float64) - reference)
+        results.append({
+            'variant': variant,
+            'path': str(path),
+            'size': path.stat().st_size,
+            'output': output,
+            'latency': latency,
+            'max_error': float(error.max()),
+            'mean_error': float(error.mean()),
+        })
+    return results
+
+
+def print_report(results: list[dict]):
+    base = results[0]['latency']['p50']
+    for result in results:
+        latency = result['latency']
+        print(f'[Quantize] {result["variant"]:<5} size={result["size"] / 1024:.1f}KB '
+              f'mean={latency["mean"]*1e3:.3f}ms p50={latency["p50"]*1e3:.3f}ms p90={latency["p90"]*1e3:.3f}ms '
+              f'p99={latency["p99"]*1e3:.3f}ms max={latency["max"]*1e3:.3f}ms speedup={base / latency["p50"]:.2f}x '
+              f'{result["output"]} max_err={result["max_error"]:.2e} mean_err={result["mean_error"]:.2e}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model', help='fp32 ONNX模型')
+    parser.add_argument('--variants', nargs='+', choices=list(QUANTIZERS), default=list(QUANTIZERS))
+    parser.add_argument('--observations', default=None, help='遥测文件(.tlm)或输入样本(.npz)，默认随机生成')
+    parser.add_argument('--samples', type=int, default=200, help='比较误差的样本数')
+    parser.add_argument('--runs', type=int, default=1000, help='测量延迟的推理次数')
+    parser.add_argument('--output', default='0', help='比较的输出名或下标')
+    parser.add_argument('--config', default=None, help='读取config.yaml的onnx段作为会话配置')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help='结果写入JSON文件')
+    args = parser.parse_args()
+
+    options = read_session_options(args.config) if args.config else dict(SESSION_OPTIONS)
+    output = int(args.output) if args.output.isdigit() else args.output
+    results = compare_variants(args.model, args.variants, options, args.observations, args.samples, args.runs,
+                               output, args.seed)
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+'''
+固定频率调度器
+
+基于单调时钟(time.monotonic)的截止时间调度，用于BetterKOS.loop和pykos_controller.simple_walking的控制循环
+SimStepScheduler接口相同，但不等待墙钟时间，每帧调用sim.step推进仿真(步进锁定)，仿真能算多快就跑多快
+eg:
+scheduler = RateScheduler(50)
+async for dt in scheduler:
+    ...     # dt为本帧对应的固定步长(秒)，scheduler.time为固定步长累计时间
+scheduler = SimStepScheduler(50, kos.sim.step)
+'''
+
+import asyncio
+import math
+import time
+
+
+OVERRUN_POLICIES = ('skip', 'catch_up', 'degrade')
+
+
+class RateScheduler:
+    '''
+        固定频率调度器
+        frequency: 目标频率(Hz)
+        overrun: 超时(上一帧耗时超过周期)时的处理策略
+            skip: 丢弃错过的帧，立即执行下一帧，dt包含被跳过的周期，相位不丢失
+            catch_up: 不休眠地连续执行错过的帧直到追上，落后超过max_lag个周期时放弃追赶
+            degrade: 同skip处理本次超时，之后降频运行(周期翻倍，最多max_degrade倍)，连续recover_ticks帧按时完成后逐级恢复
+    '''
+    def __init__(self, frequency: float, overrun: str = 'skip', max_lag: int = 5, max_degrade: int = 4, recover_ticks: int = 50):
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError(f'未知的超时策略: {overrun}，可选 {OVERRUN_POLICIES}')
+        self.period = 1 / frequency
+        self.current_period = self.period
+        self.overrun = overrun
+        self.max_lag = max_lag
+        self.max_degrade = max_degrade
+        self.recover_ticks = recover_ticks
+        self.start_time: float | None = None
+        self.next_time: float | None = None
+        self.time = 0.0             # 固定步长累计时间(秒)
+        self.ticks = 0              # 已执行的帧数
+        self.steps = 0              # 已推进的周期数(含被跳过的周期)
+        self.overruns = 0           # 超时次数
+        self.skipped = 0            # 被跳过的周期数
+        self._on_time = 0
+        self._last_tick: float | None = None
+        # 实际周期与抖动统计(Welford)
+        self._period_n = 0
+        self._period_mean = 0.0
+        self._period_m2 = 0.0
+        self._period_min = math.inf
+        self._period_max = 0.0
+        self._jitter_sum = 0.0
+        self._jitter_max = 0.0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> float:
+        return await self.wait()
+
+    async def wait(self) -> float:
+        '''
+            等待下一帧的截止时间，返回该帧的固定步长dt(秒)
+            第一次调用立即返回0
+        '''
+        now = time.monotonic()
+        if self.next_time is None:
+            self.start_time = now
+            self.next_time = now + self.current_period
+            self._last_tick = now
+            self.ticks = 1
+            return 0.0
+        period = self.current_period
+        steps = 1
+        lateness = now - self.next_time
+        if lateness < 0:
+            await asyncio.sleep(-lateness)
+            self._on_time += 1
+            if self.overrun == 'degrade' and self._on_time >= self.recover_ticks and self.current_period > self.period:
+                self.current_period = max(self.period, self.current_period / 2)
+                self._on_time = 0
+        else:
+            self.overruns += 1
+            self._on_time = 0
+            if self.overrun != 'catch_up' or lateness > self.max_lag * period:
+                missed = int(lateness // period)
+                steps += missed
+                self.skipped += missed
+                self.next_time += missed * period
+            if self.overrun == 'degrade':
+                self.current_period = min(self.current_period * 2, self.period * self.max_degrade)
+                self.next_time = now
+        tick = time.monotonic()
+        self._record(tick - self._last_tick, steps * period)
+        self._last_tick = tick
+        self.next_time += self.current_period
+        self.ticks += 1
+        self.steps += steps
+        dt = steps * period
+        self.time += dt
+        return dt
+
+    def _record(self, actual: float, expected: float):
+        self._period_n += 1
+        delta = actual - self._period_mean
+        self._period_mean += delta / self._period_n
+        self._period_m2 += delta * (actual - self._period_mean)
+        self._period_min = min(self._period_min, actual)
+        self._period_max = max(self._period_max, actual)
+        jitter = abs(actual - expected)
+        self._jitter_sum += jitter
+        self._jitter_max = max(self._jitter_max, jitter)
+
+    def stats(self) -> dict:
+        '''
+            周期与抖动统计，时间单位均为秒
+        '''
+        n = self._period_n
+        elapsed = 0.0 if self.start_time is None else time.monotonic() - self.start_time
+        return {
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'target_period': self.period,
+            'current_period': self.current_period,
+            'rate': self.ticks / elapsed if elapsed > 0 else 0.0,
+            'period_mean': self._period_mean,
+            'period_std': math.sqrt(self._period_m2 / n) if n > 0 else 0.0,
+            'period_min': self._period_min if n > 0 else 0.0,
+            'period_max': self._period_max,
+            'jitter_mean': self._jitter_sum / n if n > 0 else 0.0,
+            'jitter_max': self._jitter_max,
+        }
+
+
+class SimStepScheduler:
+    '''
+        步进锁定调度器，与RateScheduler的迭代接口和time/ticks/overruns属性相同
+        每帧(第一帧除外)先调用step(num_steps, step_size)把仿真推进一个周期，不休眠
+        step: 异步函数，通常为pykos的sim.step；sim_dt为仿真的物理步长(秒)，每个周期推进round(周期/sim_dt)步
+    '''
+    def __init__(self, frequency: float, step, sim_dt: float = 0.001):
+        self.period = 1 / frequency
+        self.step = step
+        self.num_steps = max(1, round(self.period / sim_dt))
+        self.sim_dt = self.period / self.num_steps
+        self.start_time: float | None = None
+        self.time = 0.0             # 仿真时间(秒)
+        self.ticks = 0
+        self.overruns = 0           # 步进锁定时不会超时，保留以兼容RateScheduler
+        self._step_time = 0.0       # 等待sim.step的累计墙钟时间
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> float:
+        return await self.wait()
+
+    async def wait(self) -> float:
+        if self.start_time is None:
+            self.start_time = time.monotonic()
+            self.ticks = 1
+            return 0.0
+        start = time.monotonic()
+        await self.step(self.num_steps, self.sim_dt)
+        self._step_time += time.monotonic() - start
+        self.ticks += 1
+        self.time += self.period
+        return self.period
+
+    def stats(self) -> dict:
+        '''
+            仿真时间、墙钟时间和实时倍率(仿真时间/墙钟时间)，时间单位均为秒
+        '''
+        elapsed = 0.0 if self.start_time is None else time.monotonic() - self.start_time
+        return {
+            'ticks': self.ticks,
+            'overruns': 0,
+            'target_period': self.period,
+            'rate': self.ticks / elapsed if elapsed > 0 else 0.0,
+            'sim_time': self.time,
+            'wall_time': elapsed,
+            'realtime_factor': self.time / elapsed if elapsed > 0 else 0.0,
+            'step_time': self._step_time,
+        }
@@ -0,0 +1,226 @@
+'''
+步进锁定的并行仿真评估
+
+pykos_controller.simple_walking以step_locked模式运行：不按墙钟时间等待，每帧用sim.step推进仿真一个策略周期，
+60秒的仿真不需要等60秒；多个回合按实例分组，分发到进程池中并行运行，最后汇总各回合的指标
+每个工作进程独占一个仿真实例：
+    不指定servers时，每个回合在工作进程内启动一个步进锁定的本地替身服务器(fake_kos.py，realtime=False)，工作进程数默认为CPU核数的一半
+    指定servers时，连接已经启动的kos-sim实例(每个实例一个工作进程，实例内的回合依次运行)
+未指定commands时，每个回合的默认运动指令加上由种子决定的噪声，回合之间的差异来自指令而不只是种子编号；指定的commands按原值评估
+替身服务器没有刚体动力学，IMU姿态恒定，机身倾角和摔倒数只有连接kos-sim时才有意义，使用替身服务器时报告为n/a
+eg:
+python sim_eval.py --episodes 16 --workers 4 --seconds 20 --synthetic
+python sim_eval.py --episodes 16 --seconds 20 --servers 127.0.0.1:50051 127.0.0.1:50052 --commands 0.5,0,0 1,0,0
+'''
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'onnx'))
+import pykos_controller  # noqa: E402
+from policy_layout import read_layout_spec  # noqa: E402
+from policy_session import POLICY_VARIANTS, create_session, read_session_options  # noqa: E402
+from profiler import LoopProfiler  # noqa: E402
+
+
+DEFAULT_MODEL = Path(__file__).resolve().parent / 'onnx' / 'simple_walking.onnx'
+
+
+class _EpisodeProfiler(LoopProfiler):
+    # 各回合的分段耗时只取汇总值，不在回合结束时打印
+    def dump(self, file=None):
+        pass
+
+
+def episode_plan(episodes: int, commands: list[list[float]] | None = None, seed: int = 0,
+                 command_noise: float = 0.1, default_command: list[float] | None = None) -> list[dict]:
+    '''
+        回合列表，每个回合有序号、随机种子(替身服务器的初始状态和指令噪声)和运动指令
+        commands按回合循环使用，为None时使用default_command(config.yaml中的指令)
+        只有使用default_command的回合加上标准差为command_noise的高斯噪声(x/y为m/s，yaw为rad/s)，由该回合的种子决定，同一种子可复现；
+        commands中的指令按原值评估
+    '''
+    if commands:
+        base, noise = commands, 0.0
+    else:
+        base, noise = [default_command or [0.0, 0.0, 0.0]], command_noise
+    plan = []
+    for i in range(episodes):
+        command = np.asarray(base[i % len(base)], dtype=np.float64)
+        if noise:
+            command = command + np.random.default_rng(seed + i).normal(0.0, noise, 3)
+        plan.append({'index': i, 'seed': seed + i, 'command': [round(float(v), 4) for v in command]})
+    return plan
+
+
+async def _run_episodes(model_path: str, server: tuple[str, int] | None, plan: list[dict], seconds: float,
+                        variant: str | None, fake_options: dict) -> list[dict]:
+    from fake_kos import FakeKOSServer
+    results = []
+    for episode in plan:
+        profiler = _EpisodeProfiler()
+        if server is None:
+            async with FakeKOSServer(realtime=False, seed=episode['seed'], **fake_options) as fake:
+                stats = await pykos_controller.simple_walking(model_path, None, '127.0.0.1', fake.port, seconds, profiler,
+                                                              None, variant, True, episode['command'])
+        else:
+            stats = await pykos_controller.simple_walking(model_path, None, server[0], server[1], seconds, profiler,
+                                                          None, variant, True, episode['command'])
+        inference = profiler.summary()['stages'].get('inference', {})
+        results.append({
+            **episode,
+            **stats['episode'],
+            'server': None if server is None else f'{server[0]}:{server[1]}',
+            'worker': os.getpid(),
+            'ticks': stats['ticks'],
+            'wall_time': stats['wall_time'],
+            'realtime_factor': stats['realtime_factor'],
+            'step_time': stats['step_time'],
+            'inference_mean': inference.get('mean', 0.0),
+        })
+    return results
+
+
+def _worker(model_path: str, server: tuple[str, int] | None, plan: list[dict], seconds: float, variant: str | None,
+            fake_options: dict) -> list[dict]:
+    # 进程池入口：每个工作进程有自己的事件循环和gRPC通道
+    return asyncio.run(_run_episodes(model_path, server, plan, seconds, variant, fake_options))
+
+
+def summarize(results: list[dict], wall_time: float, fall_tilt: float = 45.0) -> dict:
+    '''
+        汇总各回合指标
+        fall_tilt: 机身倾角超过该值(度)的回合计为摔倒
+        throughput为所有回合的仿真时间之和/整个评估的墙钟时间，即并行后的总实时倍率
+        tilt_max和falls只统计连接kos-sim的回合，替身服务器的IMU姿态恒定，全部来自替身服务器时为None
+    '''
+    sim_time = sum(r['sim_time'] for r in results)
+    tracking = np.array([r['tracking_error_mean'] for r in results])
+    measured = [r for r in results if r['server'] is not None]
+    return {
+        'episodes': len(results),
+        'sim_time': sim_time,
+        'wall_time': wall_time,
+        'throughput': sim_time / wall_time if wall_time > 0 else 0.0,
+        'realtime_factor_mean': float(np.mean([r['realtime_factor'] for r in results])) if results else 0.0,
+        'tracking_error_mean': float(tracking.mean()) if results else 0.0,
+        'tracking_error_std': float(tracking.std()) if results else 0.0,
+        'tracking_error_max': max((r['tracking_error_max'] for r in results), default=0.0),
+        'tilt_max': max((r['tilt_max'] for r in measured), default=0.0) if measured else None,
+        'falls': sum(r['tilt_max'] > fall_tilt for r in measured) if measured else None,
+    }
+
+
+def evaluate(model_path: str | Path, episodes: int = 8, seconds: float = 10.0, workers: int | None = None,
+             servers: list[tuple[str, int]] | None = None, commands: list[list[float]] | None = None,
+             variant: str | None = None, seed: int = 0, fake_options: dict | None = None,
+             fall_tilt: float = 45.0, command_noise: float = 0.1) -> dict:
+    '''
+        并行评估，返回{'summary': 汇总指标, 'episodes': 各回合指标(按序号排列)}
+        servers: kos-sim实例地址[(host, port)]，None时使用替身服务器，工作进程数为workers
+        workers默认为CPU核数的一半：每个回合还有一个替身服务器和gRPC线程，占满所有核反而会降低实时倍率
+        command_noise: 默认运动指令的噪声标准差(指定commands时不加噪声)，见episode_plan
+    '''
+    config_path = pykos_controller.CONFIG_PATH
+    plan = episode_plan(episodes, commands, seed, command_noise, read_layout_spec(config_path).get('command'))
+    if servers:
+        instances = list(servers)
+    else:
+        instances = [None] * min(workers or max(1, (os.cpu_count() or 1) // 2), episodes)
+    # 优化模型缓存在父进程中建好，工作进程只读取，避免多个进程同时冷启动时重复优化
+    session_options = read_session_options(config_path)
+    if variant is not None:
+        session_options['variant'] = variant
+    if session_options['cache_optimized_model']:
+        create_session(model_path, session_options)
+    # 回合轮流分给各实例，同一实例上的回合依次运行
+    groups = [plan[i::len(instances)] for i in range(len(instances))]
+    start = time.monotonic()
+    results = []
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=len(instances), mp_context=context) as pool:
+        futures = [
+            pool.submit(_worker, str(model_path), server, group, seconds, variant, fake_options or {})
+            for server, group in zip(instances, groups) if group
+        ]
+        for future in futures:
+            results.extend(future.result())
+    wall_time = time.monotonic() - start
+    results.sort(key=lambda r: r['index'])
+    return {'summary': summarize(results, wall_time, fall_tilt), 'episodes': results}
+
+
+def _tilt(value: float | None) -> str:
+    return 'n/a' if value is None else f'{value:.1f}deg'
+
+
+def print_report(report: dict):
+    for r in report['episodes']:
+        print(f'[SimEval] episode {r["index"]:<3} command={r["command"]} sim={r["sim_time"]:.1f}s wall={r["wall_time"]:.2f}s '
+              f'x{r["realtime_factor"]:.1f} tracking={r["tracking_error_mean"]:.3f}/{r["tracking_error_max"]:.3f}deg '
+              f'tilt_max={_tilt(None if r["server"] is None else r["tilt_max"])}')
+    s = report['summary']
+    falls = 'n/a' if s['falls'] is None else s['falls']
+    print(f'[SimEval] {s["episodes"]} episodes: sim={s["sim_time"]:.1f}s wall={s["wall_time"]:.2f}s '
+          f'throughput=x{s["throughput"]:.1f} (x{s["realtime_factor_mean"]:.1f} per episode) '
+          f'tracking={s["tracking_error_mean"]:.3f}±{s["tracking_error_std"]:.3f}deg max={s["tracking_error_max"]:.3f}deg '
+          f'tilt_max={_tilt(s["tilt_max"])} falls={falls}')
+    if s['tilt_max'] is None:
+        print('[SimEval] 替身服务器的IMU姿态恒定，无法测量机身倾角和摔倒，需要连接kos-sim(--servers)')
+
+
+def _address(text: str) -> tuple[str, int]:
+    host, port = text.rsplit(':', 1)
+    return host, int(port)
+
+
+def _command(text: str) -> list[float]:
+    values = [float(v) for v in text.split(',')]
+    if len(values) != 3:
+        raise argparse.ArgumentTypeError(f'运动指令需要3个值(x_vel,y_vel,yaw_vel): {text}')
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=str(DEFAULT_MODEL))
+    parser.add_argument('--synthetic', action='store_true', help='使用随机权重的合成模型(需要onnx)')
+    parser.add_argument('--episodes', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10.0, help='每个回合的仿真时长')
+    parser.add_argument('--workers', type=int, default=None, help='使用替身服务器时的工作进程数，默认CPU核数的一半')
+    parser.add_argument('--servers', nargs='+', type=_address, default=None, help='kos-sim实例地址 host:port')
+    parser.add_argument('--commands', nargs='+', type=_command, default=None, help='各回合的运动指令 x,y,yaw，循环使用')
+    parser.add_argument('--variant', choices=POLICY_VARIANTS, default=None, help='模型变体(见quantize_policy.py)')
+    parser.add_argument('--latency', type=float, default=0.0, help='替身服务器每次RPC的附加延迟(秒)')
+    parser.add_argument('--command-noise', type=float, default=0.1, help='默认运动指令的噪声标准差，由种子决定；指定--commands时不加噪声')
+    parser.add_argument('--fall-tilt', type=float, default=45.0, help='机身倾角超过该值(度)计为摔倒，只适用于kos-sim')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help='结果写入JSON文件')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        model_path = args.model
+        if args.synthetic:
+            from synthetic_policy import make_walking_policy
+            model_path = make_walking_policy(Path(workdir) / 'simple_walking.onnx')
+        report = evaluate(model_path, args.episodes, args.seconds, args.workers, args.servers, args.commands,
+                          args.variant, args.seed, {'latency': args.latency}, args.fall_tilt,
+                          args.command_noise)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), **report}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+'''
+生成与真实策略输入输出一致的小型ONNX模型，用于基准测试和无硬件调试(需要安装onnx: pip install onnx)
+
+make_obs_policy: 与BetterKOS使用的model_100.onnx相同的接口，输入obs[N, 45]，输出actions[N, 12]
+make_walking_policy: 与simple_walking.onnx相同的接口，9个命名输入，输出actions_scaled/actions/x.3(570维历史缓冲)
+权重随机生成，输出没有控制意义
+'''
+
+from pathlib import Path
+
+import numpy as np
+
+
+WALKING_INPUTS = (
+    ('x_vel.1', 1),
+    ('y_vel.1', 1),
+    ('rot.1', 1),
+    ('t.1', 1),
+    ('dof_pos.1', 10),
+    ('dof_vel.1', 10),
+    ('prev_actions.1', 10),
+    ('projected_gravity.1', 3),
+    ('buffer.1', 570),
+)
+HISTORY_SIZE = 570
+
+
+def _save(graph, path: str | Path) -> Path:
+    from onnx import checker, helper, save
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 17)])
+    model.ir_version = 8
+    checker.check_model(model)
+    path = Path(path)
+    save(model, str(path))
+    return path
+
+
+def make_obs_policy(path: str | Path, obs_size: int = 45, action_size: int = 12, hidden: int = 64, seed: int = 0) -> Path:
+    from onnx import TensorProto, helper, numpy_helper
+    rng = np.random.default_rng(seed)
+    w1 = numpy_helper.from_array((rng.standard_normal((obs_size, hidden)) * 0.1).astype(np.float32), 'w1')
+    w2 = numpy_helper.from_array((rng.standard_normal((hidden, action_size)) * 0.1).astype(np.float32), 'w2')
+    nodes = [
+        helper.make_node('MatMul', ['obs', 'w1'], ['h']),
+        helper.make_node('Tanh', ['h'], ['h1']),
+        helper.make_node('MatMul', ['h1', 'w2'], ['actions']),
+    ]
+    graph = helper.make_graph(
+        nodes, 'obs_policy',
+        [helper.make_tensor_value_info('obs', TensorProto.FLOAT, ['batch', obs_size])],
+        [helper.make_tensor_value_info('actions', TensorProto.FLOAT, ['batch', action_size])],
+        [w1, w2],
+    )
+    return _save(graph, path)
+
+
+def make_walking_policy(path: str | Path, hidden: int = 64, seed: int = 0) -> Path:
+    from onnx import TensorProto, helper, numpy_helper
+    rng = np.random.default_rng(seed)
+    size = sum(n for _, n in WALKING_INPUTS)
+    frame = size - HISTORY_SIZE     # 每帧写入历史缓冲的观测长度
+    w1 = numpy_helper.from_array((rng.standard_normal((size, hidden)) * 0.05).astype(np.float32), 'w1')
+    w2 = numpy_helper.from_array((rng.standard_normal((hidden, 10)) * 0.1).astype(np.float32), 'w2')
+    consts = [
+        numpy_helper.from_array(np.array([0], dtype=np.int64), 'axis0'),
+        numpy_helper.from_array(np.array(0.5, dtype=np.float32), 'scale'),
+        numpy_helper.from_array(np.array([frame], dtype=np.int64), 'history_start'),
+        numpy_helper.from_array(np.array([HISTORY_SIZE], dtype=np.int64), 'history_end'),
+        numpy_helper.from_array(np.array([0], dtype=np.int64), 'frame_start'),
+        numpy_helper.from_array(np.array([frame], dtype=np.int64), 'frame_end'),
+    ]
+    nodes = [
+        helper.make_node('Concat', [name for name, _ in WALKING_INPUTS], ['x'], axis=0),
+        helper.make_node('Unsqueeze', ['x', 'axis0'], ['x2']),
+        helper.make_node('MatMul', ['x2', 'w1'], ['h']),
+        helper.make_node('Tanh', ['h'], ['h1']),
+        helper.make_node('MatMul', ['h1', 'w2'], ['y']),
+        helper.make_node('Squeeze', ['y', 'axis0'], ['y1']),
+        helper.make_node('Tanh', ['y1'], ['actions']),
+        helper.make_node('Mul', ['actions', 'scale'], ['actions_scaled']),
+        # 历史缓冲左移一帧，末尾追加本帧观测
+        helper.make_node('Slice', ['buffer.1', 'history_start', 'history_end'], ['history_tail']),
+        helper.make_node('Slice', ['x', 'frame_start', 'frame_end'], ['frame']),
+        helper.make_node('Concat', ['history_tail', 'frame'], ['x.3'], axis=0),
+    ]
+    graph = helper.make_graph(
+        nodes, 'walking_policy',
+        [helper.make_tensor_value_info(name, TensorProto.FLOAT, [n]) for name, n in WALKING_INPUTS],
+        [
+            helper.make_tensor_value_info('actions_scaled', TensorProto.FLOAT, [10]),
+            helper.make_tensor_value_info('actions', TensorProto.FLOAT, [10]),
+            helper.make_tensor_value_info('x.3', TensorProto.FLOAT, [HISTORY_SIZE]),
+        ],
+        [w1, w2, *consts],
+    )
+    return _save(graph, path)
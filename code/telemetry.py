@@ -0,0 +1,127 @@
+'''
+控制循环遥测记录
+
+每帧一条定长记录(时间戳、观测、动作、电机原始状态、IMU读数)写入预分配的环形缓冲区，
+后台线程按块追加到二进制文件，记录时不做任何文件I/O，也不会阻塞控制帧；缓冲区满时丢弃新记录并计数
+文件格式: 8字节魔数 + 4字节头长度(小端) + JSON头(记录的dtype描述) + 连续的定长记录
+eg:
+recorder = TelemetryRecorder('run.tlm', record_dtype(obs_size=45, action_size=12, joint_count=10))
+recorder.record(t, obs, actions, raw_pos, raw_vel, imu)
+recorder.close()
+data = load_telemetry('run.tlm')    # numpy结构化数组(memmap)，data['obs'].shape == (N, 45)
+记录的长度由策略布局和模型决定，没有默认值；BetterKOS用kos.start_telemetry(path)按当前布局创建
+'''
+
+import json
+import struct
+import threading
+from pathlib import Path
+
+import numpy as np
+
+
+MAGIC = b'KOSTLM1\0'
+
+
+def record_dtype(obs_size: int, action_size: int, joint_count: int) -> np.dtype:
+    '''
+        单条记录的布局
+        timestamp: 单调时钟时间(秒)
+        obs: 策略输入
+        actions: 策略输出
+        raw_pos / raw_vel: 电机原始位置(度)、速度(度/秒)，策略顺序
+        imu: [gyro_x, gyro_y, gyro_z, roll, pitch, yaw]，IMU原始读数(度/秒、度)
+    '''
+    return np.dtype([
+        ('timestamp', '<f8'),
+        ('obs', '<f4', (obs_size,)),
+        ('actions', '<f4', (action_size,)),
+        ('raw_pos', '<f4', (joint_count,)),
+        ('raw_vel', '<f4', (joint_count,)),
+        ('imu', '<f4', (6,)),
+    ])
+
+
+class TelemetryRecorder:
+    '''
+        遥测记录器
+        dtype: 记录的布局，见record_dtype
+        capacity: 环形缓冲区容量(条)，应大于flush_interval内产生的记录数
+        flush_interval: 后台线程写盘间隔(秒)
+    '''
+    def __init__(self, path: str | Path, dtype: np.dtype, capacity: int = 4096, flush_interval: float = 0.5):
+        self.path = Path(path)
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.ring = np.zeros(capacity, dtype=self.dtype)
+        self._fields = {name: self.ring[name] for name in self.dtype.names}
+        self.head = 0       # 已写入缓冲区的记录总数(仅控制线程修改)
+        self.tail = 0       # 已写入文件的记录总数(仅后台线程修改)
+        self.dropped = 0
+        self._file = open(self.path, 'wb')
+        header = json.dumps({'descr': np.lib.format.dtype_to_descr(self.dtype)}).encode()
+        self._file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, name='telemetry-writer', daemon=True)
+        self._thread.start()
+
+    def record(self, timestamp: float, obs, actions, raw_pos, raw_vel, imu):
+        head = self.head
+        if head - self.tail >= self.capacity:
+            self.dropped += 1
+            return
+        i = head % self.capacity
+        fields = self._fields
+        fields['timestamp'][i] = timestamp
+        fields['obs'][i] = obs
+        fields['actions'][i] = actions
+        fields['raw_pos'][i] = raw_pos
+        fields['raw_vel'][i] = raw_vel
+        fields['imu'][i] = imu
+        self.head = head + 1
+
+    def _flush(self):
+        head = self.head
+        tail = self.tail
+        while tail < head:
+            start = tail % self.capacity
+            end = min(start + head - tail, self.capacity)
+            self._file.write(self.ring[start:end].data)
+            tail += end - start
+        self._file.flush()
+        self.tail = tail
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self._flush()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self._flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load_telemetry(path: str | Path) -> np.ndarray:
+    '''
+        以memmap方式读取遥测文件，返回结构化数组；末尾写了一半的记录会被忽略
+    '''
+    path = Path(path)
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'不是遥测文件: {path}')
+        (length,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(length))
+    dtype = np.lib.format.descr_to_dtype([tuple(field) for field in header['descr']])
+    offset = len(MAGIC) + 4 + length
+    count = (path.stat().st_size - offset) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
@@ -0,0 +1,53 @@
+'''
+GravityProjector与scipy Rotation的对比测试
+在code目录下运行: python -m pytest tests
+'''
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from gravity import GravityProjector  # noqa: E402
+
+Rotation = pytest.importorskip('scipy.spatial.transform').Rotation
+
+
+def _quats(samples: int = 10000, seed: int = 0) -> np.ndarray:
+    # 随机四元数(模长不为1)，前4个为单位四元数和绕各轴转180度
+    rng = np.random.default_rng(seed)
+    quats = rng.standard_normal((samples, 4)) * rng.uniform(0.5, 2.0, (samples, 1))
+    quats[:4] = [[0, 0, 0, 1], [1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0]]
+    return quats
+
+
+@pytest.mark.parametrize('order, signs', [
+    ((0, 1, 2), (1, 1, 1)),
+    ((0, 1, 2), (-1, -1, 1)),
+    ((1, 0, 2), (1, -1, -1)),
+])
+def test_matches_scipy(order, signs):
+    quats = _quats()
+    projector = GravityProjector(order, signs)
+    expected = Rotation.from_quat(quats).apply([0.0, 0.0, -1.0], inverse=True)[:, order] * signs
+    out = np.empty(3, dtype=np.float64)
+    error = max(np.abs(projector(*q, out=out) - e).max() for q, e in zip(quats.tolist(), expected))
+    assert error < 1e-12
+
+
+def test_writes_into_out():
+    out = np.zeros(3, dtype=np.float32)
+    assert GravityProjector()(0.0, 0.0, 0.0, 1.0, out=out) is out
+    np.testing.assert_allclose(out, [0.0, 0.0, -1.0])
+
+
+def test_rejects_zero_quaternion():
+    with pytest.raises(ValueError):
+        GravityProjector()(0.0, 0.0, 0.0, 0.0)
+
+
+def test_rejects_invalid_axis_order():
+    with pytest.raises(ValueError):
+        GravityProjector(axis_order=(0, 0, 2))
@@ -0,0 +1,214 @@
+'''
+多关节关键帧轨迹
+
+关键帧(每帧为到达该姿态所用的时长和各关节目标位置)在开始前一次性展开为按固定频率采样的numpy轨迹(每个采样点一行)，
+播放时每个周期只发送一次批量command_actuators，命令字典只构建一次、原地更新位置
+关键帧之间默认按最小加加速度(min-jerk)曲线插值，在关键帧处速度和加速度为0，起停平稳
+eg:
+trajectory = Trajectory.plan(ids, start, [(1.0, pose_a), (0.5, pose_b)], rate=100)
+player = TrajectoryPlayer(kos.actuator, ids, fields={'torque': 0.1})
+result = await player.play(trajectory.raw_positions(signs, zero), rate=100,
+                           on_progress=lambda done, total: print(f'{done}/{total}'))
+或通过BetterKOS: await kos.play_keyframes([(1.0, {31: 20, 34: -40}), (1.0, {31: 0, 34: 0})])
+'''
+
+import asyncio
+import time
+
+import numpy as np
+
+from rate_scheduler import RateScheduler
+
+
+def _linear(s: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    return s, np.ones_like(s)
+
+
+def _cubic(s: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    return s * s * (3 - 2 * s), 6 * s * (1 - s)
+
+
+def _min_jerk(s: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    s2 = s * s
+    return s2 * s * (10 - 15 * s + 6 * s2), 30 * s2 * (1 - s) ** 2
+
+
+# 插值曲线: 归一化时间s∈[0, 1] -> (进度, 进度对s的导数)
+PROFILES = {
+    'linear': _linear,
+    'cubic': _cubic,
+    'min_jerk': _min_jerk,
+}
+# 各曲线的峰值速度与平均速度之比，用于由速度上限计算时长
+PEAK_SPEED = {
+    'linear': 1.0,
+    'cubic': 1.5,
+    'min_jerk': 1.875,
+}
+
+
+class Trajectory:
+    '''
+        按固定频率采样的关节轨迹
+        ids: 电机ID
+        positions / velocities: (采样点数, 关节数)，关节空间的位置(度)和速度(度/秒)
+        第k个采样点对应开始后k/rate秒，最后一个采样点为最后一个关键帧
+    '''
+    def __init__(self, ids, positions: np.ndarray, velocities: np.ndarray, rate: float):
+        self.ids = [int(i) for i in ids]
+        self.positions = positions
+        self.velocities = velocities
+        self.rate = rate
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @property
+    def duration(self) -> float:
+        return (len(self.positions) - 1) / self.rate
+
+    @classmethod
+    def plan(cls, ids, start, keyframes, rate: float = 100, profile: str = 'min_jerk') -> 'Trajectory':
+        '''
+            由起始姿态和关键帧展开轨迹
+            start: 起始位置(度)，顺序与ids一致
+            keyframes: [(时长(秒), 目标位置)]，目标位置为与ids同序的序列，或{电机ID: 位置}(缺少的关节保持上一帧的位置)
+        '''
+        if profile not in PROFILES:
+            raise ValueError(f'未知的插值曲线: {profile}，可选{tuple(PROFILES)}')
+        ids = [int(i) for i in ids]
+        index = {actuator_id: i for i, actuator_id in enumerate(ids)}
+        poses = [np.asarray(start, dtype=np.float64)]
+        durations = []
+        for duration, pose in keyframes:
+            if duration < 0:
+                raise ValueError(f'关键帧时长不能为负: {duration}')
+            target = poses[-1].copy()
+            if isinstance(pose, dict):
+                for actuator_id, position in pose.items():
+                    target[index[int(actuator_id)]] = position
+            else:
+                target[:] = pose
+            poses.append(target)
+            durations.append(float(duration))
+        poses = np.stack(poses)
+        # 关键帧的开始时刻，按采样周期取整，保证每个关键帧都落在采样点上
+        ends = np.round(np.cumsum(durations) * rate).astype(np.int64) if durations else np.zeros(0, dtype=np.int64)
+        starts = np.concatenate(([0], ends[:-1])) if durations else ends
+        total = int(ends[-1]) if durations else 0
+        ticks = np.arange(total + 1)
+        # 每个采样点所在的关键帧段
+        segment = np.clip(np.searchsorted(ends, ticks, side='left'), 0, max(len(durations) - 1, 0))
+        positions = np.repeat(poses[:1], total + 1, axis=0)
+        velocities = np.zeros_like(positions)
+        if durations:
+            length = np.maximum(ends - starts, 1)[segment]
+            s = np.clip((ticks - starts[segment]) / length, 0.0, 1.0)
+            progress, slope = PROFILES[profile](s)
+            delta = poses[1:] - poses[:-1]
+            np.add(poses[segment], delta[segment] * progress[:, None], out=positions)
+            np.multiply(delta[segment], (slope * rate / length)[:, None], out=velocities)
+            # 时长为0的关键帧直接跳到目标
+            positions[ends] = poses[1:]
+        return cls(ids, positions, velocities, rate)
+
+    @classmethod
+    def move_to(cls, ids, start, target, duration: float | None = None, speed: float | None = None,
+                rate: float = 100, profile: str = 'min_jerk') -> 'Trajectory':
+        '''
+            从start平滑移动到target
+            duration为None时按speed(度/秒)计算，使移动最远的关节的峰值速度不超过speed
+        '''
+        if duration is None:
+            if not speed:
+                raise ValueError('需要指定duration或speed')
+            distance = float(np.max(np.abs(np.subtract(target, start)))) if len(start) else 0.0
+            duration = distance / speed * PEAK_SPEED[profile]
+        return cls.plan(ids, start, [(duration, target)], rate, profile)
+
+    def raw_positions(self, signs: np.ndarray, zero: np.ndarray) -> np.ndarray:
+        '''
+            关节空间位置 -> 电机原始位置(度，乘方向、加零位并回绕到(-180, 180])，一次算出全部采样点
+        '''
+        raw = self.positions * signs
+        raw += zero
+        np.remainder(raw, 360, out=raw)
+        np.subtract(raw, 360, out=raw, where=raw > 180)
+        return raw
+
+    def raw_velocities(self, signs: np.ndarray) -> np.ndarray:
+        return self.velocities * signs
+
+
+class TrajectoryPlayer:
+    '''
+        以固定频率播放预先算好的电机原始位置，每个周期一次批量command_actuators
+        actuator: ActuatorServiceClient
+        ids: 电机ID，顺序与轨迹的列一致
+        fields: 每条命令附带的固定字段，例如{'torque': 0.1}
+        同一时间只播放一条轨迹；cancel()后在下一个周期停止，电机停在最后一次下发的位置
+    '''
+    def __init__(self, actuator, ids, fields: dict | None = None):
+        self.actuator = actuator
+        self.ids = [int(i) for i in ids]
+        self._commands = [{'actuator_id': actuator_id, 'position': 0.0, **(fields or {})} for actuator_id in self.ids]
+        self._cancelled = False
+        self._task: asyncio.Task | None = None
+        self.scheduler: RateScheduler | None = None
+
+    async def play(self, positions: np.ndarray, rate: float = 100, velocities: np.ndarray | None = None,
+                   on_progress=None) -> dict:
+        '''
+            positions / velocities: (采样点数, 关节数)的电机原始位置(度)和速度(度/秒)，velocities为None时不下发速度
+            on_progress(done, total): 每个周期下发后调用，done为已播放到的采样点数
+            下发超时(落后于调度)时按实际时间跳过错过的采样点，结束时间不变；最后一个采样点总会下发
+            返回{'completed': 是否播放完成, 'ticks': 采样点数, 'rpcs': RPC次数, 'skipped': 跳过的采样点数, 'elapsed': 耗时}
+        '''
+        total = len(positions)
+        if positions.ndim != 2 or positions.shape[1] != len(self.ids):
+            raise ValueError(f'轨迹形状{positions.shape}与电机数{len(self.ids)}不一致')
+        commands = self._commands
+        self._cancelled = False
+        self.scheduler = scheduler = RateScheduler(rate)
+        rpcs = 0
+        index = 0
+        start = time.monotonic()
+        if total:
+            async for _ in scheduler:
+                if self._cancelled:
+                    break
+                index = min(scheduler.steps, total - 1)
+                for command, position in zip(commands, positions[index].tolist()):
+                    command['position'] = position
+                if velocities is not None:
+                    for command, velocity in zip(commands, velocities[index].tolist()):
+                        command['velocity'] = velocity
+                await self.actuator.command_actuators(commands)
+                rpcs += 1
+                if on_progress is not None:
+                    on_progress(index + 1, total)
+                if index == total - 1:
+                    break
+        completed = total == 0 or (not self._cancelled and index == total - 1)
+        return {
+            'completed': completed,
+            'ticks': total,
+            'rpcs': rpcs,
+            'skipped': index + 1 - rpcs if total else 0,
+            'elapsed': time.monotonic() - start,
+        }
+
+    def start(self, positions: np.ndarray, rate: float = 100, velocities: np.ndarray | None = None,
+              on_progress=None) -> asyncio.Task:
+        # 在后台任务中播放，返回的任务结果与play相同
+        if self._task is not None and not self._task.done():
+            raise RuntimeError('上一条轨迹还在播放')
+        self._task = asyncio.create_task(self.play(positions, rate, velocities, on_progress))
+        return self._task
+
+    def cancel(self):
+        self._cancelled = True
+
+    @property
+    def playing(self) -> bool:
+        return self._task is not None and not self._task.done()